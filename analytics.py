@@ -0,0 +1,198 @@
+"""
+Cohort analytics for the admin dashboard.
+
+Each table is read once as column arrays (one values_list query for the
+students, one per preference and allocation table, one per course table)
+and everything else is NumPy group-bys over integer codes:
+
+    demand       per course, how many students ranked it at each preference
+                 number, next to its capacity
+    outcomes     how far down their list students ended up: preference
+                 number used, auto-allocated or nothing
+    cutoffs      per course, the lowest percentage among the students
+                 allocated to it, and whether it filled up
+    departments  the outcome distribution and seats per course, by department
+
+Given a cohort (by id), only its students, courses, preferences and
+allocations are read: cohorts never compete for seats, so their figures
+are only meaningful one cohort at a time.
+
+The result is cached under the latest allocation run, the latest seat
+release and the dashboard cache generation (bumped by allocation writes,
+course changes and student imports), one entry per cohort, so it is computed once per change
+rather than per request. Preferences submitted after a run show up once
+the entry is recomputed: at the next run or after ANALYTICS_TIMEOUT.
+"""
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import dashboard_cache, engine
+from .models import AllocationRun, SeatRelease, Student
+
+
+KEY = 'allotment:analytics:{cohort}:{version}'
+ANALYTICS_TIMEOUT = 10 * 60
+
+PHASE_LABELS = {'minor1': 'Minor 1', 'minor2': 'Minor 2', 'oe': 'Open Elective'}
+
+# Outcome codes after the preference numbers 1..R
+AUTO = 'auto'
+NONE = 'none'
+
+
+# -------------------------
+# Loading
+# -------------------------
+def _columns(queryset, fields, dtype=np.int64):
+    """`fields` of every row of `queryset` as one array per field."""
+    rows = np.array(list(queryset.values_list(*fields)), dtype=dtype).reshape(-1, len(fields))
+    return rows.T
+
+
+def _students(cohort=None):
+    rows = list(
+        engine.in_cohort(Student.objects.all(), cohort).order_by('pk').values_list('id', 'department', 'percentage')
+    )
+    ids, departments, percentages = zip(*rows) if rows else ((), (), ())
+    names, codes = np.unique(np.array(departments, dtype=str), return_inverse=True)
+    return (
+        np.array(ids, dtype=np.int64),
+        names.tolist(),
+        codes.reshape(-1).astype(np.int64),
+        np.array(percentages, dtype=np.float64),
+    )
+
+
+def _courses(model, cohort=None):
+    rows = list(engine.in_cohort(model.objects.all(), cohort).order_by('pk').values_list('id', 'name', 'capacity'))
+    ids, names, capacities = zip(*rows) if rows else ((), (), ())
+    return np.array(ids, dtype=np.int64), list(names), np.array(capacities, dtype=np.int64)
+
+
+def _lookup(sorted_ids, ids):
+    """Positions of `ids` in `sorted_ids`, and a mask of the ones found."""
+    positions = np.searchsorted(sorted_ids, ids)
+    positions[positions == len(sorted_ids)] = 0
+    found = sorted_ids[positions] == ids if len(sorted_ids) else np.zeros(len(ids), dtype=bool)
+    return positions, found
+
+
+# -------------------------
+# Computing
+# -------------------------
+def _phase(spec, students, courses, cohort=None):
+    student_ids, departments, department_codes, percentages = students
+    course_ids, course_names, capacities = courses
+    n, c, d = len(student_ids), len(course_ids), len(departments)
+
+    pref_student, pref_course, priority = _columns(
+        engine.in_cohort(spec.preference_model.objects.all(), cohort, 'student__'),
+        ('student_id', f'{spec.course_field}_id', 'priority'),
+    )
+    alloc_student, alloc_course = _columns(
+        engine.in_cohort(spec.allocation_model.objects.all(), cohort, 'student__'),
+        ('student_id', f'{spec.course_field}_id'),
+    )
+
+    p_student, p_found = _lookup(student_ids, pref_student)
+    p_course, c_found = _lookup(course_ids, pref_course)
+    keep = p_found & c_found & (priority > 0)
+    p_student, p_course, priority = p_student[keep], p_course[keep], priority[keep]
+    ranks = int(priority.max()) if len(priority) else 0
+
+    a_student, a_found = _lookup(student_ids, alloc_student)
+    a_course, ac_found = _lookup(course_ids, alloc_course)
+    keep = a_found & ac_found
+    a_student, a_course = a_student[keep], a_course[keep]
+
+    # Demand: students ranking each course at each preference number
+    demand = np.bincount(p_course * ranks + (priority - 1), minlength=c * ranks).reshape(c, ranks)
+
+    # Outcome per student: 0..R-1 for preference numbers 1..R, R for an
+    # auto-allocated seat, R + 1 for no seat. The preference number used is
+    # found by matching (student, course) keys; a course listed twice
+    # counts at its best number
+    outcome = np.full(n, ranks + 1, dtype=np.int64)
+    outcome[a_student] = ranks
+    if len(priority) and len(a_student):
+        pref_keys = p_student * c + p_course
+        order = np.lexsort((priority, pref_keys))
+        pref_keys, best = np.unique(pref_keys[order], return_index=True)
+        best_priority = priority[order][best]
+        positions, found = _lookup(pref_keys, a_student * c + a_course)
+        outcome[a_student[found]] = best_priority[positions[found]] - 1
+    codes = ranks + 2
+
+    filled = np.bincount(a_course, minlength=c)
+    cutoff = np.full(c, np.inf)
+    np.minimum.at(cutoff, a_course, percentages[a_student])
+
+    by_department = np.bincount(department_codes * codes + outcome, minlength=d * codes).reshape(d, codes)
+    seats_by_department = np.bincount(
+        department_codes[a_student] * c + a_course, minlength=d * c
+    ).reshape(d, c)
+
+    return {
+        'label': PHASE_LABELS[spec.name],
+        'ranks': ranks,
+        'outcome_labels': [f'#{rank}' for rank in range(1, ranks + 1)] + [AUTO, NONE],
+        'allocated': int(len(a_student)),
+        'unallocated': int(n - len(np.unique(a_student))),
+        'outcomes': np.bincount(outcome, minlength=codes).tolist(),
+        'courses': [
+            {
+                'id': int(course_ids[j]),
+                'name': course_names[j],
+                'capacity': int(capacities[j]),
+                'filled': int(filled[j]),
+                'full': bool(filled[j] >= capacities[j]),
+                'demand': demand[j].tolist(),
+                'cutoff': round(float(cutoff[j]), 2) if np.isfinite(cutoff[j]) else None,
+                'by_department': seats_by_department[:, j].tolist(),
+            }
+            for j in range(c)
+        ],
+        'departments': [
+            {'department': departments[k], 'students': int(by_department[k].sum()), 'outcomes': by_department[k].tolist()}
+            for k in range(d)
+        ],
+    }
+
+
+def compute(cohort=None):
+    """Analytics of the current preferences and allocations (of `cohort`; not cached)."""
+    students = _students(cohort)
+    minor_courses = _courses(engine.MINOR1.course_model, cohort)
+    oe_courses = _courses(engine.OE.course_model, cohort)
+    return {
+        'generated_at': timezone.now().isoformat(),
+        'students': int(len(students[0])),
+        'departments': students[1],
+        'phases': {
+            'minor1': _phase(engine.MINOR1, students, minor_courses, cohort),
+            'minor2': _phase(engine.MINOR2, students, minor_courses, cohort),
+            'oe': _phase(engine.OE, students, oe_courses, cohort),
+        },
+    }
+
+
+# -------------------------
+# Caching
+# -------------------------
+def version():
+    """What the cached analytics depend on, as a cache key fragment."""
+    run_id = AllocationRun.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    release = SeatRelease.objects.order_by('-pk').values_list('pk', 'processed_at').first()
+    release_part = f'{release[0]}{"p" if release[1] else ""}' if release else '0'
+    return f'{run_id}-{release_part}-{dashboard_cache.generation()}'
+
+
+def cohort_analytics(cohort=None):
+    """compute(cohort), cached until the next run, seat release or bulk change."""
+    key = KEY.format(cohort=cohort if cohort is not None else 'all', version=version())
+    result = cache.get(key)
+    if result is None:
+        result = compute(cohort)
+        cache.set(key, result, timeout=ANALYTICS_TIMEOUT)
+    return result
@@ -0,0 +1,7 @@
+"""
+Read-only JSON API for the timetable and LMS integrations (/api/v1/).
+
+Admin accounts only, with session or HTTP Basic auth. Lists use cursor
+pagination on the primary key (?page_size= up to 10000), so paging stays
+cheap however deep a client goes and is stable while rows are added.
+"""
@@ -0,0 +1,38 @@
+"""
+Serializers for bulk listing.
+
+The viewsets read plain dicts with .values() and fill in related data per
+page, so the serializers only shape those dicts: no model instances and
+no per-field serializer objects.
+"""
+from rest_framework import serializers
+
+
+class RowSerializer(serializers.BaseSerializer):
+    """Output `fields` of a row dict, in that order."""
+    fields = ()
+
+    def to_representation(self, row):
+        return {field: row[field] for field in self.fields}
+
+
+class StudentSerializer(RowSerializer):
+    fields = ('id', 'roll_no', 'name', 'department', 'percentage', 'email')
+
+
+class MinorBranchSerializer(RowSerializer):
+    fields = ('id', 'name', 'capacity', 'offering_dept', 'restricted_dept')
+
+
+class OpenElectiveSerializer(RowSerializer):
+    fields = ('id', 'name', 'capacity', 'offering_dept')
+
+
+class PreferenceSerializer(RowSerializer):
+    # minor1 / minor2 / oe: course ids in priority order
+    fields = ('student', 'roll_no', 'version', 'minor1', 'minor2', 'oe')
+
+
+class AllocationSerializer(RowSerializer):
+    # minor1 / minor2 / oe: {"id", "name"} of the course, or null
+    fields = ('student', 'roll_no', 'minor1', 'minor2', 'oe')
@@ -0,0 +1,13 @@
+from rest_framework.routers import SimpleRouter
+
+from . import views
+
+
+router = SimpleRouter()
+router.register('students', views.StudentViewSet, basename='api-student')
+router.register('courses/minor', views.MinorBranchViewSet, basename='api-minor-branch')
+router.register('courses/oe', views.OpenElectiveViewSet, basename='api-open-elective')
+router.register('preferences', views.PreferenceViewSet, basename='api-preference')
+router.register('allocations', views.AllocationViewSet, basename='api-allocation')
+
+urlpatterns = router.urls
@@ -0,0 +1,206 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import viewsets
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from allotment.models import (
+    Student, MinorBranch, OpenElective, PreferenceSubmission,
+    AllocationRun, SeatRelease,
+)
+from allotment.preferences import CATEGORIES
+from allotment.waitlist import PHASES
+
+from . import serializers
+
+
+class IdCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size = 500
+    page_size_query_param = 'page_size'
+    max_page_size = 10000
+
+
+class ReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    List and retrieve over a .values() queryset. Subclasses can add data
+    to each page in `hydrate(rows)` and make responses conditional with
+    `version()`.
+    """
+    authentication_classes = [SessionAuthentication, BasicAuthentication]
+    permission_classes = [IsAdminUser]
+    renderer_classes = [JSONRenderer]
+    pagination_class = IdCursorPagination
+    fields = ()
+
+    def get_queryset(self):
+        return self.model.objects.order_by('id').values(*self.fields)
+
+    def hydrate(self, rows):
+        return rows
+
+    def version(self):
+        """(ETag, last modified datetime or None) of the data, or None."""
+        return None
+
+    def students_version(self):
+        """
+        Count and highest id of the students, for the ETag of lists with a
+        row per student: imports and deletions leave no timestamp behind.
+        """
+        students = Student.objects.aggregate(count=Count('id'), last=Max('id'))
+        return f'{students["count"]}-{students["last"] or 0}'
+
+    def _conditional(self, request, build):
+        version = self.version()
+        if version is None:
+            return build()
+        etag, last_modified = version
+        # HTTP dates have whole seconds; a fraction would never match If-Modified-Since
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if not_modified is not None:
+            return not_modified
+        response = build()
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        def build():
+            page = self.paginate_queryset(self.get_queryset())
+            data = self.get_serializer(self.hydrate(page), many=True).data
+            return self.get_paginated_response(data)
+        return self._conditional(request, build)
+
+    def retrieve(self, request, *args, **kwargs):
+        def build():
+            row = self.hydrate([self.get_object()])[0]
+            return Response(self.get_serializer(row).data)
+        return self._conditional(request, build)
+
+
+class StudentViewSet(ReadOnlyViewSet):
+    model = Student
+    fields = serializers.StudentSerializer.fields
+    serializer_class = serializers.StudentSerializer
+
+    def get_queryset(self):
+        students = super().get_queryset()
+        department = self.request.query_params.get('department')
+        return students.filter(department=department) if department else students
+
+
+class MinorBranchViewSet(ReadOnlyViewSet):
+    model = MinorBranch
+    fields = serializers.MinorBranchSerializer.fields
+    serializer_class = serializers.MinorBranchSerializer
+
+
+class OpenElectiveViewSet(ReadOnlyViewSet):
+    model = OpenElective
+    fields = serializers.OpenElectiveSerializer.fields
+    serializer_class = serializers.OpenElectiveSerializer
+
+
+class PreferenceViewSet(StudentViewSet):
+    """A student's three ranked lists; `student` is the student id."""
+    fields = ('id', 'roll_no')
+    serializer_class = serializers.PreferenceSerializer
+
+    def hydrate(self, rows):
+        ids = [row['id'] for row in rows]
+        # Pages are id-ordered: a range scan beats a 10000-item IN list
+        in_page = {'student_id__gte': min(ids, default=0), 'student_id__lte': max(ids, default=0)}
+        versions = dict(
+            PreferenceSubmission.objects.filter(**in_page).values_list('student_id', 'version')
+        )
+        lists = {category: defaultdict(list) for category in CATEGORIES}
+        for category, (model, course_field, _) in CATEGORIES.items():
+            for student_id, course_id in model.objects.filter(**in_page).order_by(
+                'student_id', 'priority', 'pk'
+            ).values_list('student_id', f'{course_field}_id'):
+                lists[category][student_id].append(course_id)
+
+        return [
+            {
+                'student': row['id'],
+                'roll_no': row['roll_no'],
+                'version': versions.get(row['id'], 0),
+                **{category: lists[category].get(row['id'], []) for category in CATEGORIES},
+            }
+            for row in rows
+        ]
+
+    def version(self):
+        latest = PreferenceSubmission.objects.aggregate(count=Count('id'), updated=Max('updated_at'))
+        stamp = latest['updated'].timestamp() if latest['updated'] else 0
+        return f'"preferences-{self.students_version()}-{latest["count"]}-{stamp}"', latest['updated']
+
+
+class AllocationViewSet(StudentViewSet):
+    """A student's three allocations; `student` is the student id."""
+    fields = ('id', 'roll_no')
+    serializer_class = serializers.AllocationSerializer
+
+    def hydrate(self, rows):
+        ids = [row['id'] for row in rows]
+        in_page = {'student_id__gte': min(ids, default=0), 'student_id__lte': max(ids, default=0)}
+        names = {
+            'minor': dict(MinorBranch.objects.values_list('id', 'name')),
+            'oe': dict(OpenElective.objects.values_list('id', 'name')),
+        }
+        allocated = {}
+        for phase, spec in PHASES.items():
+            allocated[phase] = dict(
+                spec.allocation_model.objects.filter(**in_page)
+                .values_list('student_id', f'{spec.course_field}_id')
+            )
+
+        def course(phase, student_id):
+            course_id = allocated[phase].get(student_id)
+            if course_id is None:
+                return None
+            return {'id': course_id, 'name': names['oe' if phase == 'oe' else 'minor'].get(course_id)}
+
+        return [
+            {
+                'student': row['id'],
+                'roll_no': row['roll_no'],
+                **{phase: course(phase, row['id']) for phase in PHASES},
+            }
+            for row in rows
+        ]
+
+    def version(self):
+        """
+        Allocations only change through runs, seat releases and backfills;
+        the rows also follow student imports and deletions.
+        """
+        run = AllocationRun.objects.order_by('-pk').values('pk', 'started_at', 'duration').first()
+        processed = SeatRelease.objects.filter(processed_at__isnull=False).order_by('-processed_at').values(
+            'pk', 'processed_at'
+        ).first()
+        # Pending releases too: creating or deleting one changes allocations before any backfill
+        releases = SeatRelease.objects.aggregate(count=Count('id'), last=Max('id'), created=Max('created_at'))
+
+        stamps = []
+        if run is not None:
+            stamps.append(run['started_at'] + timedelta(seconds=run['duration']))
+        if processed is not None:
+            stamps.append(processed['processed_at'])
+        if releases['created'] is not None:
+            stamps.append(releases['created'])
+        etag = (
+            f'"allocations-{self.students_version()}-{run["pk"] if run else 0}'
+            f'-{processed["pk"] if processed else 0}-{releases["count"]}-{releases["last"] or 0}"'
+        )
+        return etag, max(stamps, default=None)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class AllotmentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'allotment'
+
+    def ready(self):
+        # Registers the signal handlers that drop cached eligibility
+        # predicates and cached student dashboard data
+        from . import eligibility  # noqa: F401
+        from . import dashboard_cache  # noqa: F401
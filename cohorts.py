@@ -0,0 +1,108 @@
+"""
+Cohorts: independent partitions of one deployment.
+
+A Cohort is one programme and academic year. Students and courses join it
+through CohortStudent, CohortMinorBranch and CohortOpenElective (each
+reachable as `cohort_link`); preferences, rules and allocations follow
+their student or course. Given a `cohort`, the runners in utils load,
+allocate and replace only that cohort's rows, in a transaction of their
+own, and keep its run history and waitlists apart.
+
+Cohorts never compete for seats, so run_cohorts() allocates them side by
+side: one Minor 1 -> Minor 2 -> OE run (utils.run_all_allocations) per
+cohort in a forked process pool, each worker on its own database
+connection. Total time then follows the largest cohort rather than the
+sum of all of them, as long as there are cores (and database
+connections) to go round. That needs a database that takes concurrent
+writers, such as PostgreSQL; on SQLite, which locks the whole file for
+every write, the cohorts run one after the other. So they do inside a
+Celery prefork child (the 'cohorts' allocation job), which may not start
+processes of its own.
+
+Once cohorts are defined, every student and course is expected to belong
+to one, and allocation runs go through run_cohorts() (the admin
+dashboard offers no other; see has_cohorts()).
+"""
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.db import connection, connections
+
+from . import engine, utils
+from .models import Cohort
+
+
+CohortResult = namedtuple('CohortResult', ['code', 'message', 'seconds', 'failed'])
+
+
+def _run(cohort_id, strategy):
+    started = time.perf_counter()
+    try:
+        message, failed = utils.run_all_allocations(strategy=strategy, cohort=cohort_id), False
+    except Exception as e:
+        message, failed = f"Allocation failed: {e}", True
+    return message, time.perf_counter() - started, failed
+
+
+def _run_in_worker(cohort_id, strategy):
+    try:
+        return _run(cohort_id, strategy)
+    finally:
+        connections.close_all()
+
+
+def has_cohorts():
+    return Cohort.objects.exists()
+
+
+def can_run_in_parallel():
+    return (
+        connection.vendor != 'sqlite'
+        and 'fork' in multiprocessing.get_all_start_methods()
+        and not multiprocessing.current_process().daemon
+    )
+
+
+def run_cohorts(cohort_ids=None, strategy=None, workers=None, progress=engine.no_progress):
+    """
+    Allocate every cohort (or those in `cohort_ids`), in parallel where
+    the database allows. A failing cohort doesn't stop the others.
+    Returns one CohortResult per cohort, in code order.
+    """
+    cohorts = Cohort.objects.all()
+    if cohort_ids is not None:
+        cohorts = cohorts.filter(pk__in=cohort_ids)
+    todo = list(cohorts.values_list('pk', 'code'))
+    codes = dict(todo)
+    total = len(todo)
+    progress('cohorts', 0, total)
+
+    results = {}
+    workers = min(total, workers or os.cpu_count() or 1)
+    if workers <= 1 or not can_run_in_parallel():
+        for done, (pk, _) in enumerate(todo, start=1):
+            results[pk] = _run(pk, strategy)
+            progress('cohorts', done, total)
+    else:
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {pool.submit(_run_in_worker, pk, strategy): pk for pk, _ in todo}
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                progress('cohorts', done, total)
+
+    return [CohortResult(codes[pk], *results[pk]) for pk, _ in todo]
+
+
+def run_all_cohorts(progress=engine.no_progress, strategy=None):
+    """Runner for AllocationJob kind 'cohorts' (see tasks.RUNNERS)."""
+    results = run_cohorts(strategy=strategy, progress=progress)
+    failed = [r for r in results if r.failed]
+    if failed:
+        raise RuntimeError('; '.join(f"{r.code}: {r.message}" for r in failed))
+    return f"Allocation completed for {len(results)} cohort(s)."
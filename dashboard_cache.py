@@ -0,0 +1,228 @@
+"""
+Cached data for the student dashboard.
+
+Three entries live in the configured cache backend:
+
+* a snapshot per student (profile, cohort, the three allocations with their course,
+  the three preference lists and their version), keyed by user id and a generation number;
+* the course catalog (id and name of every minor branch and OE) per cohort,
+  shared by its students, and one of every course for students in none;
+* the current preference window.
+
+A warm dashboard load therefore needs no database query at all. A student's
+snapshot is dropped when they submit preferences; bumping the generation
+drops every snapshot at once (allocation runs, course changes). Course and
+window changes are caught by the signal receivers at the bottom, since the
+course and window views all go through save()/delete(), as do changes
+to cohort membership made in the Django admin.
+
+Hits and misses are counted per entry in the cache backend (see stats()).
+"""
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import (
+    PreferenceSubmission, Student, MinorBranch, OpenElective, PreferenceWindow,
+    Cohort, CohortStudent, CohortMinorBranch, CohortOpenElective,
+    MinorPreference, DoubleMinorPreference, OEPreference,
+    MinorAllocation, DoubleMinorAllocation, OEAllocation,
+)
+
+
+GENERATION_KEY = 'allotment:dashboard-generation'
+CATALOG_KEY = 'allotment:course-catalog:{cohort}'
+WINDOW_KEY = 'allotment:preference-window'
+STATS_KEY = 'allotment:dashboard-cache:{name}:{outcome}'
+STATS_NAMES = ('snapshot', 'catalog', 'window')
+
+# Snapshots also expire on their own, so students who stop visiting
+# don't keep entries around forever
+SNAPSHOT_TIMEOUT = 60 * 60
+
+_MISSING = object()
+
+
+# -------------------------
+# Hit / miss counters
+# -------------------------
+def _count(name, outcome):
+    key = STATS_KEY.format(name=name, outcome=outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Missing: create it without overwriting a concurrent first increment
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def stats():
+    """{name: {'hits': n, 'misses': n}} for 'snapshot', 'catalog' and 'window'."""
+    keys = {
+        (name, outcome): STATS_KEY.format(name=name, outcome=outcome)
+        for name in STATS_NAMES for outcome in ('hits', 'misses')
+    }
+    values = cache.get_many(keys.values())
+    return {
+        name: {outcome: values.get(keys[name, outcome], 0) for outcome in ('hits', 'misses')}
+        for name in STATS_NAMES
+    }
+
+
+def _cached(name, key, build, timeout=None):
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        _count(name, 'hits')
+        return value
+    _count(name, 'misses')
+    value = build()
+    cache.set(key, value, timeout=timeout)
+    return value
+
+
+# -------------------------
+# Snapshots
+# -------------------------
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def generation():
+    """The current snapshot generation; invalidate_students() moves it on."""
+    return _generation()
+
+
+def _snapshot_key(user_id):
+    return f'allotment:student-dashboard:{_generation()}:{user_id}'
+
+
+def current_version(student):
+    return (
+        PreferenceSubmission.objects.filter(student=student)
+        .values_list('version', flat=True).first()
+    ) or 0
+
+
+def student_cohort_id(student):
+    """Id of the student's cohort, or None."""
+    return CohortStudent.objects.filter(student=student).values_list('cohort_id', flat=True).first()
+
+
+def _build_snapshot(user_id):
+    student = Student.objects.filter(user_id=user_id).first()
+    if student is None:
+        return None
+
+    def allocation(model, course_field):
+        return model.objects.filter(student=student).select_related(course_field).first()
+
+    def preferences(model, course_field):
+        return list(
+            model.objects.filter(student=student)
+            .select_related(course_field).order_by('priority')
+        )
+
+    return {
+        'student': student,
+        'cohort_id': student_cohort_id(student),
+        'preference_version': current_version(student),
+        'minor1_allocation': allocation(MinorAllocation, 'minor_branch'),
+        'minor2_allocation': allocation(DoubleMinorAllocation, 'minor_branch'),
+        'oe_allocation': allocation(OEAllocation, 'oe_subject'),
+        'selected_m1_prefs': preferences(MinorPreference, 'minor_branch'),
+        'selected_m2_prefs': preferences(DoubleMinorPreference, 'minor_branch'),
+        'selected_oe_prefs': preferences(OEPreference, 'oe_subject'),
+    }
+
+
+def student_snapshot(user_id):
+    """
+    Dashboard data of the student behind `user_id`, or None if that user
+    has no Student profile.
+    """
+    return _cached(
+        'snapshot', _snapshot_key(user_id),
+        lambda: _build_snapshot(user_id), timeout=SNAPSHOT_TIMEOUT,
+    )
+
+
+def invalidate_student(user_id):
+    """Drop one student's snapshot (after they change their preferences)."""
+    cache.delete(_snapshot_key(user_id))
+
+
+def invalidate_students():
+    """Drop every student's snapshot (after an allocation run)."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, timeout=None)
+
+
+# -------------------------
+# Course catalog and window
+# -------------------------
+def course_catalog(cohort_id=None):
+    """
+    {'minor': [{'id', 'name'}, ...], 'oe': [...]} for every course of the
+    cohort, or for every course at all without one.
+    """
+    def build():
+        minor, oe = MinorBranch.objects.all(), OpenElective.objects.all()
+        if cohort_id is not None:
+            minor = minor.filter(cohort_link__cohort=cohort_id)
+            oe = oe.filter(cohort_link__cohort=cohort_id)
+        return {
+            'minor': list(minor.order_by('id').values('id', 'name')),
+            'oe': list(oe.order_by('id').values('id', 'name')),
+        }
+
+    return _cached('catalog', CATALOG_KEY.format(cohort=cohort_id or 'all'), build)
+
+
+def _drop_catalogs():
+    cache.delete_many([
+        CATALOG_KEY.format(cohort=cohort)
+        for cohort in ['all', *Cohort.objects.values_list('pk', flat=True)]
+    ])
+
+
+def current_window():
+    """The latest PreferenceWindow, or None."""
+    return _cached('window', WINDOW_KEY, lambda: PreferenceWindow.objects.order_by('-id').first())
+
+
+@receiver(post_save, sender=MinorBranch)
+@receiver(post_delete, sender=MinorBranch)
+@receiver(post_save, sender=OpenElective)
+@receiver(post_delete, sender=OpenElective)
+def _course_changed(sender, **kwargs):
+    # Course names also appear in snapshots (allocations, preferences)
+    _drop_catalogs()
+    invalidate_students()
+
+
+@receiver(post_save, sender=CohortMinorBranch)
+@receiver(post_delete, sender=CohortMinorBranch)
+@receiver(post_save, sender=CohortOpenElective)
+@receiver(post_delete, sender=CohortOpenElective)
+def _course_cohort_changed(sender, instance, **kwargs):
+    _drop_catalogs()
+    # A deleted cohort is no longer listed by _drop_catalogs
+    cache.delete(CATALOG_KEY.format(cohort=instance.cohort_id))
+
+
+@receiver(post_save, sender=CohortStudent)
+@receiver(post_delete, sender=CohortStudent)
+def _student_cohort_changed(sender, **kwargs):
+    invalidate_students()
+
+
+@receiver(post_save, sender=PreferenceWindow)
+@receiver(post_delete, sender=PreferenceWindow)
+def _window_changed(sender, **kwargs):
+    cache.delete(WINDOW_KEY)
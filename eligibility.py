@@ -0,0 +1,181 @@
+"""
+Compiled eligibility rules.
+
+The active EligibilityRule / OEEligibilityRule rows of a course are turned
+once into a CompiledRules predicate (a percentage threshold and a frozenset
+of blocked departments). Predicates are cached per branch and per OE in this
+process and dropped whenever a rule is saved or deleted. A version counter
+in the cache backend lets other workers notice the change too.
+
+A predicate can check one student, or a whole cohort at once with NumPy,
+giving a boolean eligibility mask per course. Both compare percentages in
+whole hundredths, so a threshold like 60.1 means the same to either.
+"""
+import math
+from decimal import Decimal, ROUND_CEILING
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import EligibilityRule, OEEligibilityRule
+
+
+RULES_VERSION_KEY = 'allotment:eligibility-rules-version'
+
+# (rule model, course id) -> CompiledRules
+_compiled = {}
+_compiled_version = None
+
+
+def hundredths(percentage) -> int:
+    """
+    `percentage` (a Decimal, float or int) in whole hundredths, rounded up.
+
+    Student percentages have two decimal places (the registration form and
+    the import allow no more), so they convert exactly. A threshold is read
+    as written (60.1, not the float just above it), and one with more
+    places rounds up, which keeps "below the threshold" unchanged.
+    """
+    return int(Decimal(str(percentage)).scaleb(2).to_integral_value(ROUND_CEILING))
+
+
+class CompiledRules:
+    """All active rules of one course folded into a single predicate."""
+
+    __slots__ = ('min_percentage', 'blocked_departments')
+
+    def __init__(self, rules=()):
+        min_percentage = None
+        blocked = set()
+
+        for rule in rules:
+            rtype = rule.rule_type
+            data = rule.value or {}
+
+            # 1) Minimum percentage rule → keep the strictest threshold
+            if rtype == "MIN_PERCENTAGE":
+                min_pct = data.get("min_percentage")
+                if min_pct is not None:
+                    try:
+                        min_pct = float(min_pct)
+                    except (TypeError, ValueError):
+                        # bad config → skip so we don't block allocation
+                        continue
+                    if not math.isfinite(min_pct):
+                        continue
+                    if min_percentage is None or min_pct > min_percentage:
+                        min_percentage = min_pct
+
+            # 2) Blocked departments rule → normalize to upper-case strings
+            elif rtype == "DEPARTMENT_BLOCK":
+                blocked_depts = data.get("blocked_departments", [])
+                blocked.update(str(d).upper().strip() for d in blocked_depts if str(d).strip())
+
+        self.min_percentage = min_percentage
+        self.blocked_departments = frozenset(blocked)
+
+    def below_minimum(self, percentage) -> bool:
+        """Whether `percentage` fails the minimum percentage rule."""
+        return self.min_percentage is not None and hundredths(percentage) < hundredths(self.min_percentage)
+
+    def __call__(self, student) -> bool:
+        if self.below_minimum(student.percentage):
+            return False
+        if self.blocked_departments and (student.department or "").upper() in self.blocked_departments:
+            return False
+        return True
+
+    def mask(self, columns) -> np.ndarray:
+        """Boolean eligibility of every student in `columns` (a StudentColumns)."""
+        eligible = np.ones(len(columns.percentages), dtype=bool)
+        if self.min_percentage is not None:
+            eligible &= ~(columns.percentages < hundredths(self.min_percentage))
+        if self.blocked_departments:
+            codes = [columns.department_codes[d] for d in self.blocked_departments
+                     if d in columns.department_codes]
+            if codes:
+                eligible &= ~np.isin(columns.departments, codes)
+        return eligible
+
+
+class StudentColumns:
+    """Percentage (in hundredths) and department-code columns for a list of students."""
+
+    def __init__(self, students):
+        self.department_codes = {}
+        departments = []
+        for student in students:
+            dept = (student.department or "").upper()
+            departments.append(self.department_codes.setdefault(dept, len(self.department_codes)))
+
+        self.percentages = np.fromiter(
+            (hundredths(s.percentage) for s in students), dtype=np.int64, count=len(students)
+        )
+        self.departments = np.asarray(departments, dtype=np.int32)
+
+
+# -------------------------
+# Per-course cache
+# -------------------------
+def _rules_version():
+    version = cache.get(RULES_VERSION_KEY)
+    if version is None:
+        cache.add(RULES_VERSION_KEY, 1, timeout=None)
+        version = cache.get(RULES_VERSION_KEY, 1)
+    return version
+
+
+def _sync_cache():
+    """Drop this process's predicates if another process changed a rule."""
+    global _compiled_version
+    version = _rules_version()
+    if version != _compiled_version:
+        _compiled.clear()
+        _compiled_version = version
+
+
+def invalidate_rules():
+    """Forget every compiled predicate, here and in other workers."""
+    _compiled.clear()
+    try:
+        cache.incr(RULES_VERSION_KEY)
+    except ValueError:
+        cache.set(RULES_VERSION_KEY, 1, timeout=None)
+
+
+def compiled_rules(rule_model, course_field, course_ids):
+    """
+    course_id -> CompiledRules for every id in `course_ids`, loading the
+    active rules of all uncached courses in one query.
+    """
+    _sync_cache()
+    missing = [cid for cid in course_ids if (rule_model, cid) not in _compiled]
+    if missing:
+        grouped = {cid: [] for cid in missing}
+        for rule in rule_model.objects.filter(
+            is_active=True, **{f'{course_field}_id__in': missing}
+        ):
+            grouped[getattr(rule, f'{course_field}_id')].append(rule)
+        for cid, rules in grouped.items():
+            _compiled[(rule_model, cid)] = CompiledRules(rules)
+    return {cid: _compiled[(rule_model, cid)] for cid in course_ids}
+
+
+def rules_for_branch(branch) -> CompiledRules:
+    return compiled_rules(EligibilityRule, 'branch', [branch.id])[branch.id]
+
+
+def rules_for_oe(oe_subject) -> CompiledRules:
+    return compiled_rules(OEEligibilityRule, 'oe_subject', [oe_subject.id])[oe_subject.id]
+
+
+@receiver(post_save, sender=EligibilityRule)
+@receiver(post_delete, sender=EligibilityRule)
+@receiver(post_save, sender=OEEligibilityRule)
+@receiver(post_delete, sender=OEEligibilityRule)
+def _rule_changed(sender, **kwargs):
+    # rule_create / rule_edit / rule_toggle_active / rule_delete and the
+    # OE versions all go through save()/delete(), so they land here.
+    invalidate_rules()
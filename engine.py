@@ -0,0 +1,412 @@
+"""
+In-memory allocation engine behind the run_*_allocation helpers in utils.
+
+A run loads students, preferences, active rules and courses in a handful
+of bulk queries, does the greedy pass over plain Python structures with
+in-memory seat counters, and writes the results back with a single
+bulk_create inside one transaction.
+
+Loading and writing take an optional `cohort` (models.Cohort or its id):
+a run then only sees, and only replaces, that cohort's students, courses
+and preferences. Without one a run covers the whole deployment.
+
+A student who withdrew from a phase (SeatRelease.REASON_WITHDRAWN) is left
+out of every later run of that phase: load_phase drops their preferences
+and lists them in PhaseData.withdrawn, which the strategies never seat.
+"""
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+from django.db.models import Min
+
+from .dashboard_cache import invalidate_students
+from .eligibility import StudentColumns, compiled_rules
+from .models import (
+    Student, MinorBranch, OpenElective,
+    MinorPreference, DoubleMinorPreference, OEPreference,
+    MinorAllocation, DoubleMinorAllocation, OEAllocation,
+    EligibilityRule, OEEligibilityRule, SeatRelease,
+)
+
+
+BULK_BATCH_SIZE = 1000
+
+# How often (in students) allocate_greedy reports progress
+PROGRESS_EVERY = 250
+
+
+# Static description of one allocation category (Minor 1, Minor 2, OE).
+PhaseSpec = namedtuple('PhaseSpec', [
+    'name',
+    'preference_model',
+    'preference_relation',   # reverse name on Student, e.g. 'minor_preferences'
+    'course_model',
+    'course_field',          # FK name on preferences/allocations
+    'rule_model',
+    'rule_course_field',     # FK name on the rule model
+    'allocation_model',
+])
+
+MINOR1 = PhaseSpec(
+    'minor1', MinorPreference, 'minor_preferences', MinorBranch,
+    'minor_branch', EligibilityRule, 'branch', MinorAllocation,
+)
+MINOR2 = PhaseSpec(
+    'minor2', DoubleMinorPreference, 'double_minor_preferences', MinorBranch,
+    'minor_branch', EligibilityRule, 'branch', DoubleMinorAllocation,
+)
+OE = PhaseSpec(
+    'oe', OEPreference, 'oe_preferences', OpenElective,
+    'oe_subject', OEEligibilityRule, 'oe_subject', OEAllocation,
+)
+
+# One seat given to one student.
+# `priority` is the preference number used, or None for auto-allocation.
+# `seats_before` is how many seats of the course were filled before this one.
+Allocation = namedtuple('Allocation', ['student', 'course', 'priority', 'seats_before'])
+
+
+def no_progress(phase, done=0, total=0):
+    """Default progress callback: progress(phase, done, total)."""
+
+
+# -------------------------
+# Bulk loading
+# -------------------------
+class PhaseData:
+    """Everything one phase needs, loaded once per run."""
+
+    def __init__(self, spec, courses, predicates, preferences, preference_order, cohort=None,
+                 withdrawn=frozenset()):
+        self.spec = spec
+        self.cohort = cohort                        # Cohort (or id) the data was loaded for
+        self.courses = courses                      # list, in default queryset order
+        self.courses_by_id = {c.id: c for c in courses}
+        self.predicates = predicates                # course_id -> CompiledRules
+        self.preferences = preferences              # student_id -> [(course_id, priority)]
+        self.preference_order = preference_order    # student ids, merit + earliest submission
+        self.withdrawn = withdrawn                  # student ids never to seat in this phase
+
+
+def in_cohort(queryset, cohort, path=''):
+    """
+    `queryset` narrowed to `cohort` through the cohort link at `path`
+    ('' for students and courses, 'student__' for rows hanging off a
+    student). A None cohort leaves it untouched.
+    """
+    if cohort is None:
+        return queryset
+    return queryset.filter(**{f'{path}cohort_link__cohort': cohort})
+
+
+def load_students(cohort=None):
+    """
+    All students (of `cohort`) in auto-allocation order (merit, then
+    registration time). Also used as the lookup table for the preference
+    phase.
+    """
+    return list(in_cohort(Student.objects.all(), cohort).order_by('-percentage', 'user__date_joined'))
+
+
+def load_phase(spec, courses=None, cohort=None):
+    """
+    Load one phase. `courses` can be passed in to reuse an already loaded
+    course list (Minor 1 and Minor 2 share the MinorBranch rows).
+    """
+    if courses is None:
+        courses = list(in_cohort(spec.course_model.objects.all(), cohort))
+
+    predicates = compiled_rules(
+        spec.rule_model, spec.rule_course_field, [c.id for c in courses]
+    )
+
+    withdrawn = frozenset(
+        in_cohort(SeatRelease.objects.all(), cohort, 'student__').filter(
+            phase=spec.name, reason=SeatRelease.REASON_WITHDRAWN,
+        ).values_list('student_id', flat=True)
+    )
+
+    preferences = defaultdict(list)
+    # Both the student and the course must be in the cohort
+    rows = in_cohort(spec.preference_model.objects.all(), cohort, 'student__')
+    rows = in_cohort(rows, cohort, f'{spec.course_field}__').order_by(
+        'student_id', 'priority', 'pk'
+    ).values_list('student_id', f'{spec.course_field}_id', 'priority')
+    for student_id, course_id, priority in rows:
+        if student_id not in withdrawn:
+            preferences[student_id].append((course_id, priority))
+
+    preference_order = [
+        student_id for student_id in in_cohort(Student.objects.all(), cohort).filter(
+            **{f'{spec.preference_relation}__isnull': False}
+        ).annotate(
+            submission_time=Min(f'{spec.preference_relation}__submitted_at')
+        ).order_by('-percentage', 'submission_time', 'id').values_list('id', flat=True)
+        if student_id not in withdrawn
+    ]
+
+    return PhaseData(spec, courses, predicates, preferences, preference_order, cohort, withdrawn)
+
+
+def course_cohort(spec, course_ids):
+    """Id of the cohort the courses in `course_ids` belong to, or None."""
+    return spec.course_model.objects.filter(pk__in=course_ids).values_list(
+        'cohort_link__cohort', flat=True
+    ).first()
+
+
+def load_minor1_branches(cohort=None):
+    """student_id -> Minor 1 branch id, as stored by the last Minor 1 run."""
+    branches = {}
+    for student_id, branch_id in in_cohort(MinorAllocation.objects.all(), cohort, 'student__').order_by(
+        'pk'
+    ).values_list(
+        'student_id', 'minor_branch_id'
+    ):
+        branches.setdefault(student_id, branch_id)
+    return branches
+
+
+# -------------------------
+# Greedy pass
+# -------------------------
+def eligibility_masks(students, data, columns=None):
+    """course_id -> list of bools, one per student in `students` order."""
+    if columns is None:
+        columns = StudentColumns(students)
+    return {
+        cid: predicate.mask(columns).tolist()
+        for cid, predicate in data.predicates.items()
+    }
+
+
+def allocate_greedy(students, data, excluded=None, progress=no_progress, eligible=None,
+                    start=0, kept=()):
+    """
+    Greedy allocation in merit order, entirely in memory.
+
+    Students with preferences get the first eligible preference with a free
+    seat; everyone left over is then auto-allocated to the first eligible
+    course with a free seat. `excluded` maps student_id -> course_id the
+    student must not get (their Minor 1 branch, for Minor 2).
+    `progress` is called as progress(phase, done, total) while the passes run.
+    `eligible` may be a precomputed eligibility_masks() result for `students`.
+
+    The run is a sequence of steps: step i < P visits preference_order[i],
+    step P + j visits students[j] in the auto pass (P = len(preference_order)).
+    `start` resumes at that step, with `kept` holding the allocations made
+    by the earlier steps; only the allocations made from `start` on are
+    returned.
+
+    Returns a list of Allocation in the order they were made.
+    """
+    excluded = excluded or {}
+    students_by_id = {s.id: s for s in students}
+    position = {s.id: i for i, s in enumerate(students)}
+    filled = defaultdict(int)
+    allocated = set()
+    allocations = []
+    for alloc in kept:
+        filled[alloc.course.id] += 1
+        allocated.add(alloc.student.id)
+
+    # One eligibility mask per course over the whole cohort
+    if eligible is None:
+        eligible = eligibility_masks(students, data)
+
+    def try_seat(student, course, priority):
+        if course.id == excluded.get(student.id) or student.id in data.withdrawn:
+            return False
+        if not eligible[course.id][position[student.id]]:
+            return False
+        seats_before = filled[course.id]
+        if seats_before < course.capacity:
+            filled[course.id] = seats_before + 1
+            allocated.add(student.id)
+            allocations.append(Allocation(student, course, priority, seats_before))
+            return True
+        return False
+
+    # Students WITH preferences
+    total = len(data.preference_order)
+    for done in range(min(start, total), total):
+        student_id = data.preference_order[done]
+        if done % PROGRESS_EVERY == 0:
+            progress('preferences', done, total)
+        student = students_by_id[student_id]
+        for course_id, priority in data.preferences.get(student_id, ()):
+            if try_seat(student, data.courses_by_id[course_id], priority):
+                break
+
+    progress('preferences', total, total)
+
+    # Auto-allocation for everyone still unallocated
+    start = max(0, start - len(data.preference_order))
+    total = len(students)
+    for done in range(start, total):
+        student = students[done]
+        if done % PROGRESS_EVERY == 0:
+            progress('auto', done, total)
+        if student.id in allocated:
+            continue
+        for course in data.courses:
+            if try_seat(student, course, None):
+                break
+    progress('auto', total, total)
+
+    return allocations
+
+
+# -------------------------
+# Write back
+# -------------------------
+def save_allocations(spec, objects, cohort=None):
+    """
+    Replace every allocation of this phase (of `cohort`'s students) with
+    `objects` in one transaction.
+    """
+    model = spec.allocation_model
+    with transaction.atomic():
+        in_cohort(model.objects.all(), cohort, 'student__').delete()
+        model.objects.bulk_create(objects, batch_size=BULK_BATCH_SIZE)
+        transaction.on_commit(invalidate_students)
+
+
+def save_all(results, cohort=None):
+    """Write several phases at once: `results` is [(spec, objects), ...]."""
+    with transaction.atomic():
+        for spec, objects in results:
+            save_allocations(spec, objects, cohort)
+
+
+# -------------------------
+# Incremental re-allocation
+# -------------------------
+class PreviousRun:
+    """
+    The stored allocations of one phase, placed back on the step timeline
+    of allocate_greedy so a run can be resumed part-way.
+    """
+
+    def __init__(self, students, data, course_of):
+        self.course_of = course_of                  # student_id -> course_id
+        self.pref_steps = {sid: i for i, sid in enumerate(data.preference_order)}
+        offset = len(data.preference_order)
+        self.auto_steps = {s.id: offset + j for j, s in enumerate(students)}
+
+        # A student allocated a course from their own preference list got it
+        # in the preference pass: had it failed there (excluded, ineligible
+        # or full) it would fail again in the auto pass.
+        self.step_of = {}
+        self.in_pref_pass = set()
+        for sid, course_id in list(course_of.items()):
+            if sid not in self.auto_steps:
+                del course_of[sid]
+                continue
+            if sid in self.pref_steps and any(c == course_id for c, _ in data.preferences.get(sid, ())):
+                self.step_of[sid] = self.pref_steps[sid]
+                self.in_pref_pass.add(sid)
+            else:
+                self.step_of[sid] = self.auto_steps[sid]
+
+        self.course_steps = defaultdict(list)       # course_id -> sorted steps its seats were taken
+        for sid, step in self.step_of.items():
+            self.course_steps[course_of[sid]].append(step)
+        for steps in self.course_steps.values():
+            steps.sort()
+
+    def seats_before(self, course_id, step):
+        return bisect_left(self.course_steps.get(course_id, ()), step)
+
+    def kept(self, students_by_id, data, start):
+        """Allocations made before step `start`, rebuilt as Allocation tuples."""
+        kept = []
+        for sid, step in self.step_of.items():
+            if step >= start:
+                continue
+            course_id = self.course_of[sid]
+            priority = None
+            if sid in self.in_pref_pass:
+                priority = next(p for c, p in data.preferences[sid] if c == course_id)
+            kept.append(Allocation(
+                students_by_id[sid], data.courses_by_id[course_id],
+                priority, self.seats_before(course_id, step),
+            ))
+        return kept
+
+
+def load_previous_run(students, data):
+    course_field = f'{data.spec.course_field}_id'
+    course_of = {}
+    rows = in_cohort(data.spec.allocation_model.objects.all(), data.cohort, 'student__')
+    for sid, course_id in rows.order_by('pk').values_list(
+        'student_id', course_field
+    ):
+        course_of.setdefault(sid, course_id)
+    return PreviousRun(students, data, course_of)
+
+
+def first_affected_step(students, data, previous, changes, eligible, changed_students=(), excluded=None):
+    """
+    Earliest step of the previous run whose decision can differ after
+    `changes` (course_id -> old capacity, or None when the rules changed).
+    Every step before it makes the same decision, so the run can resume
+    there. `changed_students` (e.g. whose Minor 1 moved) are affected from
+    their own first step. Returns None if nothing is affected.
+    """
+    excluded = excluded or {}
+    position = {s.id: i for i, s in enumerate(students)}
+    course_index = {c.id: i for i, c in enumerate(data.courses)}
+    earliest = None
+
+    def affected(sid, course_id, step):
+        old_capacity = changes[course_id]
+        if old_capacity is None:
+            return True
+        # Capacity-only change: the decision only differs once the course
+        # holds as many seats as the smaller of the two capacities.
+        if excluded.get(sid) == course_id or not eligible[course_id][position[sid]]:
+            return False
+        limit = min(old_capacity, data.courses_by_id[course_id].capacity)
+        return previous.seats_before(course_id, step) >= limit
+
+    for sid in changed_students:
+        for step in (previous.pref_steps.get(sid), previous.auto_steps.get(sid)):
+            if step is not None and (earliest is None or step < earliest):
+                earliest = step
+
+    # Preference pass: a student looks at their preferences in order,
+    # up to the one they were allocated (or all of them).
+    for sid, step in previous.pref_steps.items():
+        if earliest is not None and step >= earliest:
+            continue
+        got = previous.course_of.get(sid) if sid in previous.in_pref_pass else None
+        for course_id, _ in data.preferences.get(sid, ()):
+            if course_id in changes and affected(sid, course_id, step):
+                earliest = step
+                break
+            if course_id == got:
+                break
+    if earliest is not None and earliest < len(data.preference_order):
+        return earliest
+
+    # Auto pass: everyone not placed by their preferences walks the course
+    # list up to the course they got.
+    changed_index = min(course_index[cid] for cid in changes if cid in course_index) if changes else None
+    if changed_index is None:
+        return earliest
+    for student in students:
+        step = previous.auto_steps[student.id]
+        if earliest is not None and step >= earliest:
+            break
+        if student.id in previous.in_pref_pass:
+            continue
+        got = previous.course_of.get(student.id)
+        last = course_index[got] if got is not None else len(data.courses) - 1
+        if last < changed_index:
+            continue
+        for course in data.courses[changed_index:last + 1]:
+            if course.id in changes and affected(student.id, course.id, step):
+                return step
+    return earliest
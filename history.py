@@ -0,0 +1,317 @@
+"""
+Allocation run history.
+
+Every run is kept as an AllocationRun holding its parameters (strategy,
+course names and capacities, the eligibility rules in force) and one
+AllocationRunPhase per phase. A phase stores its outcomes as compressed
+NumPy arrays, one entry per student:
+
+    course        course id, or -1 when the student got nothing
+    rank          preference number used, RANK_AUTO or RANK_NONE
+    seats_before  seats of the course filled before this one
+    percentage    the student's percentage at run time
+    rejected_*    each higher choice: course, REASON_* code and the
+                  preference number the student gave it
+
+A phase of 10k students is a few tens of KB. Text is only produced when
+someone looks at an outcome (render_outcome), and comparing two runs is
+an array diff of one row per phase and run.
+"""
+import io
+from collections import Counter, namedtuple
+
+import numpy as np
+from django.db import transaction
+
+from .models import AllocationRun, AllocationRunPhase
+
+
+RANK_AUTO = 0
+RANK_NONE = -1
+
+REASON_FULL = 1
+REASON_MIN_PERCENTAGE = 2
+REASON_DEPARTMENT = 3
+REASON_EXCLUDED = 4
+REASON_NOT_CHOSEN = 5
+
+PHASE_LABELS = {'minor1': 'Minor 1', 'minor2': 'Minor 2', 'oe': 'Open Elective'}
+COURSE_TYPES = {'minor1': 'minor', 'minor2': 'minor', 'oe': 'oe'}
+
+# What a runner hands to record_run for each phase it ran
+PhaseRun = namedtuple('PhaseRun', ['spec', 'data', 'allocations', 'eligible', 'excluded', 'seconds'])
+
+Outcome = namedtuple('Outcome', ['student_id', 'course_id', 'rank', 'seats_before', 'percentage', 'rejected'])
+
+
+# -------------------------
+# Packing
+# -------------------------
+def pack(arrays):
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def _reason(student, position, course, predicate, eligible, excluded_course, filled):
+    if course.id == excluded_course:
+        return REASON_EXCLUDED
+    if not eligible[course.id][position]:
+        if predicate.below_minimum(student.percentage):
+            return REASON_MIN_PERCENTAGE
+        return REASON_DEPARTMENT
+    if filled[course.id] >= course.capacity:
+        return REASON_FULL
+    # Eligible and not full: another strategy than greedy chose otherwise
+    return REASON_NOT_CHOSEN
+
+
+def phase_arrays(students, phase):
+    """Outcome arrays of one phase, sorted by student id."""
+    data, eligible = phase.data, phase.eligible
+    excluded = phase.excluded or {}
+    by_student = {alloc.student.id: alloc for alloc in phase.allocations}
+    filled = Counter(alloc.course.id for alloc in phase.allocations)
+
+    order = sorted(range(len(students)), key=lambda i: students[i].id)
+    course, rank, seats = [], [], []
+    offsets, rejected_course, rejected_reason, rejected_priority = [0], [], [], []
+    for i in order:
+        student = students[i]
+        alloc = by_student.get(student.id)
+        prefs = data.preferences.get(student.id, ())
+        higher = prefs
+        if alloc is None:
+            course.append(-1)
+            rank.append(RANK_NONE)
+            seats.append(0)
+        else:
+            course.append(alloc.course.id)
+            rank.append(RANK_AUTO if alloc.priority is None else alloc.priority)
+            seats.append(alloc.seats_before)
+            if alloc.priority is not None:
+                used = next(k for k, (cid, p) in enumerate(prefs)
+                            if cid == alloc.course.id and p == alloc.priority)
+                higher = prefs[:used]
+
+        for course_id, number in higher:
+            rejected_course.append(course_id)
+            rejected_priority.append(number)
+            rejected_reason.append(_reason(
+                student, i, data.courses_by_id[course_id], data.predicates[course_id],
+                eligible, excluded.get(student.id), filled,
+            ))
+        offsets.append(len(rejected_course))
+
+    return {
+        'student': np.array([students[i].id for i in order], dtype=np.int64),
+        'course': np.array(course, dtype=np.int64),
+        'rank': np.array(rank, dtype=np.int16),
+        'seats_before': np.array(seats, dtype=np.int32),
+        'percentage': np.array([students[i].percentage for i in order], dtype=np.float32),
+        'rejected_offsets': np.array(offsets, dtype=np.int32),
+        'rejected_course': np.array(rejected_course, dtype=np.int64),
+        'rejected_reason': np.array(rejected_reason, dtype=np.int8),
+        'rejected_priority': np.array(rejected_priority, dtype=np.int16),
+    }
+
+
+class PhaseOutcomes:
+    """Unpacked outcomes of one AllocationRunPhase."""
+
+    def __init__(self, blob):
+        with np.load(io.BytesIO(bytes(blob))) as arrays:
+            self.arrays = {name: arrays[name] for name in arrays.files}
+
+    def __len__(self):
+        return len(self.arrays['student'])
+
+    def index(self, student_id):
+        students = self.arrays['student']
+        i = int(np.searchsorted(students, student_id))
+        return i if i < len(students) and students[i] == student_id else None
+
+    def outcome(self, i):
+        """Outcome of entry `i`; `rejected` is [(course id, REASON_*, preference number)]."""
+        a = self.arrays
+        start, end = a['rejected_offsets'][i], a['rejected_offsets'][i + 1]
+        if 'rejected_priority' in a:
+            numbers = a['rejected_priority'][start:end].tolist()
+        else:
+            # Recorded before the numbers were stored: count the choices
+            numbers = list(range(1, end - start + 1))
+        return Outcome(
+            int(a['student'][i]), int(a['course'][i]), int(a['rank'][i]),
+            int(a['seats_before'][i]), float(a['percentage'][i]),
+            list(zip(a['rejected_course'][start:end].tolist(), a['rejected_reason'][start:end].tolist(), numbers)),
+        )
+
+    def get(self, student_id):
+        i = self.index(student_id)
+        return None if i is None else self.outcome(i)
+
+
+# -------------------------
+# Recording
+# -------------------------
+def _parameters(strategy, phases):
+    parameters = {'strategy': strategy, 'courses': {}, 'rules': {}}
+    for phase in phases:
+        course_type = COURSE_TYPES[phase.spec.name]
+        parameters['courses'][course_type] = {
+            str(c.id): [c.name, c.capacity] for c in phase.data.courses
+        }
+        parameters['rules'][course_type] = {
+            str(cid): rule for cid, rule in
+            ((cid, _rule(p)) for cid, p in phase.data.predicates.items()) if rule
+        }
+    return parameters
+
+
+def _rule(predicate):
+    """A course's eligibility rule as stored in the parameters; None when it has none."""
+    if predicate is None or (predicate.min_percentage is None and not predicate.blocked_departments):
+        return None
+    return {
+        'min_percentage': predicate.min_percentage,
+        'blocked_departments': sorted(predicate.blocked_departments),
+    }
+
+
+def course_changes(run, data, changes):
+    """
+    `changes` (course id -> old capacity, or None) with the unknowns
+    filled in from `run`: a course whose rules are the same as in the run
+    only changed capacity, from the one it had then. Courses new since
+    the run, or whose rules changed, stay None.
+    """
+    course_type = COURSE_TYPES[data.spec.name]
+    courses = run.parameters['courses'].get(course_type, {})
+    rules = run.parameters['rules'].get(course_type, {})
+    narrowed = {}
+    for course_id, old_capacity in changes.items():
+        key = str(course_id)
+        if old_capacity is None and key in courses and rules.get(key) == _rule(data.predicates.get(course_id)):
+            old_capacity = courses[key][1]
+        narrowed[course_id] = old_capacity
+    return narrowed
+
+
+def record_run(kind, strategy, started_at, duration, students, phases, cohort=None):
+    """Store one run (of `cohort`) and the outcomes of its `phases` (PhaseRun tuples)."""
+    with transaction.atomic():
+        run = AllocationRun.objects.create(
+            kind=kind, strategy=strategy, started_at=started_at, duration=duration,
+            cohort_id=getattr(cohort, 'pk', cohort),
+            parameters=_parameters(strategy, phases),
+        )
+        AllocationRunPhase.objects.bulk_create([
+            AllocationRunPhase(
+                run=run, phase=phase.spec.name, duration=phase.seconds,
+                allocated=len(phase.allocations),
+                unallocated=len(students) - len(phase.allocations),
+                outcomes=pack(phase_arrays(students, phase)),
+            )
+            for phase in phases
+        ])
+    return run
+
+
+# -------------------------
+# Reading
+# -------------------------
+def _course(run, phase, course_id):
+    name, capacity = run.parameters['courses'][COURSE_TYPES[phase]].get(str(course_id), ['(deleted)', 0])
+    return name, capacity
+
+
+def _reason_text(run, phase, course_id, reason, outcome):
+    name, capacity = _course(run, phase, course_id)
+    rule = run.parameters['rules'].get(COURSE_TYPES[phase], {}).get(str(course_id), {})
+    if reason == REASON_FULL:
+        return f"all {capacity} seats of '{name}' were taken"
+    if reason == REASON_MIN_PERCENTAGE:
+        return (f"'{name}' requires at least {rule.get('min_percentage')}% "
+                f"(student had {outcome.percentage:g}%)")
+    if reason == REASON_DEPARTMENT:
+        return f"'{name}' is not open to the student's department"
+    if reason == REASON_EXCLUDED:
+        return f"'{name}' is already the student's Minor 1"
+    return f"the seat in '{name}' went to another student in the optimal assignment"
+
+
+def render_outcome(run, phase, outcome):
+    """Human-readable explanation of one Outcome of `phase` in `run`."""
+    label = PHASE_LABELS[phase]
+    lines = [
+        f"Preference #{number} not allocated: {_reason_text(run, phase, course_id, reason, outcome)}."
+        for course_id, reason, number in outcome.rejected
+    ]
+
+    if outcome.rank == RANK_NONE:
+        lines.append(f"No {label} allocated: no eligible course had a free seat.")
+        return ' '.join(lines)
+
+    name, capacity = _course(run, phase, outcome.course_id)
+    if outcome.rank == RANK_AUTO:
+        lines.append(f"Auto-allocated {label} '{name}'.")
+    else:
+        lines.append(f"Allocated {label} '{name}' using preference #{outcome.rank}.")
+    lines.append(
+        f"Student percentage: {outcome.percentage:g}. "
+        f"Seats filled before allocation: {outcome.seats_before} / {capacity}."
+    )
+    return ' '.join(lines)
+
+
+Change = namedtuple('Change', ['student_id', 'course_a', 'rank_a', 'course_b', 'rank_b'])
+
+
+def _better(rank_a, rank_b):
+    """Whether rank_b is a better outcome than rank_a."""
+    def key(rank):
+        # preference ranks first (lower is better), then auto, then nothing
+        if rank > 0:
+            return (0, rank)
+        return (1, 0) if rank == RANK_AUTO else (2, 0)
+    return key(rank_b) < key(rank_a)
+
+
+def compare_runs(run_a, run_b, limit=500):
+    """
+    Per phase present in both runs: counts of students who moved, got a
+    better or worse outcome, and up to `limit` Change rows.
+    """
+    phases_a = {p.phase: p for p in run_a.phases.all()}
+    phases_b = {p.phase: p for p in run_b.phases.all()}
+
+    result = []
+    for phase in PHASE_LABELS:
+        if phase not in phases_a or phase not in phases_b:
+            continue
+        a = PhaseOutcomes(phases_a[phase].outcomes).arrays
+        b = PhaseOutcomes(phases_b[phase].outcomes).arrays
+        _, ia, ib = np.intersect1d(a['student'], b['student'], assume_unique=True, return_indices=True)
+        moved = np.flatnonzero(a['course'][ia] != b['course'][ib])
+
+        changes = [
+            Change(int(a['student'][ia[k]]), int(a['course'][ia[k]]), int(a['rank'][ia[k]]),
+                   int(b['course'][ib[k]]), int(b['rank'][ib[k]]))
+            for k in moved
+        ]
+        improved = sum(1 for c in changes if _better(c.rank_a, c.rank_b))
+        worsened = sum(1 for c in changes if _better(c.rank_b, c.rank_a))
+        result.append({
+            'phase': phase,
+            'label': PHASE_LABELS[phase],
+            'compared': len(ia),
+            'moved': len(changes),
+            'improved': improved,
+            'worsened': worsened,
+            'changes': changes[:limit],
+        })
+    return result
+
+
+def course_name(run, phase, course_id):
+    return None if course_id < 0 else _course(run, phase, course_id)[0]
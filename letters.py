@@ -0,0 +1,159 @@
+"""
+Batch allotment letters (PDF), one per student, bundled into a ZIP.
+
+Letter data is read in the main process (one chunked query, see
+reports.report_rows) before the process pool forks, and the database
+connections are closed first, so no worker inherits an open connection
+or cursor. The letters are then handed out in batches. Each
+worker compiles the letter template and the stylesheet once, renders its
+batch with WeasyPrint and writes every PDF into a work directory with an
+atomic rename. The finished PDFs are then streamed into the ZIP one file
+at a time.
+
+Letters already present in the work directory are skipped, so a run that
+crashed can be resumed by running it again.
+"""
+import hashlib
+import os
+import re
+import shutil
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connections
+
+from . import reports
+
+
+LETTER_TEMPLATE = 'allotment_letter.html'
+LETTER_STYLESHEET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'allotment_letter.css')
+LETTER_COLUMNS = [
+    'roll_no', 'name', 'department', 'percentage',
+    'minor1', 'minor1_explanation', 'minor2', 'oe',
+]
+BATCH_SIZE = 50
+
+# Compiled once per worker process by _init_worker
+_template = None
+_stylesheet = None
+
+
+def letter_filename(roll_no):
+    """
+    PDF name for a roll number. Roll numbers that had to be sanitized get
+    a hash of the original, so 'A/1' and 'A_1' don't share a file.
+    """
+    roll_no = str(roll_no)
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', roll_no)
+    if name != roll_no:
+        name = f"{name}-{hashlib.sha1(roll_no.encode()).hexdigest()[:8]}"
+    return name + '.pdf'
+
+
+def _init_worker():
+    global _template, _stylesheet
+
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+    from django.template.loader import get_template
+    from weasyprint import CSS
+
+    _template = get_template(LETTER_TEMPLATE)
+    _stylesheet = CSS(filename=LETTER_STYLESHEET)
+
+
+def render_letter(letter):
+    """PDF bytes for one letter (a dict of LETTER_COLUMNS values)."""
+    from weasyprint import HTML
+
+    html = _template.render({'letter': letter})
+    return HTML(string=html).write_pdf(stylesheets=[_stylesheet])
+
+
+def _render_batch(letters, work_dir):
+    for letter in letters:
+        path = os.path.join(work_dir, letter_filename(letter['roll_no']))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as fh:
+            fh.write(render_letter(letter))
+        os.replace(tmp_path, path)
+    return len(letters)
+
+
+def _pending_rows(departments, done):
+    """Letter rows (tuples of LETTER_COLUMNS) whose PDF isn't in `done`."""
+    roll_no = LETTER_COLUMNS.index('roll_no')
+    return [
+        row for row in reports.report_rows(LETTER_COLUMNS, departments)
+        if letter_filename(row[roll_no]) not in done
+    ]
+
+
+def _batches(rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        yield [dict(zip(LETTER_COLUMNS, row)) for row in rows[start:start + batch_size]]
+
+
+def write_zip(work_dir, output):
+    """Stream every PDF in `work_dir` into the ZIP at `output`."""
+    names = sorted(n for n in os.listdir(work_dir) if n.endswith('.pdf'))
+    tmp_output = f"{output}.tmp"
+    # PDFs are already compressed; storing them keeps the ZIP step cheap
+    with zipfile.ZipFile(tmp_output, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name in names:
+            archive.write(os.path.join(work_dir, name), arcname=name)
+    os.replace(tmp_output, output)
+    return len(names)
+
+
+def generate_letters(output, work_dir=None, workers=None, batch_size=BATCH_SIZE,
+                     departments=None, progress=None, fresh=False):
+    """
+    Render a letter for every student and bundle them into `output`.
+
+    `work_dir` (default: `<output>.parts`) keeps the rendered PDFs between
+    runs for resuming; `fresh` empties it first (e.g. after a new allocation
+    run). `progress`, if given, is called as progress(rendered).
+    Returns a dict with letters, rendered, skipped, seconds and
+    letters_per_second (for the letters rendered in this run).
+    """
+    work_dir = work_dir or f"{output}.parts"
+    if fresh and os.path.isdir(work_dir):
+        shutil.rmtree(work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    done = {n for n in os.listdir(work_dir) if n.endswith('.pdf')}
+
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    rows = _pending_rows(departments, done)
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+    rendered = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        # Keep a bounded number of batches in flight so memory stays flat
+        pending = []
+        max_pending = 2 * workers
+        for batch in _batches(rows, batch_size):
+            pending.append(pool.submit(_render_batch, batch, work_dir))
+            if len(pending) >= max_pending:
+                rendered += pending.pop(0).result()
+                if progress:
+                    progress(rendered)
+        for future in pending:
+            rendered += future.result()
+            if progress:
+                progress(rendered)
+    elapsed = time.perf_counter() - started
+
+    letters = write_zip(work_dir, output)
+    return {
+        'letters': letters,
+        'rendered': rendered,
+        'skipped': len(done),
+        'seconds': round(elapsed, 2),
+        'letters_per_second': round(rendered / elapsed, 1) if elapsed and rendered else 0.0,
+    }
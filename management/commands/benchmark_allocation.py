@@ -0,0 +1,147 @@
+import functools
+import json
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from allotment import strategies, utils
+from allotment.metrics import QueryCounter
+from allotment.eligibility import invalidate_rules
+from allotment.management.commands.generate_cohort import clear_synthetic, generate_cohort
+
+
+def _run_separately(strategy=None):
+    utils.run_minor1_allocation(strategy=strategy)
+    utils.run_minor2_allocation(strategy=strategy)
+    utils.run_oe_allocation(strategy=strategy)
+
+
+RUNNERS = {
+    'minor1': utils.run_minor1_allocation,
+    'minor2': utils.run_minor2_allocation,
+    'oe': utils.run_oe_allocation,
+    'separate': _run_separately,
+    'all': utils.run_all_allocations,
+}
+
+
+def measure(func, repeat=3):
+    """
+    Best wall time and its query count over `repeat` runs, then one more
+    run under tracemalloc for peak Python memory (kept apart so tracing
+    doesn't skew the timing).
+    """
+    best, queries = None, 0
+    for _ in range(repeat):
+        # Every run starts cold, so query counts don't depend on run order
+        invalidate_rules()
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best, queries = elapsed, counter.count
+
+    invalidate_rules()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': round(best, 4), 'queries': queries, 'peak_mb': round(peak / 2 ** 20, 2)}
+
+
+def regressions(results, baseline, threshold):
+    """Human-readable list of measurements that got worse than the baseline."""
+    problems = []
+    for size, runners in results.items():
+        for name, now in runners.items():
+            before = baseline.get(size, {}).get(name)
+            if not before:
+                continue
+            if now['seconds'] > before['seconds'] * (1 + threshold):
+                problems.append(f"{name} @ {size}: {now['seconds']}s vs baseline {before['seconds']}s")
+            if now['queries'] > before['queries']:
+                problems.append(f"{name} @ {size}: {now['queries']} queries vs baseline {before['queries']}")
+            if now['peak_mb'] > before['peak_mb'] * (1 + threshold):
+                problems.append(f"{name} @ {size}: {now['peak_mb']} MB vs baseline {before['peak_mb']} MB")
+    return problems
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the allocation runners: wall time, DB query count and peak "
+        "memory. With --sizes, synthetic cohorts of those sizes are generated "
+        "first (see generate_cohort). Overwrites allocations, so use a scratch "
+        "database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='',
+                            help='Comma-separated cohort sizes, e.g. "1000,10000,100000". '
+                                 'Without it the current database is measured.')
+        parser.add_argument('--runners', default='minor1,minor2,oe,separate,all',
+                            help=f"Comma-separated subset of: {', '.join(RUNNERS)}.")
+        parser.add_argument('--strategy', choices=list(strategies.STRATEGIES),
+                            help='Allocation strategy (default: settings.ALLOCATION_STRATEGY).')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Runs per measurement; the best time is reported.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save-baseline', metavar='PATH',
+                            help='Write the results as a JSON baseline.')
+        parser.add_argument('--compare', metavar='PATH',
+                            help='Fail if results regress past --threshold against this baseline.')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Allowed slowdown / memory growth as a fraction (default 0.25).')
+
+    def handle(self, *args, **options):
+        names = [n for n in options['runners'].split(',') if n]
+        unknown = set(names) - set(RUNNERS)
+        if unknown:
+            raise CommandError(f"Unknown runners: {', '.join(sorted(unknown))}")
+        sizes = [int(s) for s in options['sizes'].split(',') if s]
+        repeat = max(1, options['repeat'])
+
+        results = {}
+        for size in sizes or [None]:
+            label = str(size) if size else 'current'
+            if size:
+                self.stdout.write(f"Generating {size} students...")
+                clear_synthetic()
+                generate_cohort(size, seed=options['seed'])
+
+            results[label] = {}
+            for name in names:
+                runner = functools.partial(RUNNERS[name], strategy=options['strategy'])
+                result = measure(runner, repeat)
+                results[label][name] = result
+                self.stdout.write(
+                    f"{label:>8} {name:<9} {result['seconds']:9.3f}s "
+                    f"{result['queries']:6d} queries {result['peak_mb']:9.2f} MB peak"
+                )
+
+            timed = results[label]
+            if 'separate' in timed and 'all' in timed:
+                speedup = timed['separate']['seconds'] / max(timed['all']['seconds'], 1e-9)
+                self.stdout.write(self.style.SUCCESS(f"{label:>8} run_all speedup: {speedup:.2f}x"))
+
+        if sizes:
+            clear_synthetic()
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as fh:
+                json.dump(results, fh, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {options['save_baseline']}"))
+
+        if options['compare']:
+            with open(options['compare']) as fh:
+                baseline = json.load(fh)
+            problems = regressions(results, baseline, options['threshold'])
+            if problems:
+                raise CommandError("Performance regression:\n  " + "\n  ".join(problems))
+            self.stdout.write(self.style.SUCCESS("No regression against the baseline."))
@@ -0,0 +1,160 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+WORKER_SETTINGS = 'allotment.worker_settings'
+
+# Modules a worker has no use for; the report lists the ones each profile loaded
+WEB_MODULES = ('allotment.views', 'allotment.api.views', 'rest_framework', 'weasyprint', 'openpyxl', 'scipy')
+
+# Run in a fresh interpreter per profile. 'web' starts the way the
+# project's Celery app does (Django setup, the system checks run by
+# Celery's Django fixup, the tasks); 'worker' imports allotment.worker.
+# Then it forks `workers` children, as the prefork pool does, which each
+# run a full collection, report their memory and wait until all have
+PROBE = r'''
+import gc, json, os, sys, time
+
+started = time.perf_counter()
+profile, workers, watched = sys.argv[1], int(sys.argv[2]), sys.argv[3].split(',')
+if profile == 'web':
+    import django
+    from celery import Celery
+    django.setup()
+    Celery('smartallot').config_from_object('django.conf:settings', namespace='CELERY')
+    from django.core.checks import run_checks
+    run_checks()
+    import allotment.tasks
+else:
+    import allotment.worker
+seconds = time.perf_counter() - started
+
+
+def memory():
+    fields = {}
+    with open('/proc/self/smaps_rollup') as fh:
+        for line in fh:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss': fields['Rss'], 'pss': fields['Pss'],
+        'private': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+
+release_r, release_w = os.pipe()
+children = []
+for _ in range(workers):
+    result_r, result_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(release_w)
+        gc.collect()
+        os.write(result_w, json.dumps(memory()).encode())
+        os.close(result_w)
+        os.read(release_r, 1)
+        os._exit(0)
+    os.close(result_w)
+    children.append((pid, result_r))
+
+reports = []
+for pid, result_r in children:
+    with os.fdopen(result_r) as fh:
+        reports.append(json.loads(fh.read()))
+parent = memory()
+os.close(release_w)
+for pid, _ in children:
+    os.waitpid(pid, 0)
+
+print(json.dumps({
+    'seconds': seconds,
+    'modules': len(sys.modules),
+    'loaded': [name for name in watched if name in sys.modules],
+    'parent': parent,
+    'workers': reports,
+}))
+'''
+
+
+def probe(profile, settings_module, workers):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    env.pop('CELERY_SKIP_CHECKS', None)
+    completed = subprocess.run(
+        [sys.executable, '-c', PROBE, profile, str(workers), ','.join(WEB_MODULES)],
+        env=env, capture_output=True, text=True,
+    )
+    if completed.returncode:
+        raise CommandError(f"The {profile} probe failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarise(runs):
+    """Best start-up time of `runs`, and the memory of the last one in MB."""
+    last = runs[-1]
+    workers = last['workers']
+    mb = 1024
+
+    def mean(field):
+        return sum(w[field] for w in workers) / len(workers) / mb if workers else 0.0
+
+    return {
+        'seconds': round(min(run['seconds'] for run in runs), 4),
+        'modules': last['modules'],
+        'loaded': last['loaded'],
+        'parent_rss_mb': round(last['parent']['rss'] / mb, 1),
+        'worker_private_mb': round(mean('private'), 1),
+        'worker_pss_mb': round(mean('pss'), 1),
+        'total_pss_mb': round((last['parent']['pss'] + sum(w['pss'] for w in workers)) / mb, 1),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare worker start-up with the project settings (as the project's "
+        "Celery app starts) against allotment.worker: import time, modules, "
+        "RSS of the parent, and private and proportional memory per forked "
+        "worker. Linux only."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Children to fork per profile, like --concurrency (default 4).')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Start-ups per profile; the best time is reported.')
+        parser.add_argument('--web-settings',
+                            help='Settings the project starts workers with (default: the current ones).')
+
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/smaps_rollup'):
+            raise CommandError("Memory is read from /proc/self/smaps_rollup, which this system doesn't have.")
+        web_settings = options['web_settings'] or settings.SETTINGS_MODULE
+        if web_settings == WORKER_SETTINGS:
+            raise CommandError("Run with the project settings, or pass --web-settings.")
+        workers = max(1, options['workers'])
+        repeat = max(1, options['repeat'])
+
+        results = {}
+        for profile, settings_module in (('web', web_settings), ('worker', WORKER_SETTINGS)):
+            results[profile] = result = summarise([
+                probe(profile, settings_module, workers) for _ in range(repeat)
+            ])
+            self.stdout.write(
+                f"{profile:<7} {result['seconds']:7.3f}s {result['modules']:5d} modules "
+                f"{result['parent_rss_mb']:7.1f} MB RSS | per worker {result['worker_private_mb']:6.1f} MB private "
+                f"{result['worker_pss_mb']:6.1f} MB PSS | {workers} workers {result['total_pss_mb']:7.1f} MB"
+            )
+            self.stdout.write(f"{'':<7} loaded: {', '.join(result['loaded']) or 'none of ' + ', '.join(WEB_MODULES)}")
+
+        web, lean = results['web'], results['worker']
+        self.stdout.write(self.style.SUCCESS(
+            f"start-up {web['seconds'] / max(lean['seconds'], 1e-9):.2f}x faster, "
+            f"{web['worker_private_mb'] - lean['worker_private_mb']:.1f} MB less private memory per worker, "
+            f"{web['total_pss_mb'] - lean['total_pss_mb']:.1f} MB less in total"
+        ))
@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+
+from allotment.models import (
+    Student,
+    MinorPreference, DoubleMinorPreference, OEPreference,
+    MinorAllocation, DoubleMinorAllocation, OEAllocation,
+)
+
+
+def _fk_index(model, column):
+    """Name of the index Django created for a foreign key column."""
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+    for name, info in constraints.items():
+        if info['index'] and info['columns'] == [column] and not info['unique']:
+            return name
+    return None
+
+
+def hot_queries():
+    """(label, queryset, index the plan should use) for each hot query."""
+    queries = []
+    for model in (MinorPreference, DoubleMinorPreference, OEPreference):
+        queries.append((
+            f'{model.__name__} list of one student',
+            model.objects.filter(student_id=1).order_by('priority'),
+            f'{model._meta.db_table}_student_priority_idx',
+        ))
+    queries.append((
+        'Admin dashboard page (merit order)',
+        Student.objects.order_by('-percentage', 'roll_no')[:25],
+        'allotment_student_percentage_idx',
+    ))
+    for model in (MinorAllocation, DoubleMinorAllocation, OEAllocation):
+        queries.append((
+            f'{model.__name__} of one student',
+            model.objects.filter(student_id=1),
+            f'{model._meta.db_table}_student_uniq',
+        ))
+    for model, field in ((MinorAllocation, 'minor_branch'), (OEAllocation, 'oe_subject')):
+        queries.append((
+            f'{model.__name__} seats taken per course',
+            model.objects.values(field).annotate(taken=Count('id')).order_by(),
+            _fk_index(model, f'{field}_id'),
+        ))
+    return queries
+
+
+def explain(queryset):
+    if connection.vendor != 'postgresql':
+        return queryset.explain()
+    # Small tables are cheaper to scan, so PostgreSQL would pick a
+    # sequential scan on a test database; rule it out to see whether the
+    # index can serve the query at all
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the hot allocation and dashboard queries and check that each "
+        "one uses its index (see migration 0010). Exits with an error if one "
+        "doesn't, so it can run in CI against SQLite and PostgreSQL."
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            raise CommandError(f"Query plans are only checked on PostgreSQL and SQLite, not {connection.vendor}.")
+
+        missing = []
+        for label, queryset, index in hot_queries():
+            plan = explain(queryset)
+            if index and index in plan:
+                self.stdout.write(f"{self.style.SUCCESS('ok')}      {label}: {index}")
+            else:
+                missing.append(label)
+                self.stdout.write(f"{self.style.ERROR('MISSING')} {label}: expected {index or 'an index'}")
+            if options['verbosity'] > 1 or label in missing:
+                self.stdout.write('        ' + plan.replace('\n', '\n        '))
+
+        if missing:
+            raise CommandError(f"{len(missing)} hot quer{'y does' if len(missing) == 1 else 'ies do'} not use an index.")
@@ -0,0 +1,166 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from allotment.models import (
+    Student, MinorBranch, OpenElective,
+    MinorPreference, DoubleMinorPreference, OEPreference,
+    EligibilityRule, OEEligibilityRule,
+    Cohort, CohortStudent, CohortMinorBranch, CohortOpenElective,
+)
+
+
+SYNTHETIC_PREFIX = 'synthetic'
+BATCH_SIZE = 2000
+
+
+def clear_synthetic():
+    """Remove everything a previous generate_cohort created."""
+    with transaction.atomic():
+        User.objects.filter(username__startswith=f'{SYNTHETIC_PREFIX}_').delete()
+        MinorBranch.objects.filter(name__startswith=f'{SYNTHETIC_PREFIX} ').delete()
+        OpenElective.objects.filter(name__startswith=f'{SYNTHETIC_PREFIX} ').delete()
+        Cohort.objects.filter(code__startswith=f'{SYNTHETIC_PREFIX}-').delete()
+
+
+def generate_cohort(students, branches=8, oes=6, seed=0, min_pct_rate=0.4,
+                    block_rate=0.3, pref_length=(1, 5), no_pref_rate=0.1,
+                    seat_ratio=1.1, partition=None):
+    """
+    Create a synthetic cohort: users + students spread over
+    Student.DEPARTMENTS, minor branches and OEs with a mix of eligibility
+    rules, and Minor 1 / Minor 2 / OE preference lists of random length.
+    Total seats per category are about `seat_ratio` × students.
+    With `partition`, everything is put in the Cohort 'synthetic-<partition>'
+    (see cohorts.py), so several partitions can be generated side by side.
+    """
+    rnd = random.Random(seed)
+    departments = [code for code, _ in Student.DEPARTMENTS]
+    password = make_password(None)  # unusable, and hashed only once
+    cohort = None
+    tag, roll_tag = '', ''
+    if partition:
+        cohort, _ = Cohort.objects.get_or_create(
+            code=f'{SYNTHETIC_PREFIX}-{partition}', defaults={'name': f'Synthetic {partition}'},
+        )
+        tag, roll_tag = f'{partition}_', f'{partition.upper()}-'
+
+    def courses(model, rule_model, course_field, count, label):
+        capacity = max(1, int(students * seat_ratio / count))
+        created = model.objects.bulk_create([
+            model(name=f'{SYNTHETIC_PREFIX} {tag}{label} {i + 1}', capacity=capacity,
+                  offering_dept=rnd.choice(departments))
+            for i in range(count)
+        ])
+        rules = []
+        for course in created:
+            if rnd.random() < min_pct_rate:
+                rules.append(rule_model(**{course_field: course}, rule_type='MIN_PERCENTAGE',
+                                        value={'min_percentage': rnd.choice([50, 60, 70, 80])}))
+            if rnd.random() < block_rate:
+                rules.append(rule_model(**{course_field: course}, rule_type='DEPARTMENT_BLOCK',
+                                        value={'blocked_departments': rnd.sample(departments, 1)}))
+        rule_model.objects.bulk_create(rules)
+        if cohort is not None:
+            link_model, link_field = {
+                MinorBranch: (CohortMinorBranch, 'branch'), OpenElective: (CohortOpenElective, 'oe_subject'),
+            }[model]
+            link_model.objects.bulk_create([link_model(**{link_field: c}, cohort=cohort) for c in created])
+        return created
+
+    with transaction.atomic():
+        minor_branches = courses(MinorBranch, EligibilityRule, 'branch', branches, 'Minor')
+        open_electives = courses(OpenElective, OEEligibilityRule, 'oe_subject', oes, 'OE')
+
+        for start in range(0, students, BATCH_SIZE):
+            numbers = range(start, min(start + BATCH_SIZE, students))
+            users = User.objects.bulk_create([
+                User(username=f'{SYNTHETIC_PREFIX}_{tag}{n:07d}', password=password,
+                     email=f'{SYNTHETIC_PREFIX}_{tag}{n:07d}@example.com')
+                for n in numbers
+            ])
+            created = Student.objects.bulk_create([
+                Student(
+                    user=user,
+                    name=f'Synthetic Student {n}',
+                    roll_no=f'SYN{roll_tag}{n:07d}',
+                    department=rnd.choice(departments),
+                    percentage=round(min(99.99, max(35.0, rnd.gauss(72, 12))), 2),
+                    email=user.email,
+                )
+                for n, user in zip(numbers, users)
+            ])
+            if cohort is not None:
+                CohortStudent.objects.bulk_create([CohortStudent(student=s, cohort=cohort) for s in created])
+
+            prefs = {MinorPreference: [], DoubleMinorPreference: [], OEPreference: []}
+            for student in created:
+                for model, pool, field in (
+                    (MinorPreference, minor_branches, 'minor_branch'),
+                    (DoubleMinorPreference, minor_branches, 'minor_branch'),
+                    (OEPreference, open_electives, 'oe_subject'),
+                ):
+                    if rnd.random() < no_pref_rate:
+                        continue
+                    length = min(len(pool), rnd.randint(*pref_length))
+                    for priority, course in enumerate(rnd.sample(pool, length), start=1):
+                        prefs[model].append(model(student=student, priority=priority, **{field: course}))
+            for model, rows in prefs.items():
+                model.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic cohort (students, courses, rules and preferences) "
+        "for benchmarking the allocation runners. Use a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=1000)
+        parser.add_argument('--branches', type=int, default=8, help='Minor branches to create.')
+        parser.add_argument('--oes', type=int, default=6, help='Open electives to create.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--min-pct-rate', type=float, default=0.4,
+                            help='Share of courses with a MIN_PERCENTAGE rule.')
+        parser.add_argument('--block-rate', type=float, default=0.3,
+                            help='Share of courses with a DEPARTMENT_BLOCK rule.')
+        parser.add_argument('--pref-length', default='1-5',
+                            help='Preference list length range per category, e.g. "1-5".')
+        parser.add_argument('--no-pref-rate', type=float, default=0.1,
+                            help='Share of students without preferences in a category.')
+        parser.add_argument('--seat-ratio', type=float, default=1.1,
+                            help='Total seats per category relative to the number of students.')
+        parser.add_argument('--partition',
+                            help='Put everything in the cohort "synthetic-<partition>" (repeat the '
+                                 'command with other names for several cohorts).')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete previously generated synthetic data first.')
+
+    def handle(self, *args, **options):
+        try:
+            low, high = (int(x) for x in options['pref_length'].split('-'))
+        except ValueError:
+            raise CommandError('--pref-length must look like "1-5".')
+
+        if options['clear']:
+            clear_synthetic()
+
+        generate_cohort(
+            options['students'],
+            branches=options['branches'],
+            oes=options['oes'],
+            seed=options['seed'],
+            min_pct_rate=options['min_pct_rate'],
+            block_rate=options['block_rate'],
+            pref_length=(low, high),
+            no_pref_rate=options['no_pref_rate'],
+            seat_ratio=options['seat_ratio'],
+            partition=options['partition'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {options['students']} students, {options['branches']} branches "
+            f"and {options['oes']} open electives."
+        ))
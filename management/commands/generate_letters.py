@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from allotment.letters import BATCH_SIZE, generate_letters
+
+
+class Command(BaseCommand):
+    help = (
+        "Render an allotment letter (PDF) for every student in a process pool "
+        "and bundle them into a ZIP. Re-running resumes from the letters "
+        "already rendered in the work directory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='allotment_letters.zip')
+        parser.add_argument('--work-dir', help='Where rendered PDFs are kept (default: <output>.parts).')
+        parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count).')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--department', action='append', dest='departments',
+                            help='Only students of this department (repeatable).')
+        parser.add_argument('--fresh', action='store_true',
+                            help='Discard previously rendered letters instead of resuming.')
+
+    def handle(self, *args, **options):
+        def progress(rendered):
+            self.stdout.write(f"  {rendered} letters rendered...")
+
+        stats = generate_letters(
+            options['output'],
+            work_dir=options['work_dir'],
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            departments=options['departments'],
+            progress=progress,
+            fresh=options['fresh'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['letters']} letters in {options['output']} "
+            f"({stats['rendered']} rendered, {stats['skipped']} resumed) - "
+            f"{stats['seconds']}s, {stats['letters_per_second']} letters/s"
+        ))
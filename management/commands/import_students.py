@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from allotment.student_import import BATCH_SIZE, import_students
+
+
+class Command(BaseCommand):
+    help = (
+        "Import students from a CSV with columns roll_no, name, department, "
+        "percentage, email. Existing students (same roll_no) are updated."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to import.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Validate the file without writing anything.')
+
+    def handle(self, *args, **options):
+        try:
+            fh = open(options['path'], encoding='utf-8-sig', newline='')
+        except OSError as e:
+            raise CommandError(f"Cannot open {options['path']}: {e}")
+
+        with fh:
+            result = import_students(fh, batch_size=max(1, options['batch_size']),
+                                     dry_run=options['dry_run'])
+
+        for line, message in result.errors:
+            self.stderr.write(f"line {line}: {message}")
+        if result.error_count > len(result.errors):
+            self.stderr.write(f"... and {result.error_count - len(result.errors)} more errors")
+
+        prefix = "Dry run: " if options['dry_run'] else ""
+        style = self.style.WARNING if result.error_count else self.style.SUCCESS
+        self.stdout.write(style(f"{prefix}{result}"))
@@ -0,0 +1,139 @@
+import random
+import statistics
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from allotment import dashboard_cache
+from allotment.management.commands.generate_cohort import clear_synthetic, generate_cohort
+from allotment.models import Student, MinorBranch, OpenElective, PreferenceWindow
+from allotment.preferences import (
+    PreferenceError, VersionConflict, current_version, submit_preferences, window_status,
+)
+
+
+class _Worker(threading.Thread):
+    """Submits random rankings for its students until `deadline`."""
+
+    def __init__(self, students, branch_ids, oe_ids, deadline, seed):
+        super().__init__(daemon=True)
+        self.students = students
+        self.branch_ids = branch_ids
+        self.oe_ids = oe_ids
+        self.deadline = deadline
+        self.rnd = random.Random(seed)
+        self.latencies = []
+        self.conflicts = 0
+        self.errors = 0
+
+    def ranking(self, ids):
+        return self.rnd.sample(ids, self.rnd.randint(1, min(5, len(ids))))
+
+    def run(self):
+        versions = {}
+        try:
+            while time.monotonic() < self.deadline:
+                student = self.rnd.choice(self.students)
+                if student.id not in versions:
+                    versions[student.id] = current_version(student)
+                rankings = {
+                    'minor1': self.ranking(self.branch_ids),
+                    'minor2': self.ranking(self.branch_ids),
+                    'oe': self.ranking(self.oe_ids),
+                }
+                started = time.perf_counter()
+                try:
+                    versions[student.id] = submit_preferences(student, rankings, versions[student.id])
+                except VersionConflict as e:
+                    self.conflicts += 1
+                    versions[student.id] = e.current_version
+                except (PreferenceError, DatabaseError):
+                    self.errors += 1
+                else:
+                    self.latencies.append(time.perf_counter() - started)
+        finally:
+            connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test preference submission: worker threads submit full Minor 1 / "
+        "Minor 2 / OE rankings through preferences.submit_preferences and the "
+        "sustained submissions per second is reported. Writes preferences, so "
+        "use a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=0,
+                            help='Generate a synthetic cohort of this size (and an open '
+                                 'window) first. Without it existing students are used.')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run.')
+        parser.add_argument('--shared', action='store_true',
+                            help='Let all threads write the same students, to exercise '
+                                 'version conflicts. By default each thread owns its students.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        window = None
+        if options['students']:
+            clear_synthetic()
+            generate_cohort(options['students'], seed=options['seed'])
+            now = timezone.now()
+            window = PreferenceWindow.objects.create(
+                name='Load test', start_at=now - timedelta(minutes=1),
+                end_at=now + timedelta(seconds=options['duration'] + 300),
+            )
+        elif window_status(dashboard_cache.current_window()) != 'open':
+            raise CommandError("The preference window is not open; open it or use --students.")
+
+        try:
+            self.run_workers(options)
+        finally:
+            if window is not None:
+                window.delete()
+                clear_synthetic()
+
+    def run_workers(self, options):
+        students = list(Student.objects.order_by('id'))
+        branch_ids = list(MinorBranch.objects.values_list('id', flat=True))
+        oe_ids = list(OpenElective.objects.values_list('id', flat=True))
+        if not students or not branch_ids or not oe_ids:
+            raise CommandError("Need students, minor branches and open electives.")
+
+        threads = max(1, options['threads'])
+        deadline = time.monotonic() + options['duration']
+        workers = [
+            _Worker(
+                students if options['shared'] else students[i::threads],
+                branch_ids, oe_ids, deadline, options['seed'] + i,
+            )
+            for i in range(threads)
+        ]
+        workers = [w for w in workers if w.students]
+
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(l for w in workers for l in w.latencies)
+        conflicts = sum(w.conflicts for w in workers)
+        errors = sum(w.errors for w in workers)
+        if not latencies:
+            raise CommandError(f"No submission succeeded ({conflicts} conflicts, {errors} errors).")
+
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f"{len(latencies)} submissions in {elapsed:.1f}s with {len(workers)} threads: "
+            f"{len(latencies) / elapsed:.1f}/s, "
+            f"median {statistics.median(latencies) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms"
+        )
+        style = self.style.WARNING if errors else self.style.SUCCESS
+        self.stdout.write(style(f"{conflicts} version conflicts, {errors} errors"))
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from allotment import cohorts, strategies
+from allotment.models import Cohort
+
+
+class Command(BaseCommand):
+    help = (
+        "Allocate every cohort (Minor 1 -> Minor 2 -> OE each) side by side in a "
+        "process pool and report how long each cohort and the whole run took."
+    )
+    # Batch jobs: the checks would import every view and the REST API
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cohort', action='append', dest='codes',
+                            help='Only this cohort code (repeatable).')
+        parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count).')
+        parser.add_argument('--strategy', choices=sorted(strategies.STRATEGIES))
+
+    def handle(self, *args, **options):
+        ids = None
+        if options['codes']:
+            found = dict(Cohort.objects.filter(code__in=options['codes']).values_list('code', 'pk'))
+            missing = sorted(set(options['codes']) - set(found))
+            if missing:
+                raise CommandError(f"Unknown cohort(s): {', '.join(missing)}")
+            ids = list(found.values())
+
+        if not cohorts.can_run_in_parallel():
+            self.stdout.write(self.style.WARNING("This database takes one writer at a time; running sequentially."))
+
+        started = time.perf_counter()
+        results = cohorts.run_cohorts(ids, strategy=options['strategy'], workers=options['workers'])
+        wall = time.perf_counter() - started
+        if not results:
+            raise CommandError("No cohorts to allocate.")
+
+        for result in results:
+            style = self.style.ERROR if result.failed else str
+            self.stdout.write(style(f"  {result.code}: {result.seconds:.2f}s - {result.message}"))
+        total = sum(r.seconds for r in results)
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(results)} cohort(s) in {wall:.2f}s wall time "
+            f"({total:.2f}s of cohort runs, {total / wall:.1f}x)"
+        ))
+        if any(r.failed for r in results):
+            raise CommandError("Some cohorts failed.")
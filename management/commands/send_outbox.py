@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from allotment import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Send the emails that are due in the outbox right here instead of in "
+        "the Celery worker, and report how many went out per second."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help='Stop after trying this many emails.')
+        parser.add_argument('--batch-size', type=int, help='Emails per connection (default: EMAIL_BATCH_SIZE).')
+        parser.add_argument('--rate', type=float,
+                            help='Emails per second at most (default: EMAIL_RATE_LIMIT; 0 for no limit).')
+
+    def handle(self, *args, **options):
+        result = outbox.send_pending(
+            limit=options['limit'], batch_size=options['batch_size'], rate=options['rate'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{result.sent} sent, {result.retrying} to retry, {result.failed} failed - "
+            f"{result.seconds:.2f}s, {outbox.rate_of(result):.1f} emails/s"
+        ))
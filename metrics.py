@@ -0,0 +1,293 @@
+"""
+Timings and counters for allocation runs and the busiest views.
+
+Allocation runners wrap each step of a run in RunMetrics.step():
+
+    load         students, preferences, courses and rules
+    eligibility  the eligibility masks (every rule check of the run)
+    assign       the allocation strategy, per phase
+    write        replacing the allocation rows
+    history      recording the run (history.record_run)
+    waitlist     rebuilding the course waitlists (waitlist.rebuild)
+
+Every step records its wall time, its query count and, for writes, the
+rows written. When the run ends the numbers are added to counters in the
+cache backend and logged as one JSON line on the 'allotment.metrics'
+logger. The email outbox counts its delivery attempts and sending time
+(outbox.send_pending). Views decorated with @instrument_view count requests, time and
+queries the same way; a request slower than settings.SLOW_VIEW_SECONDS is
+logged at INFO, others at DEBUG.
+
+render() returns every counter in the Prometheus text format, for
+views.metrics_view (/metrics/). As with the dashboard cache statistics, the
+counters are only shared between processes when the cache backend is
+(Redis, Memcached); with LocMemCache each process counts for itself.
+
+Profiling: with settings.PROFILING_ENABLED, an admin adding ?profile=1 to
+an instrumented view gets a cProfile dump of that request as a .prof
+download instead of the page (open it with snakeviz, or turn it into a
+flamegraph with flameprof).
+"""
+import cProfile
+import functools
+import json
+import logging
+import marshal
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+
+
+logger = logging.getLogger('allotment.metrics')
+
+KEY = 'allotment:metrics:{name}:{labels}'
+
+RUN_KINDS = ('minor1', 'minor2', 'oe', 'all', 'incremental')
+PHASES = ('minor1', 'minor2', 'oe', 'all')
+STEPS = ('load', 'eligibility', 'assign', 'write', 'history', 'waitlist')
+EMAIL_KINDS = ('otp', 'allocation_result')
+EMAIL_STATUSES = ('sent', 'retried', 'failed')
+
+# name -> (type, help, label names, scale). Seconds are stored as integer
+# microseconds, since cache.incr only adds integers
+METRICS = {
+    'allotment_allocation_runs_total': (
+        'counter', 'Allocation runs, by kind and outcome.', ('run', 'outcome'), 1),
+    'allotment_allocation_last_run_seconds': (
+        'gauge', 'Wall time of the last allocation run of each kind.', ('run',), 10 ** 6),
+    'allotment_allocation_step_seconds_total': (
+        'counter', 'Time spent in each step of allocation runs.', ('run', 'phase', 'step'), 10 ** 6),
+    'allotment_allocation_step_queries_total': (
+        'counter', 'Database queries made in each step of allocation runs.', ('run', 'phase', 'step'), 1),
+    'allotment_allocation_rows_written_total': (
+        'counter', 'Allocation rows written.', ('run', 'phase'), 1),
+    'allotment_view_requests_total': (
+        'counter', 'Requests served by instrumented views.', ('view',), 1),
+    'allotment_view_seconds_total': (
+        'counter', 'Time spent in instrumented views.', ('view',), 10 ** 6),
+    'allotment_view_queries_total': (
+        'counter', 'Database queries made by instrumented views.', ('view',), 1),
+    'allotment_emails_total': (
+        'counter', 'Outbox emails by kind and delivery attempt outcome.', ('kind', 'status'), 1),
+    'allotment_email_send_seconds_total': (
+        'counter', 'Time spent sending outbox batches.', (), 10 ** 6),
+}
+
+# Filled in by @instrument_view at import time
+VIEWS = []
+
+
+class QueryCounter:
+    """execute_wrapper that counts queries (works with DEBUG off)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+# -------------------------
+# Counters
+# -------------------------
+def _key(name, labels):
+    return KEY.format(name=name, labels=','.join(f'{k}={v}' for k, v in labels))
+
+
+def _ordered(name, labels):
+    return [(label, labels[label]) for label in METRICS[name][2]]
+
+
+def _add(name, value, **labels):
+    key = _key(name, _ordered(name, labels))
+    amount = round(value * METRICS[name][3])
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        if not cache.add(key, amount, timeout=None):
+            cache.incr(key, amount)
+
+
+def _set(name, value, **labels):
+    cache.set(_key(name, _ordered(name, labels)), round(value * METRICS[name][3]), timeout=None)
+
+
+def _label_values(label):
+    return {
+        'run': RUN_KINDS, 'phase': PHASES, 'step': STEPS,
+        'outcome': ('success', 'failed'), 'view': VIEWS,
+        'kind': EMAIL_KINDS, 'status': EMAIL_STATUSES,
+    }[label]
+
+
+def _series(labels):
+    """Every combination of values of `labels`, as [((label, value), ...)]."""
+    series = [()]
+    for label in labels:
+        series = [s + ((label, value),) for s in series for value in _label_values(label)]
+    return series
+
+
+def render():
+    """All counters that have a value, in the Prometheus text format."""
+    keys = {
+        (name, labels): _key(name, labels)
+        for name, (_, _, label_names, _) in METRICS.items()
+        for labels in _series(label_names)
+    }
+    values = cache.get_many(keys.values())
+
+    lines = []
+    for name, (kind, help_text, label_names, scale) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels in _series(label_names):
+            value = values.get(keys[name, labels])
+            if value is None:
+                continue
+            label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+            series = f'{name}{{{label_text}}}' if labels else name
+            lines.append(f'{series} {value / scale if scale != 1 else value}')
+    return '\n'.join(lines) + '\n'
+
+
+# -------------------------
+# Allocation runs
+# -------------------------
+class RunMetrics:
+    """Step timings of one allocation run; see allocation_run()."""
+
+    def __init__(self, kind, strategy):
+        self.kind = kind
+        self.strategy = strategy
+        self.steps = []
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def step(self, phase, step):
+        """
+        Time the block and count its queries. Yields the step's record; a
+        write step sets record['rows']. record['seconds'] is filled in
+        when the block exits.
+        """
+        record = {'phase': phase, 'step': step, 'rows': 0}
+        counter = QueryCounter()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(counter):
+                yield record
+        finally:
+            record['seconds'] = time.perf_counter() - started
+            record['queries'] = counter.count
+            self.steps.append(record)
+
+    def finish(self, outcome):
+        seconds = time.perf_counter() - self.started
+        _add('allotment_allocation_runs_total', 1, run=self.kind, outcome=outcome)
+        _set('allotment_allocation_last_run_seconds', seconds, run=self.kind)
+        for record in self.steps:
+            labels = {'run': self.kind, 'phase': record['phase']}
+            _add('allotment_allocation_step_seconds_total', record['seconds'], step=record['step'], **labels)
+            _add('allotment_allocation_step_queries_total', record['queries'], step=record['step'], **labels)
+            if record['rows']:
+                _add('allotment_allocation_rows_written_total', record['rows'], **labels)
+
+        logger.info(json.dumps({
+            'event': 'allocation_run',
+            'run': self.kind,
+            'strategy': self.strategy,
+            'outcome': outcome,
+            'seconds': round(seconds, 4),
+            'queries': sum(r['queries'] for r in self.steps),
+            'rows_written': sum(r['rows'] for r in self.steps),
+            'steps': [
+                dict(record, seconds=round(record['seconds'], 4)) for record in self.steps
+            ],
+        }))
+
+
+@contextmanager
+def allocation_run(kind, strategy):
+    """Yield a RunMetrics for one run; its numbers are recorded on exit."""
+    run = RunMetrics(kind, strategy)
+    try:
+        yield run
+    except Exception:
+        run.finish('failed')
+        raise
+    run.finish('success')
+
+
+# -------------------------
+# Email outbox
+# -------------------------
+def count_emails(kind, status, count=1):
+    """Delivery attempts of outbox emails (status: EMAIL_STATUSES)."""
+    _add('allotment_emails_total', count, kind=kind, status=status)
+
+
+def time_email_batch(seconds):
+    _add('allotment_email_send_seconds_total', seconds)
+
+
+# -------------------------
+# Views
+# -------------------------
+def _profiling_requested(request):
+    return (
+        getattr(settings, 'PROFILING_ENABLED', False)
+        and request.GET.get('profile') == '1'
+        and request.user.is_authenticated
+        and (request.user.is_staff or request.user.is_superuser)
+    )
+
+
+def _profile(view, name, request, *args, **kwargs):
+    profiler = cProfile.Profile()
+    profiler.runcall(view, request, *args, **kwargs)
+    profiler.create_stats()
+
+    # The same bytes profiler.dump_stats() would write to a file
+    response = HttpResponse(marshal.dumps(profiler.stats), content_type='application/octet-stream')
+    response['Content-Disposition'] = f'attachment; filename="{name}-{int(time.time())}.prof"'
+    logger.info(json.dumps({'event': 'view_profile', 'view': name, 'user': request.user.username}))
+    return response
+
+
+def instrument_view(view):
+    """Count requests, time and queries of `view`; see the module docstring."""
+    name = view.__name__
+    VIEWS.append(name)
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if _profiling_requested(request):
+            return _profile(view, name, request, *args, **kwargs)
+
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = view(request, *args, **kwargs)
+        seconds = time.perf_counter() - started
+
+        _add('allotment_view_requests_total', 1, view=name)
+        _add('allotment_view_seconds_total', seconds, view=name)
+        _add('allotment_view_queries_total', counter.count, view=name)
+        level = logging.INFO if seconds >= getattr(settings, 'SLOW_VIEW_SECONDS', 1.0) else logging.DEBUG
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps({
+                'event': 'view',
+                'view': name,
+                'method': request.method,
+                'status': response.status_code,
+                'seconds': round(seconds, 4),
+                'queries': counter.count,
+            }))
+        return response
+
+    return wrapper
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-17 00:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allotment', '0005_allocationjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='allocationjob',
+            name='kind',
+            field=models.CharField(choices=[('minor1', 'Minor 1'), ('minor2', 'Minor 2'), ('oe', 'Open Elective'), ('all', 'Minor 1 → Minor 2 → OE')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+# Case-insensitive prefix indexes for the admin dashboard search
+# (name__istartswith / roll_no__istartswith). The expression has to match
+# the SQL Django emits on each backend for the index to be usable.
+INDEXES = {
+    'postgresql': [
+        'CREATE INDEX IF NOT EXISTS allotment_student_name_ci_idx '
+        'ON allotment_student (UPPER(name::text) varchar_pattern_ops)',
+        'CREATE INDEX IF NOT EXISTS allotment_student_roll_no_ci_idx '
+        'ON allotment_student (UPPER(roll_no::text) varchar_pattern_ops)',
+    ],
+    'sqlite': [
+        'CREATE INDEX IF NOT EXISTS allotment_student_name_ci_idx '
+        'ON allotment_student (name COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS allotment_student_roll_no_ci_idx '
+        'ON allotment_student (roll_no COLLATE NOCASE)',
+    ],
+}
+
+
+def create_indexes(apps, schema_editor):
+    for sql in INDEXES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor in INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS allotment_student_name_ci_idx')
+        schema_editor.execute('DROP INDEX IF EXISTS allotment_student_roll_no_ci_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allotment', '0006_alter_allocationjob_kind'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
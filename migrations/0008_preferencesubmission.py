@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-17 00:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allotment', '0007_student_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreferenceSubmission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='preference_submission', to='allotment.student')),
+            ],
+        ),
+    ]
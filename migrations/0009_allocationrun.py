@@ -0,0 +1,43 @@
+# Generated by Django 5.0 on 2026-10-17 00:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allotment', '0008_preferencesubmission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllocationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('minor1', 'Minor 1'), ('minor2', 'Minor 2'), ('oe', 'Open Elective'), ('all', 'Minor 1 → Minor 2 → OE'), ('incremental', 'Incremental re-allocation')], max_length=20)),
+                ('strategy', models.CharField(max_length=20)),
+                ('parameters', models.JSONField(default=dict)),
+                ('started_at', models.DateTimeField()),
+                ('duration', models.FloatField(help_text='Seconds')),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AllocationRunPhase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phase', models.CharField(max_length=20)),
+                ('duration', models.FloatField(help_text='Seconds')),
+                ('allocated', models.PositiveIntegerField()),
+                ('unallocated', models.PositiveIntegerField()),
+                ('outcomes', models.BinaryField()),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='phases', to='allotment.allocationrun')),
+            ],
+            options={
+                'unique_together': {('run', 'phase')},
+            },
+        ),
+    ]
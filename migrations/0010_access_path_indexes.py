@@ -0,0 +1,83 @@
+from django.db import migrations
+
+
+# Composite indexes for the allocation and dashboard access paths, and one
+# allocation per student and category. The tables belong to models from
+# earlier migrations, so this is plain SQL (valid on PostgreSQL and
+# SQLite) rather than Meta.indexes / Meta.constraints.
+PREFERENCE_TABLES = ['minorpreference', 'doubleminorpreference', 'oepreference']
+ALLOCATION_TABLES = ['minorallocation', 'doubleminorallocation', 'oeallocation']
+
+INDEXES = [
+    # A student's ranked list: WHERE student_id = ? ORDER BY priority
+    *[
+        f'CREATE INDEX IF NOT EXISTS allotment_{table}_student_priority_idx '
+        f'ON allotment_{table} (student_id, priority)'
+        for table in PREFERENCE_TABLES
+    ],
+    # Admin dashboard paging: ORDER BY percentage DESC, roll_no LIMIT n
+    'CREATE INDEX IF NOT EXISTS allotment_student_percentage_idx '
+    'ON allotment_student (percentage DESC, roll_no)',
+    # Also the index for the per-student allocation lookups
+    *[
+        f'CREATE UNIQUE INDEX IF NOT EXISTS allotment_{table}_student_uniq '
+        f'ON allotment_{table} (student_id)'
+        for table in ALLOCATION_TABLES
+    ],
+]
+
+
+def duplicate_allocations(connection):
+    """{table: [roll numbers of the students allocated more than once]}."""
+    duplicates = {}
+    with connection.cursor() as cursor:
+        for table in ALLOCATION_TABLES:
+            cursor.execute(
+                f'SELECT s.roll_no FROM allotment_{table} a '
+                f'JOIN allotment_student s ON s.id = a.student_id '
+                f'GROUP BY a.student_id, s.roll_no HAVING COUNT(*) > 1 ORDER BY s.roll_no'
+            )
+            rolls = [roll for roll, in cursor.fetchall()]
+            if rolls:
+                duplicates[table] = rolls
+    return duplicates
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    # Which of a student's allocations is right is not ours to decide: stop
+    # and name them rather than drop rows the admin may want to keep
+    duplicates = duplicate_allocations(schema_editor.connection)
+    if duplicates:
+        listed = '; '.join(
+            f"allotment_{table}: {len(rolls)} student(s), "
+            f"{', '.join(rolls[:20])}{', ...' if len(rolls) > 20 else ''}"
+            for table, rolls in duplicates.items()
+        )
+        raise RuntimeError(
+            f"Some students are allocated more than once, which the unique indexes "
+            f"of this migration forbid ({listed}). Delete the extra rows (the "
+            f"allocation runs read the one with the lowest id), then migrate again."
+        )
+    for sql in INDEXES:
+        schema_editor.execute(sql)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    for sql in INDEXES:
+        name = sql.split(' IF NOT EXISTS ')[1].split()[0]
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allotment', '0009_allocationrun'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0 on 2026-10-17 00:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allotment', '0010_access_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Waitlist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phase', models.CharField(max_length=20, unique=True)),
+                ('entries', models.BinaryField()),
+                ('built_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='allotment.allocationrun')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SeatRelease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phase', models.CharField(max_length=20)),
+                ('course_id', models.PositiveIntegerField()),
+                ('reason', models.CharField(choices=[('withdrawn', 'Withdrawn by student'), ('removed', 'Removed by admin')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('released_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_releases', to='allotment.student')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['phase', 'processed_at'], name='seatrelease_pending_idx')],
+            },
+        ),
+    ]
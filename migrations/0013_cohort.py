@@ -0,0 +1,79 @@
+# Generated by Django 5.0 on 2026-10-17 01:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allotment', '0012_outboxemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cohort',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.SlugField(unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['code'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='allocationjob',
+            name='kind',
+            field=models.CharField(choices=[('minor1', 'Minor 1'), ('minor2', 'Minor 2'), ('oe', 'Open Elective'), ('all', 'Minor 1 → Minor 2 → OE'), ('cohorts', 'Every cohort, in parallel')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='allocationrun',
+            name='kind',
+            field=models.CharField(choices=[('minor1', 'Minor 1'), ('minor2', 'Minor 2'), ('oe', 'Open Elective'), ('all', 'Minor 1 → Minor 2 → OE'), ('cohorts', 'Every cohort, in parallel'), ('incremental', 'Incremental re-allocation')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='waitlist',
+            name='phase',
+            field=models.CharField(max_length=20),
+        ),
+        migrations.AddField(
+            model_name='allocationrun',
+            name='cohort',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='allocation_runs', to='allotment.cohort'),
+        ),
+        migrations.AddField(
+            model_name='waitlist',
+            name='cohort',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='allotment.cohort'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='waitlist',
+            unique_together={('phase', 'cohort')},
+        ),
+        migrations.CreateModel(
+            name='CohortMinorBranch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('branch', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cohort_link', to='allotment.minorbranch')),
+                ('cohort', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='minor_branches', to='allotment.cohort')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CohortOpenElective',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cohort', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='open_electives', to='allotment.cohort')),
+                ('oe_subject', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cohort_link', to='allotment.openelective')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CohortStudent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cohort', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='students', to='allotment.cohort')),
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cohort_link', to='allotment.student')),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0 on 2026-10-17 01:22
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_extra_active_jobs(apps, schema_editor):
+    # Jobs left queued or running by a lost worker would break the
+    # constraint; keep only the newest one active
+    AllocationJob = apps.get_model('allotment', 'AllocationJob')
+    active = AllocationJob.objects.filter(status__in=['queued', 'running']).order_by('-created_at', '-pk')
+    newest = active.values_list('pk', flat=True).first()
+    active.exclude(pk=newest).update(
+        status='failed', finished_at=timezone.now(),
+        message='Allocation failed: the job was lost and marked failed by migration 0014.',
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allotment', '0013_cohort'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_extra_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='allocationjob',
+            constraint=models.UniqueConstraint(models.Value(1), condition=models.Q(('status__in', ['queued', 'running'])), name='one_active_allocation_job'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0 on 2026-10-17 01:34
+
+from django.db import migrations, models
+
+
+def drop_duplicate_waitlists(apps, schema_editor):
+    # unique_together let concurrent runs store several deployment-wide
+    # waitlists of one phase; keep the newest of each. Waitlists are
+    # derived data, rebuilt by the next run.
+    Waitlist = apps.get_model('allotment', 'Waitlist')
+    for phase in Waitlist.objects.filter(cohort__isnull=True).values_list('phase', flat=True).distinct():
+        stale = Waitlist.objects.filter(phase=phase, cohort__isnull=True).order_by('-built_at', '-pk')
+        newest = stale.values_list('pk', flat=True).first()
+        stale.exclude(pk=newest).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allotment', '0015_simulationjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_waitlists, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='waitlist',
+            constraint=models.UniqueConstraint(condition=models.Q(('cohort__isnull', True)), fields=('phase',), name='one_waitlist_per_phase_without_cohort'),
+        ),
+    ]
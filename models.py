@@ -0,0 +1,295 @@
+from django.db import models
+from django.conf import settings
+
+
+class AllocationJob(models.Model):
+    """
+    One queued allocation run (see tasks.run_allocation_job).
+    Progress fields are updated by the worker while the run is in flight
+    and polled by the admin dashboard.
+    """
+    KIND_CHOICES = [
+        ('minor1', 'Minor 1'),
+        ('minor2', 'Minor 2'),
+        ('oe', 'Open Elective'),
+        ('all', 'Minor 1 → Minor 2 → OE'),
+        ('cohorts', 'Every cohort, in parallel'),
+    ]
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCESS = 'success'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCESS, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    phase = models.CharField(max_length=30, blank=True, default='')
+    processed = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    message = models.TextField(blank=True, default='')
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text='Seconds')
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # At most one job queued or running at a time
+            models.UniqueConstraint(
+                models.Value(1), condition=models.Q(status__in=['queued', 'running']),
+                name='one_active_allocation_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} run #{self.pk} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_SUCCESS, self.STATUS_FAILED)
+
+
+class SimulationJob(models.Model):
+    """
+    One queued what-if simulation (see simulation.py), of one cohort once
+    cohorts are defined. The worker (tasks.run_simulation_job) stores one
+    summary per scenario in `results`, or why it failed in `message`; the
+    client polls views.allocation_simulation_status.
+    """
+    STATUS_CHOICES = AllocationJob.STATUS_CHOICES
+
+    scenarios = models.JSONField()
+    cohort = models.ForeignKey('Cohort', null=True, blank=True, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=AllocationJob.STATUS_QUEUED)
+    results = models.JSONField(null=True, blank=True)
+    message = models.TextField(blank=True, default='')
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text='Seconds')
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Simulation #{self.pk} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (AllocationJob.STATUS_SUCCESS, AllocationJob.STATUS_FAILED)
+
+
+class PreferenceSubmission(models.Model):
+    """
+    Per-student version counter for preference submissions.
+
+    Every accepted submission bumps `version`; a submission made against an
+    older version is rejected (optimistic locking, see
+    preferences.submit_preferences), so two open tabs can't silently
+    overwrite each other.
+    """
+    student = models.OneToOneField(
+        'Student', on_delete=models.CASCADE, related_name='preference_submission'
+    )
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.student} v{self.version}"
+
+
+class AllocationRun(models.Model):
+    """
+    One allocation run, kept for history (see history.py).
+    `parameters` holds the strategy, course names/capacities and the
+    eligibility rules in force, so old runs can be explained later.
+    """
+    KIND_CHOICES = AllocationJob.KIND_CHOICES + [
+        ('incremental', 'Incremental re-allocation'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    cohort = models.ForeignKey(
+        'Cohort', null=True, blank=True, on_delete=models.SET_NULL, related_name='allocation_runs',
+    )
+    strategy = models.CharField(max_length=20)
+    parameters = models.JSONField(default=dict)
+    started_at = models.DateTimeField()
+    duration = models.FloatField(help_text='Seconds')
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"{self.get_kind_display()} run #{self.pk}"
+
+
+class AllocationRunPhase(models.Model):
+    """
+    Outcomes of one phase of an AllocationRun: one entry per student,
+    packed as compressed NumPy arrays in `outcomes` (see history.pack).
+    """
+    run = models.ForeignKey(AllocationRun, on_delete=models.CASCADE, related_name='phases')
+    phase = models.CharField(max_length=20)
+    duration = models.FloatField(help_text='Seconds')
+    allocated = models.PositiveIntegerField()
+    unallocated = models.PositiveIntegerField()
+    outcomes = models.BinaryField()
+
+    class Meta:
+        unique_together = [('run', 'phase')]
+
+    def __str__(self):
+        return f"{self.run} {self.phase}"
+
+
+class Waitlist(models.Model):
+    """
+    Per-course waitlists of one phase (of one cohort, or of the whole
+    deployment when `cohort` is empty), derived from the last allocation
+    run (see waitlist.py). `entries` holds the ranked heaps as packed arrays.
+    """
+    phase = models.CharField(max_length=20)
+    cohort = models.ForeignKey('Cohort', null=True, blank=True, on_delete=models.CASCADE)
+    run = models.ForeignKey(AllocationRun, null=True, blank=True, on_delete=models.SET_NULL)
+    entries = models.BinaryField()
+    built_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [('phase', 'cohort')]
+        constraints = [
+            # unique_together lets NULLs repeat: one deployment-wide waitlist per phase
+            models.UniqueConstraint(
+                fields=['phase'], condition=models.Q(cohort__isnull=True),
+                name='one_waitlist_per_phase_without_cohort',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.phase} waitlist" + (f" ({self.cohort_id})" if self.cohort_id else "")
+
+
+class SeatRelease(models.Model):
+    """
+    A seat given up by a student (withdrawal) or taken away by an admin.
+    The allocation row is deleted right away; the seat is handed to the
+    waitlist by the next backfill batch, which sets `processed_at`.
+    """
+    REASON_WITHDRAWN = 'withdrawn'
+    REASON_REMOVED = 'removed'
+    REASON_CHOICES = [
+        (REASON_WITHDRAWN, 'Withdrawn by student'),
+        (REASON_REMOVED, 'Removed by admin'),
+    ]
+
+    phase = models.CharField(max_length=20)
+    student = models.ForeignKey('Student', on_delete=models.CASCADE, related_name='seat_releases')
+    course_id = models.PositiveIntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    released_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['phase', 'processed_at'], name='seatrelease_pending_idx')]
+
+    def __str__(self):
+        return f"{self.student_id} released {self.phase} seat {self.course_id}"
+
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be sent, or sent. Views and tasks queue mail here
+    (outbox.enqueue) and tasks.send_outbox delivers it in batches over one
+    connection; see outbox.py.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    # Lower is sent first: OTPs go ahead of a results mailing
+    PRIORITY_URGENT = 0
+    PRIORITY_BULK = 10
+
+    kind = models.CharField(max_length=30)
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True, default='')
+    priority = models.PositiveSmallIntegerField(default=PRIORITY_BULK)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'priority', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} to {self.to} ({self.status})"
+
+
+class Cohort(models.Model):
+    """
+    A partition of the deployment: one programme and academic year.
+    Students and courses join a cohort through CohortStudent,
+    CohortMinorBranch and CohortOpenElective (all reachable as
+    `cohort_link`); rules, preferences and allocations belong to the cohort
+    of their student or course. See cohorts.py.
+    """
+    code = models.SlugField(max_length=50, unique=True)
+    name = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['code']
+
+    def __str__(self):
+        return self.name
+
+
+class CohortStudent(models.Model):
+    student = models.OneToOneField('Student', on_delete=models.CASCADE, related_name='cohort_link')
+    cohort = models.ForeignKey(Cohort, on_delete=models.CASCADE, related_name='students')
+
+    def __str__(self):
+        return f"{self.student_id} in {self.cohort_id}"
+
+
+class CohortMinorBranch(models.Model):
+    branch = models.OneToOneField('MinorBranch', on_delete=models.CASCADE, related_name='cohort_link')
+    cohort = models.ForeignKey(Cohort, on_delete=models.CASCADE, related_name='minor_branches')
+
+    def __str__(self):
+        return f"{self.branch_id} in {self.cohort_id}"
+
+
+class CohortOpenElective(models.Model):
+    oe_subject = models.OneToOneField('OpenElective', on_delete=models.CASCADE, related_name='cohort_link')
+    cohort = models.ForeignKey(Cohort, on_delete=models.CASCADE, related_name='open_electives')
+
+    def __str__(self):
+        return f"{self.oe_subject_id} in {self.cohort_id}"
@@ -0,0 +1,334 @@
+"""
+Email outbox.
+
+Nothing sends mail inside a request. enqueue() / enqueue_many() store
+OutboxEmail rows, and once the transaction commits a tasks.send_outbox
+batch is queued; enqueues made while one is already waiting share it.
+The worker (send_pending) then delivers everything that is due:
+
+* Rows are claimed EMAIL_BATCH_SIZE at a time, most urgent first (an OTP
+  is never stuck behind a results mailing), with SELECT ... FOR UPDATE
+  SKIP LOCKED where the database has it. Elsewhere (SQLite) each row is
+  claimed by an UPDATE that only matches it while it is still due, so
+  several workers can drain the outbox together without sending a
+  message twice. A claim leases the rows for CLAIM_TIMEOUT seconds; a
+  worker that dies mid-batch leaves them to be picked up again.
+* Each batch opens one connection (get_connection()) and passes every
+  message through its send_messages(), so an SMTP backend logs in once
+  per batch instead of once per email, and a message that fails doesn't
+  take the rest of the batch with it.
+* A failed message is retried after RETRY_DELAY * 2^(attempt - 1)
+  seconds (at most MAX_RETRY_DELAY) and marked failed after
+  EMAIL_MAX_ATTEMPTS attempts.
+* An OTP's body is cleared once it is sent or has failed for good, so
+  the outbox doesn't keep codes around.
+* settings.EMAIL_RATE_LIMIT (messages per second, per worker) paces the
+  sending for providers that throttle; None sends as fast as possible.
+
+Works with any EMAIL_BACKEND: the console and locmem backends are fine
+for development and tests. Every batch is counted in the metrics
+(allotment_emails_total, allotment_email_send_seconds_total) and logged
+with its messages per second; the send_outbox command drains the outbox
+by hand and prints the same figures.
+"""
+import logging
+import time
+from collections import Counter, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import engine, metrics
+from .models import OutboxEmail, Student
+
+
+logger = logging.getLogger(__name__)
+
+KIND_OTP = 'otp'
+KIND_ALLOCATION_RESULT = 'allocation_result'
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 3600
+# Seconds a claimed batch is reserved for the worker that claimed it
+CLAIM_TIMEOUT = 600
+PENDING_KEY = 'allotment:outbox-pending'
+RETRY_KEY = 'allotment:outbox-retry'
+
+SendResult = namedtuple('SendResult', ['sent', 'retrying', 'failed', 'seconds'])
+
+
+class NotSent(Exception):
+    """The mail backend returned without error but didn't send the message."""
+
+
+# -------------------------
+# Queueing
+# -------------------------
+def _row(kind, to, subject, body, priority, from_email, now):
+    return OutboxEmail(
+        kind=kind, to=to, subject=subject, body=body, priority=priority,
+        from_email=from_email or '', next_attempt_at=now,
+    )
+
+
+def enqueue(kind, to, subject, body, priority=OutboxEmail.PRIORITY_BULK, from_email=None):
+    """Queue one email; it goes out after the current transaction commits."""
+    email = _row(kind, to, subject, body, priority, from_email, timezone.now())
+    email.save()
+    transaction.on_commit(schedule)
+    return email
+
+
+def enqueue_many(kind, messages, priority=OutboxEmail.PRIORITY_BULK, from_email=None):
+    """Queue (to, subject, body) tuples in bulk. Returns how many were queued."""
+    now = timezone.now()
+    rows = [_row(kind, to, subject, body, priority, from_email, now) for to, subject, body in messages]
+    OutboxEmail.objects.bulk_create(rows, batch_size=engine.BULK_BATCH_SIZE)
+    if rows:
+        transaction.on_commit(schedule)
+    return len(rows)
+
+
+def schedule(countdown=0):
+    """Queue a send_outbox batch, unless one is already waiting."""
+    from .tasks import send_outbox
+
+    if cache.add(PENDING_KEY, True, timeout=max(countdown, 60) * 2):
+        send_outbox.apply_async(countdown=countdown)
+
+
+def schedule_retry(countdown):
+    """
+    Queue a batch for when the next retry is due, unless one is already
+    queued for that time or earlier. Separate from schedule(), so new mail
+    never waits for a retry.
+    """
+    from .tasks import send_outbox
+
+    eta = time.time() + countdown
+    queued = cache.get(RETRY_KEY)
+    if queued is None or queued < time.time() or queued > eta + 1:
+        cache.set(RETRY_KEY, eta, timeout=countdown + 60)
+        send_outbox.apply_async(countdown=countdown)
+
+
+# -------------------------
+# Sending
+# -------------------------
+class _Pacer:
+    """Sleeps just enough to keep to `rate` messages per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next > now:
+            time.sleep(self.next - now)
+        self.next = max(self.next, now) + self.interval
+
+
+def _due(now):
+    return OutboxEmail.objects.filter(status=OutboxEmail.STATUS_PENDING, next_attempt_at__lte=now)
+
+
+def _lease(pk, now, lease):
+    """Claim one row if it is still due; False when another worker got it first."""
+    return bool(_due(now).filter(pk=pk).update(attempts=F('attempts') + 1, next_attempt_at=lease))
+
+
+def _claim(batch_size):
+    """Lease up to `batch_size` due rows to this worker and return them."""
+    now = timezone.now()
+    lease = now + timedelta(seconds=CLAIM_TIMEOUT)
+    due = _due(now).order_by('priority', 'next_attempt_at', 'pk')
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            batch = list(due.select_for_update(skip_locked=True)[:batch_size])
+            OutboxEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+                attempts=F('attempts') + 1, next_attempt_at=lease,
+            )
+    else:
+        # Another worker may have read the same rows: keep only those this
+        # worker's conditional UPDATE leased
+        batch = [email for email in due[:batch_size] if _lease(email.pk, now, lease)]
+    for email in batch:
+        email.attempts += 1
+        email.next_attempt_at = lease
+    return batch
+
+
+def _retry_delay(attempts):
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def _send_batch(batch, pacer):
+    """Send `batch` over one connection. Returns (sent ids, {email: error})."""
+    default_from = settings.DEFAULT_FROM_EMAIL
+    sent, errors = [], {}
+    mail = get_connection(fail_silently=False)
+    try:
+        mail.open()
+    except Exception as e:
+        return sent, {email: e for email in batch}
+
+    try:
+        for email in batch:
+            pacer.wait()
+            message = EmailMessage(
+                email.subject, email.body, email.from_email or default_from, [email.to], connection=mail,
+            )
+            try:
+                # A backend that swallows its errors (fail_silently) reports 0 sent
+                if mail.send_messages([message]) != 1:
+                    raise NotSent("The mail backend did not send the message.")
+            except Exception as e:
+                errors[email] = e
+                # The connection may be what broke: reconnect for the rest of the batch
+                mail.close()
+                try:
+                    mail.open()
+                except Exception:
+                    pass
+            else:
+                sent.append(email.pk)
+    finally:
+        mail.close()
+    return sent, errors
+
+
+def _settle(sent, errors, max_attempts):
+    now = timezone.now()
+    if sent:
+        OutboxEmail.objects.filter(pk__in=sent).update(
+            status=OutboxEmail.STATUS_SENT, sent_at=now, last_error='',
+        )
+        # An OTP is a credential: don't keep it once it is delivered
+        OutboxEmail.objects.filter(pk__in=sent, kind=KIND_OTP).update(body='')
+    retrying = failed = 0
+    for email, error in errors.items():
+        email.last_error = f"{type(error).__name__}: {error}"
+        if email.attempts >= max_attempts:
+            email.status = OutboxEmail.STATUS_FAILED
+            if email.kind == KIND_OTP:
+                email.body = ''
+            failed += 1
+            logger.warning("Giving up on email %s to %s: %s", email.pk, email.to, email.last_error)
+        else:
+            email.next_attempt_at = now + timedelta(seconds=_retry_delay(email.attempts))
+            retrying += 1
+    OutboxEmail.objects.bulk_update(list(errors), ['status', 'next_attempt_at', 'last_error', 'body'])
+    return retrying, failed
+
+
+def _count(batch, sent, errors, max_attempts):
+    sent = set(sent)
+    counts = Counter()
+    for email in batch:
+        if email.pk in sent:
+            counts[email.kind, 'sent'] += 1
+        elif email in errors:
+            counts[email.kind, 'failed' if email.attempts >= max_attempts else 'retried'] += 1
+    for (kind, status), count in counts.items():
+        metrics.count_emails(kind, status, count)
+
+
+def send_pending(limit=None, batch_size=None, rate=None):
+    """
+    Send due emails, batch after batch, until none are due (or `limit`
+    have been tried). Returns a SendResult.
+    """
+    batch_size = batch_size or getattr(settings, 'EMAIL_BATCH_SIZE', BATCH_SIZE)
+    max_attempts = getattr(settings, 'EMAIL_MAX_ATTEMPTS', MAX_ATTEMPTS)
+    pacer = _Pacer(rate if rate is not None else getattr(settings, 'EMAIL_RATE_LIMIT', None))
+
+    started = time.perf_counter()
+    sent = retrying = failed = tried = 0
+    while limit is None or tried < limit:
+        batch = _claim(batch_size if limit is None else min(batch_size, limit - tried))
+        if not batch:
+            break
+        batch_started = time.perf_counter()
+        sent_ids, errors = _send_batch(batch, pacer)
+        batch_retrying, batch_failed = _settle(sent_ids, errors, max_attempts)
+        metrics.time_email_batch(time.perf_counter() - batch_started)
+        _count(batch, sent_ids, errors, max_attempts)
+
+        tried += len(batch)
+        sent += len(sent_ids)
+        retrying += batch_retrying
+        failed += batch_failed
+
+    result = SendResult(sent, retrying, failed, time.perf_counter() - started)
+    if tried:
+        logger.info(
+            "Outbox: %d sent, %d to retry, %d failed in %.2fs (%.1f emails/s)",
+            sent, retrying, failed, result.seconds, rate_of(result),
+        )
+    return result
+
+
+def rate_of(result):
+    """Emails sent per second in a SendResult."""
+    return result.sent / result.seconds if result.seconds else 0.0
+
+
+def next_due():
+    """Seconds until the earliest pending retry, or None when nothing is waiting."""
+    first = OutboxEmail.objects.filter(status=OutboxEmail.STATUS_PENDING).order_by('next_attempt_at').values_list(
+        'next_attempt_at', flat=True
+    ).first()
+    if first is None:
+        return None
+    return max((first - timezone.now()).total_seconds(), 0)
+
+
+# -------------------------
+# Messages
+# -------------------------
+def queue_otp(email, otp):
+    enqueue(
+        KIND_OTP, email, "SmartAllot Password Reset OTP",
+        f"Your OTP for password reset is: {otp}\nThis code is valid for a short time.",
+        priority=OutboxEmail.PRIORITY_URGENT,
+    )
+
+
+def queue_allocation_results():
+    """Queue one email per student with their current allocations. Returns the count."""
+    courses = {}
+    for spec in (engine.MINOR1, engine.MINOR2, engine.OE):
+        courses[spec.name] = dict(spec.allocation_model.objects.values_list(
+            'student_id', f'{spec.course_field}__name'
+        ))
+
+    def line(label, name):
+        return f"{label}: {name or 'not allocated'}"
+
+    messages = []
+    for student_id, name, roll_no, email in Student.objects.exclude(email='').order_by('pk').values_list(
+        'id', 'name', 'roll_no', 'email'
+    ).iterator(chunk_size=2000):
+        messages.append((email, "SmartAllot allocation results", '\n'.join([
+            f"Dear {name} ({roll_no}),",
+            "",
+            "The Minor and Open Elective allocation results are out:",
+            "",
+            line("Minor 1", courses['minor1'].get(student_id)),
+            line("Minor 2", courses['minor2'].get(student_id)),
+            line("Open Elective", courses['oe'].get(student_id)),
+            "",
+            "Log in to SmartAllot for the details and your allotment letter.",
+        ])))
+    with transaction.atomic():
+        return enqueue_many(KIND_ALLOCATION_RESULT, messages)
@@ -0,0 +1,169 @@
+"""
+Preference submission, shared by the student dashboard form and the JSON
+API (views.preference_api).
+
+A submission replaces one or more of a student's ranked lists with one
+bulk_create per list, inside a transaction that first claims the next
+version of the student's PreferenceSubmission row:
+
+    UPDATE ... SET version = version + 1 WHERE student = s AND version = v
+
+Exactly one of several concurrent submissions made against version v
+matches; the others get VersionConflict and must reload. The claimed row
+also serialises the list writes of one student. A submission without a
+version is refused rather than checked against the current one. When
+the database can't take the write in time (SQLite's "database is
+locked", a lock timeout) nothing is saved and Busy is raised, so the
+student can try again.
+
+The allocation tie-break is the earliest `submitted_at` of a list (see
+engine.load_phase). It is kept when a list is edited, so a student's
+place among equal percentages is their first submission time and doesn't
+depend on how often, or how concurrently, they saved afterwards.
+"""
+import logging
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from . import dashboard_cache
+from .dashboard_cache import current_version
+from .models import (
+    PreferenceSubmission,
+    MinorPreference, DoubleMinorPreference, OEPreference,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# category -> (preference model, course field, course catalog key)
+CATEGORIES = {
+    'minor1': (MinorPreference, 'minor_branch', 'minor'),
+    'minor2': (DoubleMinorPreference, 'minor_branch', 'minor'),
+    'oe': (OEPreference, 'oe_subject', 'oe'),
+}
+
+
+class PreferenceError(Exception):
+    """A submission that was not saved; str() is shown to the student."""
+
+
+class WindowClosed(PreferenceError):
+    pass
+
+
+class InvalidRanking(PreferenceError):
+    pass
+
+
+class VersionConflict(PreferenceError):
+    def __init__(self, current_version, message=None):
+        super().__init__(message or (
+            "Your preferences were changed elsewhere (another tab or device). "
+            "Please reload and try again."
+        ))
+        self.current_version = current_version
+
+
+class Busy(PreferenceError):
+    def __init__(self):
+        super().__init__(
+            "The server is busy and your preferences were not saved. Please try again in a moment."
+        )
+
+
+def window_status(window):
+    """'no_window', 'not_started', 'open' or 'ended'."""
+    if window is None or not window.is_active:
+        return 'no_window'
+    now = timezone.now()
+    if now < window.start_at:
+        return 'not_started'
+    if now > window.end_at:
+        return 'ended'
+    return 'open'
+
+
+def clean_ranking(category, course_ids, catalog):
+    """`course_ids` as a list of known course ids without repeats."""
+    if category not in CATEGORIES:
+        raise InvalidRanking(f"Unknown preference list '{category}'.")
+    known = {course['id'] for course in catalog[CATEGORIES[category][2]]}
+
+    cleaned = []
+    for value in course_ids:
+        try:
+            course_id = int(value)
+        except (TypeError, ValueError):
+            raise InvalidRanking(f"'{value}' is not a course id.")
+        if course_id not in known:
+            raise InvalidRanking(f"Course {course_id} does not exist.")
+        if course_id in cleaned:
+            raise InvalidRanking(f"Course {course_id} is ranked more than once.")
+        cleaned.append(course_id)
+    return cleaned
+
+
+def submit_preferences(student, rankings, version):
+    """
+    Replace the lists in `rankings` (category -> course ids in priority
+    order; categories left out are not touched), provided the student's
+    preferences are still at `version`.
+
+    Raises WindowClosed, InvalidRanking, VersionConflict or Busy; returns
+    the new version.
+    """
+    if version is None:
+        raise VersionConflict(
+            current_version(student), "This form is out of date. Please reload the page and try again.",
+        )
+    if window_status(dashboard_cache.current_window()) != 'open':
+        raise WindowClosed("The preference window is closed. Your preferences were not changed.")
+
+    # Only courses of the student's own cohort can be ranked
+    catalog = dashboard_cache.course_catalog(dashboard_cache.student_cohort_id(student))
+    cleaned = {
+        category: clean_ranking(category, course_ids, catalog)
+        for category, course_ids in rankings.items()
+    }
+
+    try:
+        _save(student, cleaned, version)
+    except OperationalError as e:
+        logger.warning("Preferences of student %s not saved: %s", student.pk, e)
+        raise Busy()
+    return version + 1
+
+
+def _save(student, cleaned, version):
+    with transaction.atomic():
+        # Write first, so the transaction takes its write lock up front
+        claimed = PreferenceSubmission.objects.filter(
+            student=student, version=version
+        ).update(version=F('version') + 1, updated_at=timezone.now())
+        if not claimed and version == 0:
+            # First submission: the row doesn't exist yet
+            try:
+                with transaction.atomic():
+                    PreferenceSubmission.objects.create(student=student, version=1)
+                claimed = 1
+            except IntegrityError:
+                pass
+        if not claimed:
+            raise VersionConflict(current_version(student))
+
+        for category, course_ids in cleaned.items():
+            model, course_field, _ = CATEGORIES[category]
+            rows = model.objects.filter(student=student)
+            first_submitted = rows.aggregate(first=Min('submitted_at'))['first']
+            rows.delete()
+            model.objects.bulk_create([
+                model(student=student, priority=priority, **{f'{course_field}_id': course_id})
+                for priority, course_id in enumerate(course_ids, start=1)
+            ])
+            if first_submitted is not None and course_ids:
+                # bulk_create stamps submitted_at with now (auto_now_add)
+                rows.update(submitted_at=first_submitted)
+
+        transaction.on_commit(lambda: dashboard_cache.invalidate_student(student.user_id))
@@ -0,0 +1,92 @@
+"""
+Allocation report export (CSV and XLSX), streamed so memory stays flat
+whatever the cohort size.
+
+One row per student. Allocations are joined in as subquery annotations and
+the rows are read with .iterator(chunk_size=...) as plain tuples.
+"""
+import csv
+import tempfile
+
+from django.db.models import OuterRef, Subquery
+
+from .models import Student, MinorAllocation, DoubleMinorAllocation, OEAllocation
+
+
+CHUNK_SIZE = 2000
+
+# key -> header; the order here is the order in the report
+REPORT_COLUMNS = {
+    'roll_no': 'Roll No',
+    'name': 'Name',
+    'department': 'Department',
+    'percentage': 'Percentage',
+    'email': 'Email',
+    'minor1': 'Minor 1',
+    'minor1_explanation': 'Minor 1 Explanation',
+    'minor2': 'Minor 2',
+    'oe': 'Open Elective',
+}
+DEFAULT_COLUMNS = ['roll_no', 'name', 'department', 'percentage', 'minor1', 'minor2', 'oe']
+
+
+def _allocated(model, field):
+    return Subquery(
+        model.objects.filter(student=OuterRef('pk')).order_by('pk').values(field)[:1]
+    )
+
+
+def select_columns(requested):
+    """Known columns from `requested` in report order, or the defaults."""
+    columns = [key for key in REPORT_COLUMNS if key in set(requested)]
+    return columns or list(DEFAULT_COLUMNS)
+
+
+def report_rows(columns, departments=None):
+    """Tuples of `columns` for every student, read in chunks."""
+    students = Student.objects.all()
+    if departments:
+        students = students.filter(department__in=departments)
+
+    annotations = {
+        'minor1': _allocated(MinorAllocation, 'minor_branch__name'),
+        'minor1_explanation': _allocated(MinorAllocation, 'explanation'),
+        'minor2': _allocated(DoubleMinorAllocation, 'minor_branch__name'),
+        'oe': _allocated(OEAllocation, 'oe_subject__name'),
+    }
+    students = students.annotate(**{k: v for k, v in annotations.items() if k in columns})
+
+    return students.order_by('roll_no').values_list(*columns).iterator(chunk_size=CHUNK_SIZE)
+
+
+class _Echo:
+    """File-like object whose write() just returns the value (for csv.writer)."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(columns, departments=None):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([REPORT_COLUMNS[c] for c in columns])
+    for row in report_rows(columns, departments):
+        yield writer.writerow(['' if value is None else value for value in row])
+
+
+def write_xlsx(columns, departments=None):
+    """
+    Write the report through a write-only workbook (rows are not kept in
+    memory) into a temporary file and return it, rewound.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Allocations')
+    sheet.append([REPORT_COLUMNS[c] for c in columns])
+    for row in report_rows(columns, departments):
+        sheet.append(list(row))
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return output
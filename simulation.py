@@ -0,0 +1,286 @@
+"""
+What-if allocation runs that never write to the database.
+
+A Snapshot loads students, preferences, courses and every eligibility
+rule (active or not) once, of one cohort when given (cohorts never
+compete for seats, so each is simulated on its own). A scenario is a set of overrides applied on
+top of it:
+
+    {
+        "name": "More AI seats",
+        "strategy": "greedy",                         # optional, see strategies.py
+        "capacity": {"minor": {"12": 60}, "oe": {"3": 0}},
+        "rules": {"minor": {"7": false}},             # rule id -> active
+        "min_percentage": {"oe": {"3": 65, "4": null}},  # course id -> threshold (null: none)
+    }
+
+and runs Minor 1 -> Minor 2 -> OE in memory, returning per-phase summary
+statistics (fill rate per course, unallocated count, preference rank
+distribution). An empty scenario describes the current setup.
+
+Simulations run in the Celery worker (tasks.run_simulation_job), never
+in a web request. There several scenarios run in parallel in a forked
+process pool: the snapshot is built once, handed to the pool's
+initializer (with fork it is inherited copy-on-write, not pickled) and
+the workers receive only the scenario dicts. The pool is billiard's,
+Celery's fork of multiprocessing, which unlike multiprocessing lets a
+prefork worker child (a daemonic process) start processes of its own.
+"""
+import copy
+import gc
+import multiprocessing
+import os
+from collections import Counter, namedtuple
+
+import billiard
+from django.db import connections
+
+from . import engine, strategies
+from .eligibility import CompiledRules, StudentColumns
+from .models import EligibilityRule, OEEligibilityRule
+
+
+MAX_SCENARIOS = 20
+
+# course type -> phases drawing on those courses
+COURSE_TYPES = {'minor': ['minor1', 'minor2'], 'oe': ['oe']}
+
+Rule = namedtuple('Rule', ['id', 'course_id', 'rule_type', 'value', 'is_active'])
+
+
+class SimulationError(ValueError):
+    """A scenario that can't be run; str() says why."""
+
+
+class Snapshot:
+    """Everything a scenario needs, read once and never written."""
+
+    def __init__(self, cohort=None):
+        self.students = engine.load_students(cohort=cohort)
+        self.columns = StudentColumns(self.students)
+
+        minor1 = engine.load_phase(engine.MINOR1, cohort=cohort)
+        self.phases = {
+            'minor1': minor1,
+            'minor2': engine.load_phase(engine.MINOR2, courses=minor1.courses, cohort=cohort),
+            'oe': engine.load_phase(engine.OE, cohort=cohort),
+        }
+        self.rules = {
+            'minor': self._load_rules(EligibilityRule, 'branch', cohort),
+            'oe': self._load_rules(OEEligibilityRule, 'oe_subject', cohort),
+        }
+
+    @staticmethod
+    def _load_rules(rule_model, course_field, cohort):
+        rules = engine.in_cohort(rule_model.objects.all(), cohort, f'{course_field}__')
+        return [
+            Rule(*row) for row in rules.order_by('pk').values_list(
+                'id', f'{course_field}_id', 'rule_type', 'value', 'is_active'
+            )
+        ]
+
+
+# -------------------------
+# Scenarios
+# -------------------------
+def _overrides(raw, key, course_type, known_ids, convert):
+    section = raw.get(key) or {}
+    if not isinstance(section, dict):
+        raise SimulationError(f"'{key}' must map 'minor' / 'oe' to overrides.")
+    values = section.get(course_type) or {}
+    if not isinstance(values, dict):
+        raise SimulationError(f"'{key}.{course_type}' must map ids to values.")
+
+    cleaned = {}
+    for raw_id, value in values.items():
+        try:
+            object_id = int(raw_id)
+        except (TypeError, ValueError):
+            raise SimulationError(f"'{raw_id}' in '{key}.{course_type}' is not an id.")
+        if object_id not in known_ids:
+            raise SimulationError(f"Unknown id {object_id} in '{key}.{course_type}'.")
+        try:
+            cleaned[object_id] = convert(value)
+        except (TypeError, ValueError):
+            raise SimulationError(f"Invalid value {value!r} for {object_id} in '{key}.{course_type}'.")
+    return cleaned
+
+
+def _capacity(value):
+    value = int(value)
+    if value < 0:
+        raise ValueError
+    return value
+
+
+def _active(value):
+    if not isinstance(value, bool):
+        raise ValueError
+    return value
+
+
+def _threshold(value):
+    if value is None:
+        return None
+    value = float(value)
+    if not 0 <= value <= 100:
+        raise ValueError
+    return value
+
+
+def clean_scenario(snapshot, raw):
+    """Validate one scenario dict and turn its ids into ints."""
+    if not isinstance(raw, dict):
+        raise SimulationError("Each scenario must be an object.")
+    strategy = raw.get('strategy') or None
+    if strategy is not None and strategy not in strategies.STRATEGIES:
+        raise SimulationError(f"Unknown strategy '{strategy}'.")
+
+    scenario = {'name': str(raw.get('name') or ''), 'strategy': strategy}
+    for course_type, phases in COURSE_TYPES.items():
+        course_ids = set(snapshot.phases[phases[0]].courses_by_id)
+        rule_ids = {rule.id for rule in snapshot.rules[course_type]}
+        scenario[course_type] = {
+            'capacity': _overrides(raw, 'capacity', course_type, course_ids, _capacity),
+            'rules': _overrides(raw, 'rules', course_type, rule_ids, _active),
+            'min_percentage': _overrides(raw, 'min_percentage', course_type, course_ids, _threshold),
+        }
+    return scenario
+
+
+def _phase_data(snapshot, course_type, overrides):
+    """PhaseData for each phase of `course_type` with the overrides applied."""
+    base = snapshot.phases[COURSE_TYPES[course_type][0]]
+
+    courses = []
+    for course in base.courses:
+        if course.id in overrides['capacity']:
+            # Copy, so the shared snapshot is never modified
+            course = copy.copy(course)
+            course.capacity = overrides['capacity'][course.id]
+        courses.append(course)
+
+    grouped = {course.id: [] for course in courses}
+    for rule in snapshot.rules[course_type]:
+        if overrides['rules'].get(rule.id, rule.is_active) and rule.course_id in grouped:
+            grouped[rule.course_id].append(rule)
+    predicates = {}
+    for course_id, rules in grouped.items():
+        predicate = CompiledRules(rules)
+        if course_id in overrides['min_percentage']:
+            predicate.min_percentage = overrides['min_percentage'][course_id]
+        predicates[course_id] = predicate
+
+    masks = {cid: predicate.mask(snapshot.columns).tolist() for cid, predicate in predicates.items()}
+    phases = {}
+    for name in COURSE_TYPES[course_type]:
+        data = snapshot.phases[name]
+        phases[name] = engine.PhaseData(
+            data.spec, courses, predicates, data.preferences, data.preference_order,
+            withdrawn=data.withdrawn,
+        )
+    return phases, masks
+
+
+def _summary(students, data, allocations):
+    filled = Counter(alloc.course.id for alloc in allocations)
+    ranks = Counter(alloc.priority for alloc in allocations)
+    distribution = {str(rank): ranks[rank] for rank in sorted(r for r in ranks if r is not None)}
+    distribution['auto'] = ranks[None]
+    return {
+        'allocated': len(allocations),
+        'unallocated': len(students) - len(allocations),
+        'rank_distribution': distribution,
+        'courses': [
+            {
+                'id': course.id,
+                'name': course.name,
+                'capacity': course.capacity,
+                'filled': filled[course.id],
+                'fill_rate': round(filled[course.id] / course.capacity, 4) if course.capacity else None,
+            }
+            for course in data.courses
+        ],
+    }
+
+
+def check_scenarios(raw_scenarios):
+    """The checks that need no snapshot: a list of 1..MAX_SCENARIOS items."""
+    if not isinstance(raw_scenarios, list) or not raw_scenarios:
+        raise SimulationError("Expected a non-empty list of scenarios.")
+    if len(raw_scenarios) > MAX_SCENARIOS:
+        raise SimulationError(f"At most {MAX_SCENARIOS} scenarios per request.")
+
+
+def run_scenario(snapshot, scenario):
+    """Minor 1 -> Minor 2 -> OE for one cleaned scenario, in memory."""
+    allocate = strategies.get_strategy(scenario['strategy'])
+    students = snapshot.students
+
+    minor, minor_masks = _phase_data(snapshot, 'minor', scenario['minor'])
+    oe, oe_masks = _phase_data(snapshot, 'oe', scenario['oe'])
+
+    minor1 = allocate(students, minor['minor1'], eligible=minor_masks)
+    minor2 = allocate(
+        students, minor['minor2'], eligible=minor_masks,
+        excluded={alloc.student.id: alloc.course.id for alloc in minor1},
+    )
+    oe_allocs = allocate(students, oe['oe'], eligible=oe_masks)
+
+    return {
+        'name': scenario['name'],
+        'strategy': strategies.strategy_name(scenario['strategy']),
+        'phases': {
+            'minor1': _summary(students, minor['minor1'], minor1),
+            'minor2': _summary(students, minor['minor2'], minor2),
+            'oe': _summary(students, oe['oe'], oe_allocs),
+        },
+    }
+
+
+# -------------------------
+# Process pool
+# -------------------------
+# The snapshot of this pool worker, set by _init_worker
+_worker_snapshot = None
+
+
+def _init_worker(snapshot):
+    global _worker_snapshot
+    # Frozen objects aren't touched by the collector, so fewer of the pages
+    # shared with the parent get copied. Freezing here, in the pool worker,
+    # leaves the parent's collector as it was.
+    gc.freeze()
+    _worker_snapshot = snapshot
+
+
+def _run_in_worker(scenario):
+    return run_scenario(_worker_snapshot, scenario)
+
+
+def can_fork():
+    """Whether this platform can start a forked pool."""
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def simulate(raw_scenarios, workers=None, snapshot=None, cohort=None):
+    """
+    Validate and run `raw_scenarios` against one snapshot (built here,
+    of `cohort`, unless given). Returns one result dict per scenario, in
+    order. Raises SimulationError for an invalid scenario before anything
+    runs.
+    """
+    check_scenarios(raw_scenarios)
+    snapshot = snapshot or Snapshot(cohort)
+    scenarios = [clean_scenario(snapshot, raw) for raw in raw_scenarios]
+
+    workers = min(len(scenarios), workers or os.cpu_count() or 1)
+    if workers <= 1 or not can_fork():
+        return [run_scenario(snapshot, scenario) for scenario in scenarios]
+
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+    with billiard.get_context('fork').Pool(
+        workers, initializer=_init_worker, initargs=(snapshot,),
+    ) as pool:
+        return pool.map(_run_in_worker, scenarios)
@@ -0,0 +1,157 @@
+"""
+Allocation strategies.
+
+Every strategy takes the same arguments as engine.allocate_greedy (minus
+the incremental `start` / `kept`) and returns engine.Allocation tuples,
+so the runners, allocation models and explanation strings don't care
+which one produced them.
+
+* 'greedy' (default): engine.allocate_greedy, merit order, first eligible
+  preference with a free seat. Since every course ranks students the same
+  way (by merit), this is also the student-optimal stable matching.
+* 'optimal': one capacitated assignment problem per phase that first
+  seats as many students as possible and then minimises the total
+  preference rank (auto-allocated seats rank after every preference).
+  Solved as a linear program with SciPy's HiGHS dual simplex; the
+  constraint matrix is totally unimodular, so the basic solution it
+  returns is integral.
+
+The strategy is picked per run, defaulting to settings.ALLOCATION_STRATEGY.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+
+from . import engine
+
+
+DEFAULT_STRATEGY = 'greedy'
+
+
+def allocate_optimal(students, data, excluded=None, progress=engine.no_progress, eligible=None):
+    import numpy as np
+    from scipy.optimize import linprog
+    from scipy.sparse import csr_matrix
+
+    excluded = excluded or {}
+    if eligible is None:
+        eligible = engine.eligibility_masks(students, data)
+
+    courses = data.courses
+    if not students or not courses:
+        return []
+    n, m = len(students), len(courses)
+    position = {s.id: i for i, s in enumerate(students)}
+    course_index = {c.id: j for j, c in enumerate(courses)}
+
+    ranks = {}
+    for student_id, prefs in data.preferences.items():
+        student_ranks = ranks[student_id] = {}
+        for course_id, priority in prefs:
+            student_ranks.setdefault(course_id, priority)
+
+    # A seat outside the student's list costs more than any preference,
+    # and every seat given saves more than any rank total can add up to
+    auto_rank = max((p for r in ranks.values() for p in r.values()), default=0) + 1
+    seat_bonus = auto_rank * n + 1
+
+    allowed = np.array([eligible[c.id] for c in courses], dtype=bool).T.reshape(n, m)
+    allowed[:, [j for j, c in enumerate(courses) if not c.capacity]] = False
+    allowed[[position[sid] for sid in data.withdrawn if sid in position], :] = False
+    for student_id, course_id in excluded.items():
+        if student_id in position and course_id in course_index:
+            allowed[position[student_id], course_index[course_id]] = False
+
+    # The problem is a min-cost flow: student -> preferred course (cost =
+    # rank) or student -> hub -> any allowed course (cost = auto_rank).
+    # Students with the same allowed courses share a hub, which keeps the
+    # program at about (preferences + students) variables instead of
+    # students x courses.
+    pref_rows = [
+        (position[sid], course_index[cid], priority)
+        for sid, student_ranks in ranks.items() if sid in position
+        for cid, priority in student_ranks.items()
+        if allowed[position[sid], course_index[cid]]
+    ]
+    pref_s, pref_c, pref_rank = np.array(pref_rows, dtype=int).reshape(-1, 3).T
+    patterns, hub_of = np.unique(allowed, axis=0, return_inverse=True)
+    hub_of = hub_of.reshape(-1)
+    auto_s = np.flatnonzero(allowed.any(axis=1))
+    auto_h = hub_of[auto_s]
+    hub_h, hub_c = np.nonzero(patterns)
+
+    kd, ka, kh = len(pref_s), len(auto_s), len(hub_h)
+    if not kd + ka:
+        return []
+
+    progress('solve', 0, 1)
+    h = len(patterns)
+    d_vars, a_vars, h_vars = np.arange(kd), kd + np.arange(ka), kd + ka + np.arange(kh)
+    # Rows 0..n-1: one seat per student; rows n..n+m-1: course capacity
+    seats = csr_matrix((
+        np.ones(kd + ka + kd + kh),
+        (np.concatenate([pref_s, auto_s, n + pref_c, n + hub_c]),
+         np.concatenate([d_vars, a_vars, d_vars, h_vars])),
+    ), shape=(n + m, kd + ka + kh))
+    # One row per hub: what flows in flows out
+    hubs = csr_matrix((
+        np.concatenate([np.ones(ka), -np.ones(kh)]),
+        (np.concatenate([auto_h, hub_h]), np.concatenate([a_vars, h_vars])),
+    ), shape=(h, kd + ka + kh))
+    costs = np.concatenate([pref_rank - seat_bonus, np.full(ka, auto_rank - seat_bonus), np.zeros(kh)])
+    bounds = np.column_stack([np.zeros(kd + ka + kh), np.concatenate([np.ones(kd + ka), np.full(kh, np.inf)])])
+    result = linprog(
+        costs, A_ub=seats, b_ub=np.concatenate([np.ones(n), [c.capacity for c in courses]]),
+        A_eq=hubs, b_eq=np.zeros(h), bounds=bounds, method='highs-ds',
+    )
+    if result.status != 0:
+        raise RuntimeError(f"Optimal allocation failed: {result.message}")
+    progress('solve', 1, 1)
+
+    x = np.rint(result.x).astype(int)
+    seated = {students[pref_s[i]].id: courses[pref_c[i]] for i in np.flatnonzero(x[d_vars])}
+
+    # Hand out each hub's seats to its students in merit order
+    hub_seats = defaultdict(list)
+    for i in np.flatnonzero(x[h_vars]):
+        hub_seats[hub_h[i]].extend([courses[hub_c[i]]] * x[kd + ka + i])
+    for i in np.flatnonzero(x[a_vars]):
+        seated[students[auto_s[i]].id] = hub_seats[auto_h[i]].pop(0)
+
+    # Report in greedy order: the preference pass, then the rest by merit,
+    # numbering seats in that order for the explanations
+    students_by_id = {s.id: s for s in students}
+    order = list(data.preference_order)
+    listed = set(order)
+    order += [s.id for s in students if s.id not in listed]
+
+    filled = dict.fromkeys(data.courses_by_id, 0)
+    allocations = []
+    for student_id in order:
+        course = seated.get(student_id)
+        if course is None:
+            continue
+        priority = ranks.get(student_id, {}).get(course.id)
+        allocations.append(engine.Allocation(students_by_id[student_id], course, priority, filled[course.id]))
+        filled[course.id] += 1
+    return allocations
+
+
+STRATEGIES = {
+    'greedy': engine.allocate_greedy,
+    'optimal': allocate_optimal,
+}
+
+
+def strategy_name(name=None):
+    """`name`, or settings.ALLOCATION_STRATEGY when it's not given."""
+    return name or getattr(settings, 'ALLOCATION_STRATEGY', DEFAULT_STRATEGY)
+
+
+def get_strategy(name=None):
+    """The allocate function for `name`, or for settings.ALLOCATION_STRATEGY."""
+    name = strategy_name(name)
+    try:
+        return STRATEGIES[name]
+    except KeyError:
+        raise ValueError(f"Unknown allocation strategy '{name}'. Choose from: {', '.join(STRATEGIES)}")
@@ -0,0 +1,224 @@
+"""
+Bulk student import from the registrar's roll list (CSV).
+
+Columns: roll_no, name, department, percentage, email (header row
+required, extra columns ignored). Rows are validated one at a time as the
+file is read; valid rows are written in batches with one lookup query and
+bulk_create / bulk_update per batch, so memory and query count don't grow
+with the file.
+
+New students get a User named after their roll number with an unusable
+password, hashed once for the whole import. They set a real password
+through the forgot-password (OTP) flow. Re-importing a file updates
+existing students in place, matched on roll_no.
+
+Rows are held to what the registration form accepts: a percentage has at
+most two decimal places, and an email can't already belong to another
+account (the forgot-password flow finds users by email).
+"""
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from .dashboard_cache import invalidate_students
+from .models import Student
+
+
+REQUIRED_COLUMNS = ['roll_no', 'name', 'department', 'percentage', 'email']
+BATCH_SIZE = 1000
+
+# Per-row errors kept for the report; the rest are only counted
+MAX_ERRORS = 500
+
+UPDATE_FIELDS = ['name', 'department', 'percentage', 'email']
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []  # (line number, message)
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+    def __str__(self):
+        return f"{self.created} created, {self.updated} updated, {self.error_count} rows rejected"
+
+
+def _department_codes():
+    codes = {}
+    for code, label in Student.DEPARTMENTS:
+        codes[code.upper()] = code
+        codes[label.upper()] = code
+    return codes
+
+
+def clean_row(row, departments):
+    """
+    Validated dict of REQUIRED_COLUMNS for one CSV row.
+    Raises ValidationError with every problem found in the row.
+    """
+    values = {column: (row.get(column) or '').strip() for column in REQUIRED_COLUMNS}
+    problems = []
+
+    for column in REQUIRED_COLUMNS:
+        if not values[column]:
+            problems.append(f"{column} is missing")
+
+    roll_max = Student._meta.get_field('roll_no').max_length
+    if len(values['roll_no']) > roll_max:
+        problems.append(f"roll_no is longer than {roll_max} characters")
+    name_max = Student._meta.get_field('name').max_length
+    if len(values['name']) > name_max:
+        problems.append(f"name is longer than {name_max} characters")
+
+    if values['department']:
+        department = departments.get(values['department'].upper())
+        if department is None:
+            problems.append(f"unknown department '{values['department']}'")
+        values['department'] = department
+
+    if values['percentage']:
+        try:
+            percentage = Decimal(values['percentage'])
+        except InvalidOperation:
+            percentage = None
+        if percentage is None or not percentage.is_finite():
+            problems.append(f"percentage '{values['percentage']}' is not a number")
+        elif not 0 <= percentage <= 100:
+            problems.append("percentage must be between 0 and 100")
+        elif percentage.as_tuple().exponent < -2:
+            # The registration form (DecimalField, decimal_places=2) refuses these too
+            problems.append(f"percentage '{values['percentage']}' has more than 2 decimal places")
+        else:
+            values['percentage'] = percentage
+
+    if values['email']:
+        try:
+            validate_email(values['email'])
+        except ValidationError:
+            problems.append(f"invalid email '{values['email']}'")
+        values['email'] = values['email'].lower()
+
+    if problems:
+        raise ValidationError(problems)
+    return values
+
+
+def _write_batch(batch, password, result, dry_run):
+    """Create or update one batch of (line, values) rows."""
+    roll_nos = [values['roll_no'] for _, values in batch]
+    emails = [values['email'] for _, values in batch]
+
+    existing = {s.roll_no: s for s in Student.objects.filter(roll_no__in=roll_nos).select_related('user')}
+    email_owner = dict(Student.objects.filter(email__in=emails).values_list('email', 'roll_no'))
+    # Any account's email, student or not: forgot_password looks users up by email
+    email_users = {}
+    for user_id, email in User.objects.filter(email__in=emails).values_list('id', 'email'):
+        email_users.setdefault(email, set()).add(user_id)
+    taken_usernames = set(
+        User.objects.filter(username__in=[r for r in roll_nos if r not in existing])
+        .values_list('username', flat=True)
+    )
+
+    to_create, to_update = [], []
+    for line, values in batch:
+        owner = email_owner.get(values['email'])
+        if owner is not None and owner != values['roll_no']:
+            result.add_error(line, f"email {values['email']} already belongs to roll_no {owner}")
+            continue
+
+        student = existing.get(values['roll_no'])
+        own = {student.user_id} if student else set()
+        if email_users.get(values['email'], set()) - own:
+            result.add_error(line, f"email {values['email']} already belongs to another account")
+            continue
+        if student is None:
+            if values['roll_no'] in taken_usernames:
+                result.add_error(line, f"a user named {values['roll_no']} exists without a student profile")
+                continue
+            to_create.append(values)
+        else:
+            for field in UPDATE_FIELDS:
+                setattr(student, field, values[field])
+            student.user.email = values['email']
+            to_update.append(student)
+
+    if dry_run:
+        result.created += len(to_create)
+        result.updated += len(to_update)
+        return
+
+    with transaction.atomic():
+        users = User.objects.bulk_create([
+            User(username=values['roll_no'], email=values['email'], password=password)
+            for values in to_create
+        ])
+        Student.objects.bulk_create([
+            Student(user=user, **values)
+            for user, values in zip(users, to_create)
+        ])
+        Student.objects.bulk_update(to_update, UPDATE_FIELDS)
+        User.objects.bulk_update([student.user for student in to_update], ['email'])
+
+    result.created += len(to_create)
+    result.updated += len(to_update)
+
+
+def import_students(lines, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Import students from an iterable of CSV text lines (an open text file
+    or TextIOWrapper). Valid rows are imported even when others fail;
+    `dry_run` only validates. Returns an ImportResult.
+    """
+    result = ImportResult()
+    reader = csv.DictReader(lines)
+    header = [column.strip().lower() for column in reader.fieldnames or []]
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        result.add_error(1, f"missing columns: {', '.join(missing)}")
+        return result
+    reader.fieldnames = header
+
+    departments = _department_codes()
+    password = make_password(None)  # unusable, and hashed only once
+    seen_roll_nos, seen_emails = set(), set()
+    batch = []
+
+    for row in reader:
+        line = reader.line_num
+        try:
+            values = clean_row(row, departments)
+        except ValidationError as e:
+            result.add_error(line, '; '.join(e.messages))
+            continue
+
+        if values['roll_no'] in seen_roll_nos:
+            result.add_error(line, f"roll_no {values['roll_no']} appears more than once in the file")
+            continue
+        if values['email'] in seen_emails:
+            result.add_error(line, f"email {values['email']} appears more than once in the file")
+            continue
+        seen_roll_nos.add(values['roll_no'])
+        seen_emails.add(values['email'])
+
+        batch.append((line, values))
+        if len(batch) >= batch_size:
+            _write_batch(batch, password, result, dry_run)
+            batch = []
+    if batch:
+        _write_batch(batch, password, result, dry_run)
+
+    if result.updated and not dry_run:
+        # Updated profiles are part of cached dashboard snapshots
+        invalidate_students()
+    return result
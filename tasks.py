@@ -0,0 +1,173 @@
+"""
+Celery tasks for allocation runs, what-if simulations, seat backfills
+and the email outbox.
+
+The admin dashboard queues a run (views.allocation_job_start) instead of
+running it inside the HTTP request; the worker records status, phase and
+progress on the AllocationJob row, which the dashboard polls through
+views.allocation_job_status.
+
+Only one job is queued or running at a time (a unique constraint on
+AllocationJob). A job still queued or running ALLOCATION_JOB_TIMEOUT
+seconds after it was queued or started is taken to be lost (its worker
+died or its message never arrived); expire_stale_jobs() marks it failed
+so it doesn't block every later run.
+
+With CELERY_TASK_ALWAYS_EAGER = True (or the in-memory broker,
+CELERY_BROKER_URL = 'memory://') the task runs without Redis.
+"""
+import time
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import AllocationJob, SimulationJob
+from . import cohorts, outbox, simulation, utils, waitlist
+
+
+RUNNERS = {
+    'minor1': utils.run_minor1_allocation,
+    'minor2': utils.run_minor2_allocation,
+    'oe': utils.run_oe_allocation,
+    'all': utils.run_all_allocations,
+    'cohorts': cohorts.run_all_cohorts,
+}
+
+# Minimum seconds between progress writes to the job row
+PROGRESS_INTERVAL = 0.5
+# Default for settings.ALLOCATION_JOB_TIMEOUT
+JOB_TIMEOUT = 60 * 60
+
+
+class JobProgress:
+    """
+    Progress callback for the allocation runners that writes to an
+    AllocationJob row, throttled so the job table isn't hammered.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.phase = None
+        self.last_write = 0.0
+
+    def __call__(self, phase, done=0, total=0):
+        now = time.monotonic()
+        if phase == self.phase and done != total and now - self.last_write < PROGRESS_INTERVAL:
+            return
+        self.phase = phase
+        self.last_write = now
+        AllocationJob.objects.filter(pk=self.job_id).update(
+            phase=phase, processed=done, total=total
+        )
+
+
+def expire_stale_jobs():
+    """Mark jobs lost in the queue or in a dead worker failed. Returns how many."""
+    timeout = getattr(settings, 'ALLOCATION_JOB_TIMEOUT', JOB_TIMEOUT)
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=timeout)
+    return AllocationJob.objects.filter(
+        Q(status=AllocationJob.STATUS_QUEUED, created_at__lt=cutoff)
+        | Q(status=AllocationJob.STATUS_RUNNING, started_at__lt=cutoff)
+    ).update(
+        status=AllocationJob.STATUS_FAILED, finished_at=now,
+        message=f"Allocation failed: no result after {timeout // 60} minutes; the job was given up as lost.",
+    )
+
+
+@shared_task
+def run_allocation_job(job_id):
+    # Only a job still queued starts: one expired as stale while its
+    # message was on the way stays failed
+    claimed = AllocationJob.objects.filter(pk=job_id, status=AllocationJob.STATUS_QUEUED).update(
+        status=AllocationJob.STATUS_RUNNING, started_at=timezone.now(),
+    )
+    if not claimed:
+        return None
+    job = AllocationJob.objects.get(pk=job_id)
+    runner = RUNNERS[job.kind]
+
+    started = time.perf_counter()
+    try:
+        message = runner(progress=JobProgress(job.pk))
+    except Exception as e:
+        job.status = AllocationJob.STATUS_FAILED
+        job.message = f"Allocation failed: {e}"
+        raise
+    else:
+        job.status = AllocationJob.STATUS_SUCCESS
+        job.message = message
+    finally:
+        job.refresh_from_db(fields=['phase', 'processed', 'total'])
+        job.finished_at = timezone.now()
+        job.duration = time.perf_counter() - started
+        job.save(update_fields=['status', 'message', 'finished_at', 'duration'])
+
+    return job.message
+
+
+@shared_task
+def run_simulation_job(job_id):
+    """Run a SimulationJob's scenarios (see simulation.simulate) and store the results."""
+    claimed = SimulationJob.objects.filter(pk=job_id, status=AllocationJob.STATUS_QUEUED).update(
+        status=AllocationJob.STATUS_RUNNING,
+    )
+    if not claimed:
+        return None
+    job = SimulationJob.objects.get(pk=job_id)
+
+    started = time.perf_counter()
+    try:
+        job.results = simulation.simulate(
+            job.scenarios, workers=getattr(settings, 'SIMULATION_WORKERS', None), cohort=job.cohort_id,
+        )
+    except simulation.SimulationError as e:
+        job.status = AllocationJob.STATUS_FAILED
+        job.message = str(e)
+    except Exception as e:
+        job.status = AllocationJob.STATUS_FAILED
+        job.message = f"Simulation failed: {e}"
+        raise
+    else:
+        job.status = AllocationJob.STATUS_SUCCESS
+    finally:
+        job.finished_at = timezone.now()
+        job.duration = time.perf_counter() - started
+        job.save(update_fields=['status', 'results', 'message', 'finished_at', 'duration'])
+
+    return f"{len(job.results or [])} scenario(s) simulated."
+
+
+@shared_task
+def backfill_seats(phase, cohort_id=None):
+    """
+    Hand the seats released in `phase` (of the cohort) since the last
+    batch to the waitlist (see waitlist.schedule_backfill, which queues
+    this).
+    """
+    # Releases from now on queue the next batch
+    cache.delete(waitlist.PENDING_KEY.format(phase=phase, cohort=cohort_id))
+    moves = waitlist.backfill(phase, cohort_id)
+    return f"{len(moves)} {phase} seat(s) filled from the waitlist or by auto-allocation."
+
+
+@shared_task
+def send_outbox():
+    """
+    Send every email that is due (see outbox.py; outbox.schedule queues
+    this), then queue the next batch for when the first retry is due.
+    """
+    # Mail queued from now on queues the next batch
+    cache.delete(outbox.PENDING_KEY)
+    result = outbox.send_pending()
+    delay = outbox.next_due()
+    if delay is not None:
+        outbox.schedule_retry(delay)
+    return (
+        f"{result.sent} email(s) sent, {result.retrying} to retry, {result.failed} failed "
+        f"({outbox.rate_of(result):.1f}/s)."
+    )
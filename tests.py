@@ -1,3 +1,814 @@
-from django.test import TestCase
+import csv
+import gc
+import io
+import json
+import os
+import tempfile
+import zipfile
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from smtplib import SMTPException
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection
+from django.db.models import Min
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import analytics, cohorts, dashboard_cache, engine, history, letters, outbox, simulation, strategies, utils, waitlist
+from .eligibility import StudentColumns, invalidate_rules, rules_for_branch, rules_for_oe
+from .management.commands.explain_queries import explain, hot_queries
+from .management.commands.generate_cohort import clear_synthetic, generate_cohort
+from .models import (
+    Student, MinorBranch, OpenElective, MinorAllocation, DoubleMinorAllocation, OEAllocation,
+    EligibilityRule, OEEligibilityRule, PreferenceWindow, PreferenceSubmission, MinorPreference,
+    AllocationRun, SeatRelease, OutboxEmail, Cohort, CohortStudent, CohortMinorBranch, CohortOpenElective,
+    SimulationJob,
+)
+from .preferences import VersionConflict, submit_preferences
+from .student_import import import_students
+
+
+def allocations():
+    """(Minor 1, Minor 2, OE) as student id -> course id."""
+    return (
+        dict(MinorAllocation.objects.values_list('student_id', 'minor_branch_id')),
+        dict(DoubleMinorAllocation.objects.values_list('student_id', 'minor_branch_id')),
+        dict(OEAllocation.objects.values_list('student_id', 'oe_subject_id')),
+    )
+
+
+def passes_rules(student, rules):
+    """Whether `student` passes the rule rows, read the way the rule forms write them."""
+    for rule in rules:
+        value = rule.value or {}
+        if rule.rule_type == 'MIN_PERCENTAGE':
+            threshold = value.get('min_percentage')
+            if threshold is not None and Decimal(str(student.percentage)) < Decimal(str(threshold)):
+                return False
+        elif rule.rule_type == 'DEPARTMENT_BLOCK':
+            blocked = [str(d).upper().strip() for d in value.get('blocked_departments', [])]
+            if (student.department or '').upper() in blocked:
+                return False
+    return True
+
+
+def reference_allocation(spec, excluded=None):
+    """
+    The greedy as the runners did it before the engine: one query per
+    decision and the rules read from their rows. Returns student id ->
+    course id without writing anything.
+    """
+    excluded = excluded or {}
+    courses = list(spec.course_model.objects.all())
+    seated, filled = {}, Counter()
+
+    def try_seat(student, course):
+        if course.id == excluded.get(student.id):
+            return False
+        rules = spec.rule_model.objects.filter(is_active=True, **{spec.rule_course_field: course})
+        if not passes_rules(student, rules) or filled[course.id] >= course.capacity:
+            return False
+        filled[course.id] += 1
+        seated[student.id] = course.id
+        return True
+
+    with_preferences = Student.objects.filter(
+        **{f'{spec.preference_relation}__isnull': False}
+    ).annotate(
+        submission_time=Min(f'{spec.preference_relation}__submitted_at')
+    ).order_by('-percentage', 'submission_time', 'id')
+    for student in with_preferences:
+        for pref in spec.preference_model.objects.filter(student=student).order_by('priority', 'pk'):
+            if try_seat(student, getattr(pref, spec.course_field)):
+                break
+
+    for student in Student.objects.order_by('-percentage', 'user__date_joined'):
+        if student.id in seated:
+            continue
+        for course in courses:
+            if try_seat(student, course):
+                break
+    return seated
+
+
+@override_settings(ALLOCATION_STRATEGY='greedy')
+class AllocationTestCase(TestCase):
+    students = 150
+
+    def setUp(self):
+        cache.clear()
+        self.generate(seed=0)
+
+    def generate(self, seed):
+        # Fewer seats than students, so courses fill up and order matters
+        generate_cohort(self.students, branches=5, oes=4, seed=seed, seat_ratio=0.7)
+        # generate_cohort bulk-creates its rules, which skips the signals
+        invalidate_rules()
+
+
+class EngineTests(AllocationTestCase):
+    def test_runners_match_reference_greedy(self):
+        utils.run_minor1_allocation()
+        utils.run_minor2_allocation()
+        utils.run_oe_allocation()
+        minor1, minor2, oe = allocations()
+
+        self.assertEqual(minor1, reference_allocation(engine.MINOR1))
+        self.assertEqual(minor2, reference_allocation(engine.MINOR2, excluded=minor1))
+        self.assertEqual(oe, reference_allocation(engine.OE))
+
+    def test_run_all_matches_separate_runners(self):
+        utils.run_minor1_allocation()
+        utils.run_minor2_allocation()
+        utils.run_oe_allocation()
+        separate = allocations()
+
+        utils.run_all_allocations()
+        self.assertEqual(allocations(), separate)
+
+    def test_compiled_rules_match_rule_rows(self):
+        students = engine.load_students()
+        columns = StudentColumns(students)
+        for course in MinorBranch.objects.all():
+            rules = list(course.rules.filter(is_active=True))
+            self.assertEqual(
+                rules_for_branch(course).mask(columns).tolist(),
+                [passes_rules(student, rules) for student in students],
+            )
+        for course in OpenElective.objects.all():
+            rules = list(course.rules.filter(is_active=True))
+            self.assertEqual(
+                rules_for_oe(course).mask(columns).tolist(),
+                [passes_rules(student, rules) for student in students],
+            )
+
+
+class IncrementalTests(AllocationTestCase):
+    def assertMatchesFullRerun(self, course_type, changes):
+        utils.run_incremental_allocation(course_type, changes)
+        incremental = allocations()
+        utils.run_all_allocations()
+        self.assertEqual(incremental, allocations())
+
+    def test_capacity_change(self):
+        utils.run_all_allocations()
+        branch = MinorBranch.objects.order_by('id').first()
+        old = branch.capacity
+        branch.capacity = max(0, old - 4)
+        branch.save()
+        self.assertMatchesFullRerun('minor', {branch.id: old})
+
+    def test_capacity_change_from_last_run(self):
+        # The old capacity comes from the last run's parameters
+        utils.run_all_allocations()
+        oe = OpenElective.objects.order_by('id').last()
+        oe.capacity += 5
+        oe.save()
+        self.assertMatchesFullRerun('oe', {oe.id: None})
+
+    def test_rule_change(self):
+        utils.run_all_allocations()
+        branch = MinorBranch.objects.order_by('id').first()
+        EligibilityRule.objects.create(
+            branch=branch, rule_type='MIN_PERCENTAGE', value={'min_percentage': 75}, is_active=True,
+        )
+        self.assertMatchesFullRerun('minor', {branch.id: None})
+
+    def test_oe_rule_change(self):
+        utils.run_all_allocations()
+        oe = OpenElective.objects.order_by('id').first()
+        OEEligibilityRule.objects.create(
+            oe_subject=oe, rule_type='DEPARTMENT_BLOCK', value={'blocked_departments': ['CSE']},
+        )
+        self.assertMatchesFullRerun('oe', {oe.id: None})
+
+
+class ReportExportTests(AllocationTestCase):
+    students = 40
+
+    def setUp(self):
+        super().setUp()
+        utils.run_all_allocations()
+        self.client.force_login(User.objects.create_user('report-admin', is_staff=True))
+
+    def expected(self, departments):
+        minor1 = dict(MinorAllocation.objects.values_list('student__roll_no', 'minor_branch__name'))
+        oe = dict(OEAllocation.objects.values_list('student__roll_no', 'oe_subject__name'))
+        return [
+            [roll_no, minor1.get(roll_no, ''), oe.get(roll_no, '')]
+            for roll_no in Student.objects.filter(department__in=departments)
+            .order_by('roll_no').values_list('roll_no', flat=True)
+        ]
+
+    def test_csv_columns_and_departments(self):
+        response = self.client.get(reverse('download_csv_report'), {
+            'columns': 'oe,roll_no,unknown,minor1', 'department': ['CSE', 'IT'],
+        })
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        # Report order, whatever the order asked for; unknown columns dropped
+        self.assertEqual(rows[0], ['Roll No', 'Minor 1', 'Open Elective'])
+        self.assertEqual(rows[1:], self.expected(['CSE', 'IT']))
+
+    def test_xlsx(self):
+        from openpyxl import load_workbook
+
+        response = self.client.get(reverse('download_csv_report'), {
+            'columns': 'roll_no,minor1,oe', 'department': 'MECH', 'format': 'xlsx',
+        })
+        self.assertEqual(response.status_code, 200)
+        sheet = load_workbook(io.BytesIO(b''.join(response.streaming_content)))['Allocations']
+        rows = [['' if value is None else value for value in row] for row in sheet.iter_rows(values_only=True)]
+        self.assertEqual(rows[0], ['Roll No', 'Minor 1', 'Open Elective'])
+        self.assertEqual(rows[1:], self.expected(['MECH']))
+
+
+def render_roll_no(letter):
+    return str(letter['roll_no']).encode()
+
+
+class LetterTests(AllocationTestCase):
+    students = 30
+
+    def setUp(self):
+        super().setUp()
+        utils.run_all_allocations()
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.output = os.path.join(self.dir.name, 'letters.zip')
+        self.work_dir = os.path.join(self.dir.name, 'parts')
+
+    def generate_letters(self, **kwargs):
+        # The orchestration only: the workers write the roll number instead of a PDF
+        with mock.patch.object(letters, '_init_worker', lambda: None), \
+                mock.patch.object(letters, 'render_letter', render_roll_no):
+            return letters.generate_letters(self.output, self.work_dir, workers=2, batch_size=7, **kwargs)
+
+    def test_one_letter_per_student(self):
+        result = self.generate_letters()
+        self.assertEqual((result['letters'], result['rendered'], result['skipped']), (30, 30, 0))
+        with zipfile.ZipFile(self.output) as archive:
+            self.assertEqual(
+                {name: archive.read(name).decode() for name in archive.namelist()},
+                {letters.letter_filename(roll_no): roll_no
+                 for roll_no in Student.objects.values_list('roll_no', flat=True)},
+            )
+
+    def test_resume_renders_only_missing_letters(self):
+        self.generate_letters()
+        for name in sorted(os.listdir(self.work_dir))[:4]:
+            os.remove(os.path.join(self.work_dir, name))
+
+        result = self.generate_letters()
+        self.assertEqual((result['letters'], result['rendered'], result['skipped']), (30, 4, 26))
+        self.assertEqual(self.generate_letters(fresh=True)['rendered'], 30)
+
+    def test_sanitized_names_stay_unique(self):
+        self.assertEqual(letters.letter_filename('B2023-17'), 'B2023-17.pdf')
+        self.assertNotEqual(letters.letter_filename('A/1'), letters.letter_filename('A_1'))
+
+
+# Signed-cookie sessions leave the user lookup as the only query of the request itself
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+class StudentDashboardCacheTests(AllocationTestCase):
+    students = 20
+
+    def setUp(self):
+        super().setUp()
+        utils.run_all_allocations()
+        self.student = Student.objects.order_by('id').first()
+        self.client.force_login(self.student.user)
+
+    def load(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('student_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(captured)
+
+    def test_warm_load_makes_at_most_one_query(self):
+        self.load()
+        response, queries = self.load()
+        self.assertLessEqual(queries, 1)
+        self.assertEqual(response.context['student'], self.student)
+        self.assertEqual(dashboard_cache.stats()['snapshot'], {'hits': 1, 'misses': 1})
+
+    def test_allocation_run_refreshes_the_snapshot(self):
+        self.load()
+        MinorAllocation.objects.filter(student=self.student).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            utils.run_all_allocations()
+        response, queries = self.load()
+        self.assertGreater(queries, 1)
+        self.assertEqual(
+            response.context['minor1_allocation'],
+            MinorAllocation.objects.filter(student=self.student).first(),
+        )
+
+
+class StudentImportTests(TestCase):
+    header = 'roll_no,name,department,percentage,email\n'
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user('registrar', email='registrar@example.com')
+
+    def test_rows_are_validated(self):
+        result = import_students(io.StringIO(self.header + (
+            'R1,Asha,CSE,72.34,asha@example.com\n'
+            'R2,Ravi,Computer,72.345,ravi@example.com\n'
+            'R3,Mira,IT,abc,mira@example.com\n'
+            'R4,Omar,ENTC,101,omar@example.com\n'
+            'R5,Lena,ARTS,60,lena@example.com\n'
+            'R6,Ivan,MECH,60,registrar@example.com\n'
+            'R1,Asha,CSE,72.34,asha2@example.com\n'
+            'R7,Kiran,Civil,88,KIRAN@example.com\n'
+        )))
+        self.assertEqual((result.created, result.updated, result.error_count), (2, 0, 6))
+        self.assertEqual(result.errors, [
+            (3, "percentage '72.345' has more than 2 decimal places"),
+            (4, "percentage 'abc' is not a number"),
+            (5, "percentage must be between 0 and 100"),
+            (6, "unknown department 'ARTS'"),
+            (8, "roll_no R1 appears more than once in the file"),
+            (7, "email registrar@example.com already belongs to another account"),
+        ])
+        self.assertEqual(
+            list(Student.objects.order_by('roll_no').values_list('roll_no', 'department', 'percentage', 'email')),
+            [('R1', 'CSE', 72.34, 'asha@example.com'), ('R7', 'CIVIL', 88.0, 'kiran@example.com')],
+        )
+        self.assertFalse(User.objects.get(username='R1').has_usable_password())
+
+    def test_reimport_updates_in_place(self):
+        import_students(io.StringIO(self.header + 'R1,Asha,CSE,72.34,asha@example.com\n'))
+        result = import_students(io.StringIO(self.header + 'R1,Asha K,IT,75.5,asha.k@example.com\n'))
+        self.assertEqual((result.created, result.updated, result.error_count), (0, 1, 0))
+        student = Student.objects.select_related('user').get()
+        self.assertEqual((student.name, student.department, student.percentage), ('Asha K', 'IT', 75.5))
+        self.assertEqual((student.email, student.user.email), ('asha.k@example.com', 'asha.k@example.com'))
+
+
+class OptimalStrategyTests(AllocationTestCase):
+    students = 60
+
+    def cost(self, allocations, data):
+        """(seats given, total rank), auto-allocated seats ranking after every preference."""
+        auto_rank = max((p for prefs in data.preferences.values() for _, p in prefs), default=0) + 1
+        ranks = [auto_rank if alloc.priority is None else alloc.priority for alloc in allocations]
+        return len(ranks), sum(ranks)
+
+    def test_optimal_is_never_worse_than_greedy(self):
+        for seed in range(4):
+            with self.subTest(seed=seed):
+                clear_synthetic()
+                self.generate(seed)
+                students = engine.load_students()
+                for spec in (engine.MINOR1, engine.OE):
+                    data = engine.load_phase(spec)
+                    greedy_seats, greedy_rank = self.cost(engine.allocate_greedy(students, data), data)
+                    optimal_seats, optimal_rank = self.cost(strategies.allocate_optimal(students, data), data)
+                    self.assertGreaterEqual(optimal_seats, greedy_seats)
+                    if optimal_seats == greedy_seats:
+                        self.assertLessEqual(optimal_rank, greedy_rank)
+
+
+class SimulationTests(AllocationTestCase):
+    students = 60
+
+    def test_parallel_matches_serial_and_writes_nothing(self):
+        branch = MinorBranch.objects.order_by('id').first()
+        scenarios = [{}, {'capacity': {'minor': {str(branch.id): 0}}}, {'strategy': 'optimal'}]
+        frozen = gc.get_freeze_count()
+
+        serial = simulation.simulate(scenarios, workers=1)
+        self.assertEqual(simulation.simulate(scenarios, workers=3), serial)
+        self.assertEqual(gc.get_freeze_count(), frozen)
+        self.assertEqual(allocations(), ({}, {}, {}))
+        self.assertEqual(serial[1]['phases']['minor1']['courses'][0]['filled'], 0)
+
+    def test_invalid_scenario(self):
+        with self.assertRaises(simulation.SimulationError):
+            simulation.simulate([{'capacity': {'minor': {'999999': 3}}}])
+
+
+class PreferenceVersionTests(AllocationTestCase):
+    students = 20
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        PreferenceWindow.objects.create(
+            name='Preference Window', start_at=now - timedelta(days=1), end_at=now + timedelta(days=1),
+            is_active=True,
+        )
+        self.student = Student.objects.order_by('id').first()
+        self.branches = list(MinorBranch.objects.order_by('id').values_list('id', flat=True))
+
+    def ranking(self):
+        return list(
+            MinorPreference.objects.filter(student=self.student)
+            .order_by('priority').values_list('minor_branch_id', flat=True)
+        )
+
+    def test_stale_version_is_rejected(self):
+        version = submit_preferences(self.student, {'minor1': self.branches[:2]}, 0)
+        self.assertEqual(version, 1)
+
+        with self.assertRaises(VersionConflict) as raised:
+            submit_preferences(self.student, {'minor1': self.branches[2:]}, 0)
+        self.assertEqual(raised.exception.current_version, 1)
+        self.assertEqual(self.ranking(), self.branches[:2])
+
+    def test_missing_version_is_rejected(self):
+        submit_preferences(self.student, {'minor1': self.branches[:2]}, 0)
+        with self.assertRaises(VersionConflict):
+            submit_preferences(self.student, {'minor1': self.branches[2:]}, None)
+        self.assertEqual(self.ranking(), self.branches[:2])
+
+    def test_api_answers_409_with_current_version(self):
+        submit_preferences(self.student, {'minor1': self.branches[:2]}, 0)
+        self.client.force_login(self.student.user)
+        response = self.client.post(
+            reverse('preference_api'), json.dumps({'version': 0, 'minor1': self.branches[2:]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['version'], 1)
+        self.assertEqual(self.ranking(), self.branches[:2])
+
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.popular = MinorBranch.objects.create(name='AI', capacity=1)
+        self.strict = MinorBranch.objects.create(name='Robotics', capacity=5)
+        self.open = MinorBranch.objects.create(name='Finance', capacity=5)
+        EligibilityRule.objects.create(
+            branch=self.strict, rule_type='MIN_PERCENTAGE', value={'min_percentage': 85}, is_active=True,
+        )
+        self.first = self.student('H1', 90, [(self.popular, 1)])
+        # Preference numbers as submitted, with a gap where a course was deleted
+        self.second = self.student('H2', 80, [(self.popular, 1), (self.strict, 3), (self.open, 4)])
+
+    def student(self, roll_no, percentage, preferences):
+        student = Student.objects.create(
+            user=User.objects.create_user(roll_no), name=roll_no, roll_no=roll_no, department='CSE',
+            percentage=percentage, email=f'{roll_no}@example.com',
+        )
+        for branch, priority in preferences:
+            MinorPreference.objects.create(student=student, minor_branch=branch, priority=priority)
+        return student
+
+    def latest_outcome(self, student):
+        run = AllocationRun.objects.order_by('-pk').first()
+        outcomes = history.PhaseOutcomes(run.phases.get(phase='minor1').outcomes)
+        return run, outcomes.get(student.id)
+
+    def test_outcome_and_explanation(self):
+        utils.run_minor1_allocation()
+        run, outcome = self.latest_outcome(self.second)
+
+        self.assertEqual((outcome.course_id, outcome.rank), (self.open.id, 4))
+        self.assertEqual(outcome.rejected, [
+            (self.popular.id, history.REASON_FULL, 1),
+            (self.strict.id, history.REASON_MIN_PERCENTAGE, 3),
+        ])
+        self.assertEqual(history.render_outcome(run, 'minor1', outcome), (
+            "Preference #1 not allocated: all 1 seats of 'AI' were taken. "
+            "Preference #3 not allocated: 'Robotics' requires at least 85.0% (student had 80%). "
+            "Allocated Minor 1 'Finance' using preference #4. "
+            "Student percentage: 80. Seats filled before allocation: 0 / 5."
+        ))
+
+    def test_explanation_uses_the_run_parameters(self):
+        utils.run_minor1_allocation()
+        run, outcome = self.latest_outcome(self.second)
+        # Later course changes don't rewrite an old run's explanation
+        MinorBranch.objects.filter(pk=self.popular.pk).update(name='Data Science', capacity=3)
+        self.assertIn("all 1 seats of 'AI' were taken", history.render_outcome(run, 'minor1', outcome))
+
+    def test_compare_runs(self):
+        utils.run_minor1_allocation()
+        before = AllocationRun.objects.order_by('-pk').first()
+        self.popular.capacity = 2
+        self.popular.save()
+        utils.run_minor1_allocation()
+        after = AllocationRun.objects.order_by('-pk').first()
+
+        [minor1] = history.compare_runs(before, after)
+        self.assertEqual((minor1['compared'], minor1['moved'], minor1['improved'], minor1['worsened']), (2, 1, 1, 0))
+        self.assertEqual(minor1['changes'], [history.Change(self.second.id, self.open.id, 4, self.popular.id, 1)])
+
+
+class WaitlistTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.a, self.b, self.c = (MinorBranch.objects.create(name=name, capacity=1) for name in 'ABC')
+        self.s1 = self.student('W1', 90, [self.a])
+        self.s2 = self.student('W2', 80, [self.a, self.b])
+        self.s3 = self.student('W3', 70, [self.b, self.c])
+        # Three seats for four students: W4 gets none
+        self.s4 = self.student('W4', 60, [])
+        utils.run_minor1_allocation()
+
+    def student(self, roll_no, percentage, branches):
+        student = Student.objects.create(
+            user=User.objects.create_user(roll_no), name=roll_no, roll_no=roll_no, department='CSE',
+            percentage=percentage, email=f'{roll_no}@example.com',
+        )
+        for priority, branch in enumerate(branches, start=1):
+            MinorPreference.objects.create(student=student, minor_branch=branch, priority=priority)
+        return student
+
+    def seats(self):
+        return dict(MinorAllocation.objects.values_list('student_id', 'minor_branch_id'))
+
+    def test_release_cascades_down_the_waitlists(self):
+        self.assertEqual(self.seats(), {self.s1.id: self.a.id, self.s2.id: self.b.id, self.s3.id: self.c.id})
+
+        self.assertTrue(waitlist.release('minor1', self.s1, SeatRelease.REASON_WITHDRAWN))
+        self.assertEqual(waitlist.backfill('minor1'), [
+            (self.s2.id, self.b.id, self.a.id, 1),
+            (self.s3.id, self.c.id, self.b.id, 1),
+            # Nobody waits for C: auto-allocated, never to the student who withdrew
+            (self.s4.id, None, self.c.id, None),
+        ])
+        self.assertEqual(self.seats(), {self.s2.id: self.a.id, self.s3.id: self.b.id, self.s4.id: self.c.id})
+        self.assertFalse(SeatRelease.objects.filter(processed_at__isnull=True).exists())
+
+    def test_only_released_seats_are_filled(self):
+        # A capacity increase is for the next run to fill, not a backfill
+        self.a.capacity = 2
+        self.a.save()
+        self.assertEqual(waitlist.backfill('minor1'), [])
+
+        waitlist.release('minor1', self.s3, SeatRelease.REASON_REMOVED)
+        self.assertEqual(waitlist.backfill('minor1'), [(self.s4.id, None, self.c.id, None)])
+        self.assertEqual(self.seats()[self.s2.id], self.b.id)
+
+    def test_withdrawn_student_stays_out_of_later_runs(self):
+        waitlist.release('minor1', self.s1, SeatRelease.REASON_WITHDRAWN)
+        utils.run_minor1_allocation()
+        self.assertNotIn(self.s1.id, self.seats())
+
+
+class ApiConditionalTests(AllocationTestCase):
+    students = 30
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_user('api-admin', is_staff=True))
+        # The preference list's Last-Modified is the latest submission
+        PreferenceSubmission.objects.create(student=Student.objects.order_by('id').first(), version=1)
+        utils.run_all_allocations()
+
+    def test_not_modified(self):
+        for name in ('api-allocation-list', 'api-preference-list'):
+            with self.subTest(name):
+                url = reverse(name)
+                first = self.client.get(url)
+                self.assertEqual(first.status_code, 200)
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+                self.assertEqual(
+                    self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304,
+                )
+
+    def test_modified_after_a_run(self):
+        url = reverse('api-allocation-list')
+        etag = self.client.get(url)['ETag']
+        utils.run_all_allocations()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_modified_after_a_student_is_deleted(self):
+        for name in ('api-allocation-list', 'api-preference-list'):
+            with self.subTest(name):
+                url = reverse(name)
+                etag = self.client.get(url)['ETag']
+                Student.objects.order_by('id').last().delete()
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class FailingBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise SMTPException("Connection unexpectedly closed")
+
+
+class SilentBackend(BaseEmailBackend):
+    """A backend whose errors were swallowed (fail_silently): nothing sent."""
+
+    def send_messages(self, email_messages):
+        return 0
+
+
+class OutboxRetryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.email = OutboxEmail.objects.create(
+            kind=outbox.KIND_ALLOCATION_RESULT, to='student@example.com',
+            subject='Allocation results', body='...', next_attempt_at=timezone.now(),
+        )
+
+    def make_due(self):
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+
+    def assertRetrying(self, result):
+        self.assertEqual((result.sent, result.retrying, result.failed), (0, 1, 0))
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, OutboxEmail.STATUS_PENDING)
+        self.assertEqual(self.email.attempts, 1)
+        self.assertGreater(self.email.next_attempt_at, timezone.now())
+
+    @override_settings(EMAIL_BACKEND='allotment.tests.FailingBackend')
+    def test_failure_is_retried_later(self):
+        self.assertRetrying(outbox.send_pending())
+        self.assertIn('SMTPException', self.email.last_error)
+        # Not due again yet
+        self.assertEqual(outbox.send_pending().retrying, 0)
+
+    @override_settings(EMAIL_BACKEND='allotment.tests.SilentBackend')
+    def test_nothing_sent_is_retried(self):
+        self.assertRetrying(outbox.send_pending())
+
+    def test_retry_sends(self):
+        with override_settings(EMAIL_BACKEND='allotment.tests.FailingBackend'):
+            outbox.send_pending()
+        self.make_due()
+
+        result = outbox.send_pending()
+        self.assertEqual((result.sent, result.retrying, result.failed), (1, 0, 0))
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, OutboxEmail.STATUS_SENT)
+        self.assertEqual(self.email.last_error, '')
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(EMAIL_BACKEND='allotment.tests.FailingBackend', EMAIL_MAX_ATTEMPTS=2)
+    def test_gives_up_after_max_attempts(self):
+        outbox.send_pending()
+        self.make_due()
+        result = outbox.send_pending()
+        self.assertEqual(result.failed, 1)
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, OutboxEmail.STATUS_FAILED)
+        self.assertEqual(self.email.attempts, 2)
+
+    @override_settings(EMAIL_BACKEND='allotment.tests.FailingBackend', EMAIL_MAX_ATTEMPTS=1)
+    def test_otp_body_is_cleared_once_settled(self):
+        outbox.queue_otp('student@example.com', '123456')
+        outbox.queue_otp('other@example.com', '654321')
+        otp, other = OutboxEmail.objects.filter(kind=outbox.KIND_OTP).order_by('pk')
+        OutboxEmail.objects.filter(pk=other.pk).update(next_attempt_at=timezone.now() + timedelta(hours=1))
+
+        # Failed for good
+        outbox.send_pending()
+        otp.refresh_from_db()
+        self.assertEqual((otp.status, otp.body), (OutboxEmail.STATUS_FAILED, ''))
+
+        # Sent
+        self.make_due()
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            outbox.send_pending()
+        other.refresh_from_db()
+        self.assertEqual((other.status, other.body), (OutboxEmail.STATUS_SENT, ''))
+        self.assertIn('654321', mail.outbox[-1].body)
+        # Other kinds keep their body
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.body, '...')
+
+    def test_a_claimed_row_is_not_leased_again(self):
+        now = timezone.now()
+        self.assertEqual([email.pk for email in outbox._claim(10)], [self.email.pk])
+        # What a second worker that read the row before the claim would try
+        self.assertFalse(outbox._lease(self.email.pk, now, now + timedelta(seconds=60)))
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.attempts, 1)
+
+
+class CohortTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user('cohort-admin', is_staff=True))
+        generate_cohort(60, branches=3, oes=2, seed=1, seat_ratio=0.7, partition='a')
+        generate_cohort(40, branches=2, oes=2, seed=2, seat_ratio=0.7, partition='b')
+        invalidate_rules()
+        self.a, self.b = Cohort.objects.order_by('code')
+
+    def test_cohorts_allocate_apart(self):
+        results = cohorts.run_cohorts(workers=1)
+        self.assertFalse(any(result.failed for result in results))
+
+        # No seat goes to a student of another cohort
+        student_cohorts = dict(CohortStudent.objects.values_list('student_id', 'cohort_id'))
+        branch_cohorts = dict(CohortMinorBranch.objects.values_list('branch_id', 'cohort_id'))
+        oe_cohorts = dict(CohortOpenElective.objects.values_list('oe_subject_id', 'cohort_id'))
+        minor1, minor2, oe = allocations()
+        self.assertTrue(minor1 and oe)
+        for seated, course_cohorts in ((minor1, branch_cohorts), (minor2, branch_cohorts), (oe, oe_cohorts)):
+            for student_id, course_id in seated.items():
+                self.assertEqual(student_cohorts[student_id], course_cohorts[course_id])
+
+        # The same as running each cohort on its own
+        together = allocations()
+        for cohort in (self.a, self.b):
+            utils.run_all_allocations(cohort=cohort.pk)
+        self.assertEqual(allocations(), together)
+
+    def test_analytics_are_per_cohort(self):
+        cohorts.run_cohorts(workers=1)
+        for cohort, students in ((self.a, 60), (self.b, 40)):
+            result = analytics.cohort_analytics(cohort.pk)
+            self.assertEqual(result['students'], students)
+            self.assertEqual(
+                {course['id'] for course in result['phases']['minor1']['courses']},
+                set(MinorBranch.objects.filter(cohort_link__cohort=cohort).values_list('pk', flat=True)),
+            )
+            self.assertEqual(
+                result['phases']['oe']['allocated'],
+                OEAllocation.objects.filter(student__cohort_link__cohort=cohort).count(),
+            )
+        self.assertEqual(analytics.cohort_analytics()['students'], 100)
+
+        url = reverse('admin_analytics')
+        self.assertEqual(self.client.get(url, {'cohort': self.b.pk}).json()['students'], 40)
+        self.assertEqual(self.client.get(url, {'cohort': 999999}).status_code, 404)
+
+    def test_simulation_is_per_cohort(self):
+        cohorts.run_cohorts(workers=1)
+        result = simulation.simulate([{}], workers=1, cohort=self.a.pk)[0]['phases']['minor1']
+        seated = MinorAllocation.objects.filter(student__cohort_link__cohort=self.a)
+        self.assertEqual(result['allocated'] + result['unallocated'], 60)
+        self.assertEqual(
+            {course['id']: course['filled'] for course in result['courses']},
+            {
+                branch.pk: seated.filter(minor_branch=branch).count()
+                for branch in MinorBranch.objects.filter(cohort_link__cohort=self.a)
+            },
+        )
+
+        url = reverse('allocation_simulate')
+        response = self.client.post(url, {'scenarios': [{}]}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {'scenarios': [{}], 'cohort': self.b.code}, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(SimulationJob.objects.get(pk=response.json()['job']).cohort, self.b)
+
+
+class EligibilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.branch = MinorBranch.objects.create(name='Robotics', capacity=10)
+        # 60.1 has no exact float: the float is just above 60.10
+        EligibilityRule.objects.create(
+            branch=self.branch, rule_type='MIN_PERCENTAGE', value={'min_percentage': 60.1}, is_active=True,
+        )
+
+    def student(self, roll_no, percentage):
+        return Student.objects.create(
+            user=User.objects.create_user(roll_no), name=roll_no, roll_no=roll_no, department='CSE',
+            percentage=percentage, email=f'{roll_no}@example.com',
+        )
+
+    def test_threshold_without_exact_float(self):
+        at, below = self.student('at', Decimal('60.10')), self.student('below', Decimal('60.09'))
+        predicate = rules_for_branch(self.branch)
+
+        # As the registration form hands them over, and as read back
+        for students in ([at, below], list(Student.objects.order_by('id'))):
+            self.assertEqual([predicate(s) for s in students], [True, False])
+            self.assertEqual([utils.is_student_eligible(s, self.branch) for s in students], [True, False])
+            self.assertEqual(predicate.mask(StudentColumns(students)).tolist(), [True, False])
+
+
+class AdminDashboardTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('dashboard-admin', is_staff=True))
+
+    def query_counts(self, students):
+        clear_synthetic()
+        generate_cohort(students, seed=students)
+        cache.clear()
+        counts = []
+        for query in ('', '?q=synth&filter=submitted&page=2', '?filter=missing'):
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(reverse('admin_dashboard') + query)
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(captured))
+        return counts
+
+    def test_query_count_does_not_grow_with_the_cohort(self):
+        self.assertEqual(self.query_counts(40), self.query_counts(200))
+
+
+@skipUnless(connection.vendor in ('postgresql', 'sqlite'), "Query plans are checked on PostgreSQL and SQLite")
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_their_indexes(self):
+        for label, queryset, index in hot_queries():
+            with self.subTest(label):
+                self.assertIsNotNone(index)
+                self.assertIn(index, explain(queryset))
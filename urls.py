@@ -1,17 +1,36 @@
-from django.urls import path
+from django.urls import include, path
 from . import views
+from .api import urls as api_urls
 
 urlpatterns = [
     # Dashboards
     path('', views.home, name='home'),
     path('dashboard/admin/', views.admin_dashboard, name='admin_dashboard'),
+    path('dashboard/admin/analytics/', views.admin_analytics, name='admin_analytics'),
     path('dashboard/student/', views.student_dashboard, name='student_dashboard'),
+    path('api/preferences/', views.preference_api, name='preference_api'),
+
+    # Read-only integration API (api/)
+    path('api/v1/', include(api_urls)),
+
+    # Background allocation runs
+    path('allocation/jobs/start/', views.allocation_job_start, name='allocation_job_start'),
+    path('allocation/jobs/<int:pk>/', views.allocation_job_status, name='allocation_job_status'),
+    path('allocation/runs/', views.allocation_runs, name='allocation_runs'),
+    path('allocation/runs/<int:pk>/', views.allocation_run_detail, name='allocation_run_detail'),
+    path('allocation/runs/compare/', views.allocation_run_compare, name='allocation_run_compare'),
+    path('allocation/withdraw/', views.allocation_withdraw, name='allocation_withdraw'),
+    path('allocation/release/', views.allocation_release, name='allocation_release'),
+    path('allocation/notify/', views.allocation_notify, name='allocation_notify'),
+    path('allocation/simulate/', views.allocation_simulate, name='allocation_simulate'),
+    path('allocation/simulate/<int:pk>/', views.allocation_simulation_status, name='allocation_simulation_status'),
 
     # Course Management
     path('manage-courses/', views.manage_courses, name='manage_courses'),
     path('courses/create/', views.course_create, name='course_create'),
     path('courses/<str:course_type>/<int:pk>/update/', views.course_update, name='course_update'),
     path('courses/<str:course_type>/<int:pk>/delete/', views.course_delete, name='course_delete'),
+    path('courses/<str:course_type>/<int:pk>/reallocate/', views.course_reallocate, name='course_reallocate'),
 
     # ---------- MINOR RULES ----------
     path('rules/<int:branch_pk>/create/', views.rule_create, name='rule_create'),
@@ -27,4 +46,10 @@ urlpatterns = [
 
     # Reports
     path('reports/download/csv/', views.download_csv_report, name='download_csv_report'),
+
+    # Student import
+    path('students/import/', views.student_import, name='student_import'),
+
+    # Prometheus scrape endpoint; set the scrape job's metrics_path to /metrics/
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
@@ -3,9 +3,17 @@ from django.conf import settings
 from .models import (
     Student, MinorBranch, OpenElective,
     MinorPreference, DoubleMinorPreference, OEPreference,
-    MinorAllocation, DoubleMinorAllocation, OEAllocation , OEEligibilityRule
+    MinorAllocation, DoubleMinorAllocation, OEAllocation , OEEligibilityRule,
+    AllocationRunPhase, SeatRelease,
 )
 from django.db.models import Min, Count
+from django.db import transaction
+from django.utils import timezone
+import time
+
+from . import engine, history, metrics, strategies, waitlist
+from .dashboard_cache import invalidate_students
+from .eligibility import rules_for_branch, rules_for_oe
 
 
 
@@ -17,227 +25,408 @@ def is_student_eligible(student, branch: MinorBranch) -> bool:
     all active EligibilityRule rows attached to that branch.
     Returns True if all rules pass, False if any rule fails.
     """
-    rules = branch.rules.filter(is_active=True)
+    return rules_for_branch(branch)(student)
 
-    for rule in rules:
-        rtype = rule.rule_type
-        data = rule.value or {}
 
-        # 1) Minimum percentage rule
-        if rtype == "MIN_PERCENTAGE":
-            min_pct = data.get("min_percentage")
-            if min_pct is not None:
-                try:
-                    min_pct = float(min_pct)
-                except (TypeError, ValueError):
-                    # bad config → fail safe OR skip; here we skip to not block allocation
-                    continue
+def is_student_eligible_for_oe(student, oe_subject: OpenElective) -> bool:
+    """
+    Check if a student is eligible for a given OpenElective based on
+    active OEEligibilityRule rows attached to that OE.
+    """
+    # Future OE-specific rules (e.g. ONLY_NON_PARENT_DEPT) go in eligibility.CompiledRules
+    return rules_for_oe(oe_subject)(student)
+
+
+def _minor1_objects(allocations):
+    objects = []
+    for alloc in allocations:
+        student, branch = alloc.student, alloc.course
+        if alloc.priority is not None:
+            explanation = (
+                f"Allocated Minor '{branch.name}' using preference #{alloc.priority}. "
+                f"Student percentage: {student.percentage}. "
+                f"Eligible as per configured eligibility rules. "
+                f"Seats filled before allocation: {alloc.seats_before} / {branch.capacity}."
+            )
+        else:
+            explanation = (
+                f"Auto-allocated Minor '{branch.name}'. "
+                f"Student percentage: {student.percentage}. "
+                f"No preferences submitted. "
+                f"Seats filled before allocation: {alloc.seats_before} / {branch.capacity}."
+            )
+        objects.append(MinorAllocation(
+            student_id=student.id,
+            minor_branch_id=branch.id,
+            explanation=explanation
+        ))
+    return objects
+
+
+def _minor2_objects(allocations):
+    return [
+        DoubleMinorAllocation(student_id=alloc.student.id, minor_branch_id=alloc.course.id)
+        for alloc in allocations
+    ]
+
+
+def _oe_objects(allocations):
+    return [
+        OEAllocation(student_id=alloc.student.id, oe_subject_id=alloc.course.id)
+        for alloc in allocations
+    ]
+
+
+def _run_phase(spec, objects_for, progress, strategy, excluded=None, cohort=None):
+    """
+    Load, allocate and save one phase (of one cohort, or of everyone), and
+    record it in the run history. Each step is timed and its queries
+    counted (see metrics.py).
+    """
+    allocate = strategies.get_strategy(strategy)
+    name = strategies.strategy_name(strategy)
+    started_at, clock = timezone.now(), time.perf_counter()
+    with metrics.allocation_run(spec.name, name) as run:
+        progress('load')
+        with run.step(spec.name, 'load'):
+            students = engine.load_students(cohort)
+            data = engine.load_phase(spec, cohort=cohort)
+            if excluded is not None:
+                excluded = excluded(cohort)
+        with run.step(spec.name, 'eligibility'):
+            eligible = engine.eligibility_masks(students, data)
+
+        with run.step(spec.name, 'assign') as assign:
+            allocations = allocate(students, data, excluded=excluded, eligible=eligible, progress=progress)
+            objects = objects_for(allocations)
+
+        progress('write', len(objects), len(objects))
+        with run.step(spec.name, 'write') as write:
+            engine.save_allocations(spec, objects, cohort)
+            write['rows'] = len(objects)
+        phases = [history.PhaseRun(spec, data, allocations, eligible, excluded, assign['seconds'])]
+        with run.step(spec.name, 'history'):
+            record = history.record_run(
+                spec.name, name, started_at, time.perf_counter() - clock, students, phases, cohort=cohort,
+            )
+        with run.step(spec.name, 'waitlist'):
+            waitlist.rebuild(students, phases, record)
+
+
+def run_minor1_allocation(progress=engine.no_progress, strategy=None, cohort=None):
+    # Students sorted by merit + earliest submission, then everyone left
+    # over is auto-allocated (see engine.allocate_greedy). `strategy` picks
+    # another allocation strategy (see strategies.py); `cohort` limits the
+    # run to one cohort (see cohorts.py).
+    _run_phase(engine.MINOR1, _minor1_objects, progress, strategy, cohort=cohort)
+    return "Minor 1 allocation completed successfully"
 
-                if student.percentage < min_pct:
-                    return False
 
-        # 2) Blocked departments rule
-        elif rtype == "DEPARTMENT_BLOCK":
-            blocked_depts = data.get("blocked_departments", [])
-            # normalize to upper-case strings
-            blocked_depts = [str(d).upper().strip() for d in blocked_depts if str(d).strip()]
-            if (student.department or "").upper() in blocked_depts:
-                return False
 
-       
+def run_minor2_allocation(progress=engine.no_progress, strategy=None, cohort=None):
+    # Each student's Minor 1 branch is excluded from Minor 2
+    _run_phase(
+        engine.MINOR2, _minor2_objects, progress, strategy, excluded=engine.load_minor1_branches, cohort=cohort,
+    )
+    return "Minor 2 allocation completed. Unassigned students were auto-allocated where possible."
 
-    # If no rule failed → eligible
-    return True
 
+def run_oe_allocation(progress=engine.no_progress, strategy=None, cohort=None):
+    _run_phase(engine.OE, _oe_objects, progress, strategy, cohort=cohort)
+    return "Open Elective allocation completed with eligibility rules based on major and minors."
 
-def is_student_eligible_for_oe(student, oe_subject: OpenElective) -> bool:
-    """
-    Check if a student is eligible for a given OpenElective based on
-    active OEEligibilityRule rows attached to that OE.
-    """
-    rules = oe_subject.rules.filter(is_active=True)
-
-    for rule in rules:
-        rtype = rule.rule_type
-        data = rule.value or {}
-
-        if rtype == "MIN_PERCENTAGE":
-            min_pct = data.get("min_percentage")
-            if min_pct is not None:
-                try:
-                    min_pct = float(min_pct)
-                except (TypeError, ValueError):
-                    continue
-
-                if student.percentage < min_pct:
-                    return False
-
-        elif rtype == "DEPARTMENT_BLOCK":
-            blocked_depts = data.get("blocked_departments", [])
-            blocked_depts = [str(d).upper().strip() for d in blocked_depts if str(d).strip()]
-            if (student.department or "").upper() in blocked_depts:
-                return False
-
-        # Future OE-specific rules go here
-        # elif rtype == "ONLY_NON_PARENT_DEPT":
-        #     ...
-
-    return True
-def run_minor1_allocation():
-    # Clear previous allocations
-    MinorAllocation.objects.all().delete()
-
-    # Students with preferences (sorted by merit + earliest submission)
-    students_with_prefs = Student.objects.filter(
-        minor_preferences__isnull=False
-    ).annotate(
-        submission_time=Min('minor_preferences__submitted_at')
-    ).order_by('-percentage', 'submission_time')
-
-    # Allocation for students WITH preferences
-    for student in students_with_prefs:
-        preferences = MinorPreference.objects.filter(
-            student=student
-        ).order_by('priority')
-
-        for pref in preferences:
-            branch = pref.minor_branch
-
-            if not is_student_eligible(student, branch):
-                continue
-
-            allocated_count = MinorAllocation.objects.filter(
-                minor_branch=branch
-            ).count()
-
-            if allocated_count < branch.capacity:
-                explanation = (
-                    f"Allocated Minor '{branch.name}' using preference #{pref.priority}. "
-                    f"Student percentage: {student.percentage}. "
-                    f"Eligible as per configured eligibility rules. "
-                    f"Seats filled before allocation: {allocated_count} / {branch.capacity}."
-                )
 
-                MinorAllocation.objects.create(
-                    student=student,
-                    minor_branch=branch,
-                    explanation=explanation
-                )
-                break
-
-    # Auto-allocation for students WITHOUT preferences
-    students_without_prefs = Student.objects.filter(
-        minorallocation__isnull=True
-    ).order_by('-percentage', 'user__date_joined')
-
-    for student in students_without_prefs:
-        for branch in MinorBranch.objects.all():
-            if not is_student_eligible(student, branch):
-                continue
-
-            allocated_count = MinorAllocation.objects.filter(
-                minor_branch=branch
-            ).count()
-
-            if allocated_count < branch.capacity:
-                explanation = (
-                    f"Auto-allocated Minor '{branch.name}'. "
-                    f"Student percentage: {student.percentage}. "
-                    f"No preferences submitted. "
-                    f"Seats filled before allocation: {allocated_count} / {branch.capacity}."
-                )
+def _phase_progress(progress, name):
+    """Prefix a phase name ('minor1:auto') so one job can report all three."""
+    def report(phase, done=0, total=0):
+        progress(f"{name}:{phase}", done, total)
+    return report
 
-                MinorAllocation.objects.create(
-                    student=student,
-                    minor_branch=branch,
-                    explanation=explanation
-                )
-                break
 
-    return "Minor 1 allocation completed successfully"
+def run_all_allocations(progress=engine.no_progress, strategy=None, cohort=None):
+    """
+    Minor 1 → Minor 2 → OE in one pass: students, preferences and rules are
+    loaded once, Minor 1 results feed the Minor 2 exclusion straight from
+    memory, and all three tables are written in one transaction.
+    Produces the same allocations as running the three runners in order.
+    With `cohort`, only that cohort is loaded and replaced.
+    """
+    allocate = strategies.get_strategy(strategy)
+    name = strategies.strategy_name(strategy)
+    started_at, clock = timezone.now(), time.perf_counter()
+    with metrics.allocation_run('all', name) as run:
+        progress('load')
+        with run.step('all', 'load'):
+            students = engine.load_students(cohort)
+            minor1 = engine.load_phase(engine.MINOR1, cohort=cohort)
+            minor2 = engine.load_phase(engine.MINOR2, courses=minor1.courses, cohort=cohort)
+            oe = engine.load_phase(engine.OE, cohort=cohort)
+
+        # Minor 1 and Minor 2 draw on the same branches and rules
+        with run.step('all', 'eligibility'):
+            columns = engine.StudentColumns(students)
+            branch_masks = engine.eligibility_masks(students, minor1, columns)
+            oe_masks = engine.eligibility_masks(students, oe, columns)
+
+        with run.step('minor1', 'assign') as minor1_step:
+            minor1_allocs = allocate(
+                students, minor1, eligible=branch_masks,
+                progress=_phase_progress(progress, 'minor1'),
+            )
+            minor1_objects = _minor1_objects(minor1_allocs)
+        minor1_branches = {alloc.student.id: alloc.course.id for alloc in minor1_allocs}
+
+        with run.step('minor2', 'assign') as minor2_step:
+            minor2_allocs = allocate(
+                students, minor2, excluded=minor1_branches, eligible=branch_masks,
+                progress=_phase_progress(progress, 'minor2'),
+            )
+            minor2_objects = _minor2_objects(minor2_allocs)
+        with run.step('oe', 'assign') as oe_step:
+            oe_allocs = allocate(
+                students, oe, eligible=oe_masks,
+                progress=_phase_progress(progress, 'oe'),
+            )
+            oe_objects = _oe_objects(oe_allocs)
+
+        results = [
+            (engine.MINOR1, minor1_objects),
+            (engine.MINOR2, minor2_objects),
+            (engine.OE, oe_objects),
+        ]
+        written = sum(len(objects) for _, objects in results)
+        progress('write', written, written)
+        with run.step('all', 'write') as write:
+            engine.save_all(results, cohort)
+            write['rows'] = written
+        phases = [
+            history.PhaseRun(engine.MINOR1, minor1, minor1_allocs, branch_masks, None, minor1_step['seconds']),
+            history.PhaseRun(engine.MINOR2, minor2, minor2_allocs, branch_masks, minor1_branches,
+                             minor2_step['seconds']),
+            history.PhaseRun(engine.OE, oe, oe_allocs, oe_masks, None, oe_step['seconds']),
+        ]
+        with run.step('all', 'history'):
+            record = history.record_run(
+                'all', name, started_at, time.perf_counter() - clock, students, phases, cohort=cohort,
+            )
+        with run.step('all', 'waitlist'):
+            waitlist.rebuild(students, phases, record)
+    return "Minor 1, Minor 2 and Open Elective allocation completed in a single run."
+
+
+def _resume_phase(students, data, changes, objects_for, excluded=None, changed_students=(),
+                  eligible=None, old_explanations=None):
+    """
+    Re-run one phase from the first step affected by `changes`, keeping
+    every earlier allocation. Returns (new course_of, moves, rows to delete,
+    objects to insert, all allocations of the phase) where moves is
+    [(student, old_course_id, new_course_id)].
+    """
+    if eligible is None:
+        eligible = engine.eligibility_masks(students, data)
+    previous = engine.load_previous_run(students, data)
+    start = engine.first_affected_step(
+        students, data, previous, changes, eligible,
+        changed_students=changed_students, excluded=excluded,
+    )
+    if start is None:
+        # Nothing moves; resume past the last step so explanations still refresh
+        start = len(data.preference_order) + len(students)
+
+    students_by_id = {s.id: s for s in students}
+    kept = previous.kept(students_by_id, data, start)
+    new_allocs = engine.allocate_greedy(
+        students, data, excluded=excluded, eligible=eligible, start=start, kept=kept,
+    )
+
+    course_of = {alloc.student.id: alloc.course.id for alloc in kept}
+    course_of.update((alloc.student.id, alloc.course.id) for alloc in new_allocs)
+
+    # Only students at or after the resume point can have moved; kept rows
+    # on a changed course may still need a fresh explanation (its capacity)
+    redone = {sid for sid, step in previous.step_of.items() if step >= start}
+    redone.update(alloc.student.id for alloc in new_allocs)
+    refreshed = [alloc for alloc in kept if alloc.course.id in changes]
+    if old_explanations is not None:
+        redone.update(alloc.student.id for alloc in refreshed)
+
+    moves = []
+    new_objects = {obj.student_id: obj for obj in objects_for(refreshed + new_allocs)}
+    to_delete, to_insert = [], []
+    for sid in redone:
+        old, new = previous.course_of.get(sid), course_of.get(sid)
+        obj = new_objects.get(sid)
+        if old != new:
+            moves.append((students_by_id[sid], old, new))
+        elif old_explanations is None or obj is None or old_explanations.get(sid) == obj.explanation:
+            continue
+        if old is not None:
+            to_delete.append(sid)
+        if obj is not None:
+            to_insert.append(obj)
+    return course_of, moves, to_delete, to_insert, kept + new_allocs
+
+
+def _rerun_with_diff(course_type, cohort=None):
+    specs = [engine.MINOR1, engine.MINOR2] if course_type == 'minor' else [engine.OE]
+
+    def current():
+        return {
+            spec.name: dict(engine.in_cohort(spec.allocation_model.objects.all(), cohort, 'student__').values_list(
+                'student_id', f'{spec.course_field}_id'
+            ))
+            for spec in specs
+        }
+
+    before = current()
+    if course_type == 'minor':
+        run_minor1_allocation(cohort=cohort)
+        run_minor2_allocation(cohort=cohort)
+    else:
+        run_oe_allocation(cohort=cohort)
+    after = current()
+
+    moved = [
+        (spec, sid, before[spec.name].get(sid), after[spec.name].get(sid))
+        for spec in specs
+        for sid in set(before[spec.name]) | set(after[spec.name])
+        if before[spec.name].get(sid) != after[spec.name].get(sid)
+    ]
+    students = Student.objects.in_bulk({sid for _, sid, _, _ in moved})
+    courses = specs[0].course_model.objects.in_bulk()
+    return [
+        (spec.name, students[sid], courses.get(old), courses.get(new))
+        for spec, sid, old, new in moved
+    ]
+
+
+def _resumable_run(specs, cohort=None):
+    """
+    The latest run of `specs` (of the cohort) if the stored allocations
+    are still that greedy run's result, else None: when a phase was last
+    run with another strategy, was never run, or had seats released (and
+    backfilled from the waitlist) since.
+    """
+    cohort_id = getattr(cohort, 'pk', cohort)
+    latest = None
+    for spec in specs:
+        phase = AllocationRunPhase.objects.filter(
+            phase=spec.name, run__cohort_id=cohort_id,
+        ).select_related('run').order_by('-run__started_at', '-run__pk').first()
+        if phase is None or strategies.get_strategy(phase.run.strategy) is not engine.allocate_greedy:
+            return None
+        released = engine.in_cohort(SeatRelease.objects.all(), cohort, 'student__').filter(
+            phase=spec.name, created_at__gte=phase.run.started_at,
+        )
+        if released.exists():
+            return None
+        latest = latest or phase.run
+    return latest
+
+
+def run_incremental_allocation(course_type, changes):
+    """
+    Re-allocate after a course change without starting from scratch.
 
+    `course_type` is 'minor' or 'oe'; `changes` maps course id → its old
+    capacity, or None when unknown or its rules changed. Unknowns are
+    filled in from the last run's parameters (history.course_changes): a
+    course whose rules are unchanged since then gets the capacity it had
+    in that run. Every allocation made before
+    the first student whose decision can be affected is kept and the greedy
+    resumes from there, so the result matches a full rerun. A branch change
+    re-runs Minor 1 and then Minor 2 (students whose Minor 1 moved are
+    re-checked too); an OE change only re-runs OE.
 
+    Assumes preferences and students are unchanged since the last run;
+    otherwise use the full runners.
 
-def run_minor2_allocation():
-    DoubleMinorAllocation.objects.all().delete()
-
-    # Use correct related_name for reverse relations
-    students_with_prefs = Student.objects.filter(double_minor_preferences__isnull=False).annotate(
-        submission_time=Min('double_minor_preferences__submitted_at')
-    ).order_by('-percentage', 'submission_time')
-
-    for student in students_with_prefs:
-        # Get the student's Minor 1 allocation to exclude it from Minor 2
-        minor1_allocation = MinorAllocation.objects.filter(student=student).first()
-        minor1_branch_id = minor1_allocation.minor_branch_id if minor1_allocation else None
-        
-        preferences = DoubleMinorPreference.objects.filter(student=student).order_by('priority')
-        for pref in preferences:
-            branch = pref.minor_branch
-            # Check if student is eligible and hasn't already been allocated this branch for Minor 1
-            if is_student_eligible(student, branch) and branch.id != minor1_branch_id:
-                allocated_count = DoubleMinorAllocation.objects.filter(minor_branch=branch).count()
-                if allocated_count < branch.capacity:
-                    DoubleMinorAllocation.objects.create(student=student, minor_branch=branch)
-                    break
-    
-    # Auto-allocation phase for students without preferences
-    students_without_prefs = Student.objects.filter(doubleminorallocation__isnull=True).order_by('-percentage', 'user__date_joined')
-    for student in students_without_prefs:
-        # Get the student's Minor 1 allocation to exclude it from Minor 2
-        minor1_allocation = MinorAllocation.objects.filter(student=student).first()
-        minor1_branch_id = minor1_allocation.minor_branch_id if minor1_allocation else None
-        
-        available_branches = MinorBranch.objects.all()
-        for branch in available_branches:
-            # Check if student is eligible and hasn't already been allocated this branch for Minor 1
-            if is_student_eligible(student, branch) and branch.id != minor1_branch_id:
-                allocated_count = DoubleMinorAllocation.objects.filter(minor_branch=branch).count()
-                if allocated_count < branch.capacity:
-                    DoubleMinorAllocation.objects.create(student=student, minor_branch=branch)
-                    break
-    
-    return "Minor 2 allocation completed. Unassigned students were auto-allocated where possible."
+    Returns a list of (phase name, student, old course, new course).
 
+    Resuming mid-run only works for the greedy strategy, from rows that
+    are still a greedy run's result (see _resumable_run). Otherwise the
+    affected phases are re-run in full and the same diff is returned.
 
-def run_oe_allocation():
-    OEAllocation.objects.all().delete()
-    
-    # Students who submitted OE preferences
-    students_with_prefs = Student.objects.filter(
-        oe_preferences__isnull=False
-    ).annotate(
-        submission_time=Min('oe_preferences__submitted_at')
-    ).order_by('-percentage', 'submission_time')
-
-    for student in students_with_prefs:
-        preferences = OEPreference.objects.filter(student=student).order_by('priority')
-        for pref in preferences:
-            oe_subject = pref.oe_subject
-
-            # ✅ Apply all OE eligibility logic here
-            if not is_student_eligible_for_oe(student, oe_subject):
-                continue
-
-            allocated_count = OEAllocation.objects.filter(oe_subject=oe_subject).count()
-            if allocated_count < oe_subject.capacity:
-                OEAllocation.objects.create(student=student, oe_subject=oe_subject)
-                break
-                
-    # Auto-allocation phase for students without OE preferences
-    students_without_prefs = Student.objects.filter(
-        oeallocation__isnull=True
-    ).order_by('-percentage', 'user__date_joined')
-
-    for student in students_without_prefs:
-        available_oes = OpenElective.objects.all()
-        for oe_subject in available_oes:
-            if not is_student_eligible_for_oe(student, oe_subject):
-                continue
-
-            allocated_count = OEAllocation.objects.filter(oe_subject=oe_subject).count()
-            if allocated_count < oe_subject.capacity:
-                OEAllocation.objects.create(student=student, oe_subject=oe_subject)
-                break
-    
-    return "Open Elective allocation completed with eligibility rules based on major and minors."
+    When the changed courses belong to a cohort, only that cohort is
+    re-allocated.
+    """
+    spec = engine.MINOR1 if course_type == 'minor' else engine.OE
+    cohort = engine.course_cohort(spec, list(changes))
+    if strategies.get_strategy() is not engine.allocate_greedy:
+        return _rerun_with_diff(course_type, cohort)
+    specs = [engine.MINOR1, engine.MINOR2] if course_type == 'minor' else [engine.OE]
+    last_run = _resumable_run(specs, cohort)
+    if last_run is None:
+        return _rerun_with_diff(course_type, cohort)
+
+    started_at, clock = timezone.now(), time.perf_counter()
+    results, diff, phases = [], [], []
+
+    def add_phase(spec, data, moves, to_delete, to_insert, allocations, eligible, excluded, seconds):
+        results.append((spec, to_delete, to_insert))
+        phases.append(history.PhaseRun(spec, data, allocations, eligible, excluded, seconds))
+        for student, old, new in moves:
+            diff.append((
+                spec.name, student,
+                data.courses_by_id.get(old), data.courses_by_id.get(new),
+            ))
+
+    with metrics.allocation_run('incremental', strategies.DEFAULT_STRATEGY) as run:
+        if course_type == 'minor':
+            with run.step('all', 'load'):
+                students = engine.load_students(cohort)
+                minor1 = engine.load_phase(engine.MINOR1, cohort=cohort)
+                minor2 = engine.load_phase(engine.MINOR2, courses=minor1.courses, cohort=cohort)
+                old_explanations = dict(engine.in_cohort(
+                    MinorAllocation.objects.all(), cohort, 'student__'
+                ).values_list('student_id', 'explanation'))
+                changes = history.course_changes(last_run, minor1, changes)
+            with run.step('all', 'eligibility'):
+                branch_masks = engine.eligibility_masks(students, minor1)
+
+            with run.step('minor1', 'assign') as step:
+                minor1_branches, moves, to_delete, to_insert, allocations = _resume_phase(
+                    students, minor1, changes, _minor1_objects,
+                    eligible=branch_masks, old_explanations=old_explanations,
+                )
+            add_phase(engine.MINOR1, minor1, moves, to_delete, to_insert,
+                   allocations, branch_masks, None, step['seconds'])
+
+            with run.step('minor2', 'assign') as step:
+                _, moves, to_delete, to_insert, allocations = _resume_phase(
+                    students, minor2, changes, _minor2_objects,
+                    excluded=minor1_branches, eligible=branch_masks,
+                    changed_students=[student.id for student, _, _ in moves],
+                )
+            add_phase(engine.MINOR2, minor2, moves, to_delete, to_insert,
+                   allocations, branch_masks, minor1_branches, step['seconds'])
+        else:
+            with run.step('all', 'load'):
+                students = engine.load_students(cohort)
+                oe = engine.load_phase(engine.OE, cohort=cohort)
+                changes = history.course_changes(last_run, oe, changes)
+            with run.step('all', 'eligibility'):
+                oe_masks = engine.eligibility_masks(students, oe)
+            with run.step('oe', 'assign') as step:
+                _, moves, to_delete, to_insert, allocations = _resume_phase(
+                    students, oe, changes, _oe_objects, eligible=oe_masks,
+                )
+            add_phase(engine.OE, oe, moves, to_delete, to_insert,
+                   allocations, oe_masks, None, step['seconds'])
+
+        with run.step('all', 'write') as write, transaction.atomic():
+            for spec, to_delete, to_insert in results:
+                model = spec.allocation_model
+                model.objects.filter(student_id__in=to_delete).delete()
+                model.objects.bulk_create(to_insert, batch_size=engine.BULK_BATCH_SIZE)
+                write['rows'] += len(to_insert)
+            transaction.on_commit(invalidate_students)
+        with run.step('all', 'history'):
+            record = history.record_run(
+                'incremental', strategies.DEFAULT_STRATEGY, started_at, time.perf_counter() - clock,
+                students, phases, cohort=cohort,
+            )
+        with run.step('all', 'waitlist'):
+            waitlist.rebuild(students, phases, record)
+
+    return diff
@@ -1,12 +1,23 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.utils import timezone
-from django.core.mail import send_mail
 from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.http import require_POST
+from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    BooleanField, Exists, ExpressionWrapper, OuterRef, Prefetch, Q, Subquery,
+)
+from django.utils.dateparse import parse_datetime
 
+import hmac
+import io
+import json
 import random
 import string
 
@@ -15,7 +26,18 @@ from .forms import (
     PasswordResetRequestForm,
     OTPPasswordResetForm,
 )
-from allotment.models import Student
+from allotment.models import (
+    Student, PreferenceWindow, AllocationJob, AllocationRun, AllocationRunPhase, SeatRelease, SimulationJob,
+    Cohort, MinorPreference, DoubleMinorPreference, OEPreference,
+)
+from allotment.tasks import expire_stale_jobs, run_allocation_job, run_simulation_job
+from allotment.utils import run_incremental_allocation
+from allotment import analytics, cohorts, dashboard_cache, history, metrics, outbox, reports, simulation, waitlist
+from allotment.metrics import instrument_view
+from allotment.preferences import (
+    CATEGORIES, Busy, InvalidRanking, PreferenceError, VersionConflict, submit_preferences, window_status,
+)
+from allotment.student_import import import_students
 
 
 # -------------------------
@@ -126,7 +148,8 @@ def _generate_otp(length=6):
 
 def forgot_password(request):
     """
-    Step 1: User enters email, we send OTP and store it in session.
+    Step 1: User enters email, we store an OTP in session and queue it
+    for sending (outbox.py).
     """
     if request.method == 'POST':
         form = PasswordResetRequestForm(request.POST)
@@ -143,16 +166,9 @@ def forgot_password(request):
                 request.session['password_reset_otp'] = otp
                 request.session['password_reset_time'] = timezone.now().isoformat()
 
-                subject = "SmartAllot Password Reset OTP"
-                message = f"Your OTP for password reset is: {otp}\nThis code is valid for a short time."
-                from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', None)
-
-                try:
-                    send_mail(subject, message, from_email, [email])
-                    messages.success(request, "OTP has been sent to your email.")
-                    return redirect('reset_password_with_otp')
-                except Exception as e:
-                    form.add_error(None, f"Error sending email: {e}")
+                outbox.queue_otp(email, otp)
+                messages.success(request, "OTP has been sent to your email.")
+                return redirect('reset_password_with_otp')
     else:
         form = PasswordResetRequestForm()
 
@@ -198,3 +214,642 @@ def reset_password_with_otp(request):
         form = OTPPasswordResetForm()
 
     return render(request, 'core/reset_password_with_otp.html', {'form': form})
+
+
+# -------------------------
+# Background Allocation Jobs
+# -------------------------
+def _is_admin(user):
+    return user.is_authenticated and (user.is_staff or user.is_superuser)
+
+
+@instrument_view
+@require_POST
+def allocation_job_start(request):
+    """
+    Queue an allocation run from the admin dashboard's Run buttons
+    (run_minor1 / run_minor2 / run_oe / run_all / run_cohorts) and go back to the dashboard,
+    which polls the job for progress. Once cohorts are defined only
+    run_cohorts is accepted.
+    """
+    if not _is_admin(request.user):
+        return redirect('admin_login')
+
+    kind = next((k for k in ('minor1', 'minor2', 'oe', 'all', 'cohorts') if f'run_{k}' in request.POST), None)
+    if kind is None:
+        messages.error(request, "Unknown allocation type.")
+        return redirect('admin_dashboard')
+
+    if kind != 'cohorts' and cohorts.has_cohorts():
+        # A run over everyone would let the cohorts compete for each other's seats
+        messages.error(request, "Cohorts are defined: allocate them with Run All Cohorts.")
+        return redirect('admin_dashboard')
+
+    expire_stale_jobs()
+    try:
+        with transaction.atomic():
+            job = AllocationJob.objects.create(kind=kind, requested_by=request.user)
+    except IntegrityError:
+        # The one_active_allocation_job constraint: another job is queued or running
+        active = AllocationJob.objects.filter(status__in=AllocationJob.ACTIVE_STATUSES).first()
+        messages.error(request, f"{active or 'Another allocation'} is still in progress. Please wait for it to finish.")
+        return redirect(f"{reverse('admin_dashboard')}?job={active.pk}" if active else 'admin_dashboard')
+
+    transaction.on_commit(lambda: run_allocation_job.delay(job.pk))
+    messages.success(request, f"{job.get_kind_display()} allocation has been queued.")
+    return redirect(f"{reverse('admin_dashboard')}?job={job.pk}")
+
+
+def allocation_job_status(request, pk):
+    """
+    JSON progress of one allocation job, polled by the admin dashboard.
+    """
+    if not _is_admin(request.user):
+        return JsonResponse({'error': 'forbidden'}, status=403)
+
+    expire_stale_jobs()
+    job = get_object_or_404(AllocationJob, pk=pk)
+    return JsonResponse({
+        'id': job.pk,
+        'kind': job.kind,
+        'kind_display': job.get_kind_display(),
+        'status': job.status,
+        'phase': job.phase,
+        'processed': job.processed,
+        'total': job.total,
+        'message': job.message,
+        'duration': job.duration,
+        'finished': job.is_finished,
+    })
+
+
+# -------------------------
+# Incremental Re-allocation
+# -------------------------
+PHASE_LABELS = {'minor1': 'Minor 1', 'minor2': 'Minor 2', 'oe': 'Open Elective'}
+
+
+@require_POST
+def course_reallocate(request, course_type, pk):
+    """
+    Re-allocate after one course changed, keeping every allocation made
+    before the first affected student, and show who moved. Whether only
+    the capacity changed is worked out from the last run's parameters
+    (see run_incremental_allocation); `old_capacity` (optional) overrides
+    the capacity it had then.
+    """
+    if not _is_admin(request.user):
+        return redirect('admin_login')
+    if course_type not in ('minor', 'oe'):
+        messages.error(request, "Unknown course type.")
+        return redirect('manage_courses')
+
+    try:
+        old_capacity = int(request.POST['old_capacity'])
+    except (KeyError, ValueError):
+        old_capacity = None
+
+    diff = run_incremental_allocation(course_type, {pk: old_capacity})
+    moves = [
+        {
+            'phase': PHASE_LABELS[phase],
+            'student': student,
+            'old_course': old_course,
+            'new_course': new_course,
+        }
+        for phase, student, old_course, new_course in diff
+    ]
+    return render(request, 'reallocation_diff.html', {'moves': moves})
+
+
+# -------------------------
+# Seat Release and Waitlist Backfill
+# -------------------------
+@require_POST
+def allocation_withdraw(request):
+    """A student gives up their seat in one phase (POST `phase`)."""
+    if not request.user.is_authenticated or _is_admin(request.user):
+        return redirect('student_login')
+    student = get_object_or_404(Student, user=request.user)
+    phase = request.POST.get('phase')
+    if phase not in waitlist.PHASES:
+        messages.error(request, "Unknown allocation.")
+    elif waitlist.release(phase, student, SeatRelease.REASON_WITHDRAWN, released_by=request.user):
+        messages.success(request, f"You have withdrawn from your {PHASE_LABELS[phase]} seat.")
+    else:
+        messages.error(request, f"You have no {PHASE_LABELS[phase]} seat to withdraw from.")
+    return redirect('student_dashboard')
+
+
+@require_POST
+def allocation_release(request):
+    """An admin takes away a student's seat (POST `phase`, `roll_no`)."""
+    if not _is_admin(request.user):
+        return redirect('admin_login')
+    phase = request.POST.get('phase')
+    student = Student.objects.filter(roll_no=request.POST.get('roll_no', '').strip()).first()
+    if phase not in waitlist.PHASES or student is None:
+        messages.error(request, "Pick an allocation and an existing roll number.")
+    elif waitlist.release(phase, student, SeatRelease.REASON_REMOVED, released_by=request.user):
+        messages.success(
+            request,
+            f"{student.roll_no}'s {PHASE_LABELS[phase]} seat was released; "
+            f"the waitlist will fill it in a few seconds.",
+        )
+    else:
+        messages.error(request, f"{student.roll_no} has no {PHASE_LABELS[phase]} seat.")
+    return redirect('admin_dashboard')
+
+
+@require_POST
+def allocation_notify(request):
+    """Queue an email with their allocation results to every student."""
+    if not _is_admin(request.user):
+        return redirect('admin_login')
+    count = outbox.queue_allocation_results()
+    messages.success(request, f"Queued allocation result emails for {count} students; they are sent in the background.")
+    return redirect('admin_dashboard')
+
+
+# -------------------------
+# What-if Simulation
+# -------------------------
+@instrument_view
+@require_POST
+def allocation_simulate(request):
+    """
+    Queue allocation scenarios to run in memory, without writing anything.
+    Body: {"scenarios": [{...}, ...], "cohort": "code"} (format in
+    simulation.py); the cohort is required once cohorts are defined.
+    Answers 202 with {"job": id, "status_url": url}; the results come from
+    allocation_simulation_status once the worker has run them.
+    """
+    if not _is_admin(request.user):
+        return JsonResponse({'error': 'forbidden'}, status=403)
+
+    try:
+        body = json.loads(request.body)
+        scenarios = body.get('scenarios')
+        code = body.get('cohort')
+        simulation.check_scenarios(scenarios)
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'Expected {"scenarios": [...]}.'}, status=400)
+    except simulation.SimulationError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    cohort = None
+    if code is not None:
+        cohort = Cohort.objects.filter(code=str(code)).first()
+        if cohort is None:
+            return JsonResponse({'error': f"Unknown cohort '{code}'."}, status=400)
+    elif cohorts.has_cohorts():
+        # Cohorts never compete for seats, so neither do their scenarios
+        return JsonResponse({'error': 'Pick a cohort to simulate.'}, status=400)
+
+    job = SimulationJob.objects.create(scenarios=scenarios, cohort=cohort, requested_by=request.user)
+    transaction.on_commit(lambda: run_simulation_job.delay(job.pk))
+    return JsonResponse(
+        {'job': job.pk, 'status_url': reverse('allocation_simulation_status', args=[job.pk])}, status=202,
+    )
+
+
+def allocation_simulation_status(request, pk):
+    """
+    One simulation job: {"status": ..., "finished": bool}, plus
+    "scenarios" (one summary each, in order) once it succeeded or
+    "error" when a scenario was invalid or the run failed.
+    """
+    if not _is_admin(request.user):
+        return JsonResponse({'error': 'forbidden'}, status=403)
+
+    job = get_object_or_404(SimulationJob, pk=pk)
+    data = {'id': job.pk, 'status': job.status, 'finished': job.is_finished, 'duration': job.duration}
+    if job.status == AllocationJob.STATUS_SUCCESS:
+        data['scenarios'] = job.results
+    elif job.status == AllocationJob.STATUS_FAILED:
+        data['error'] = job.message
+    return JsonResponse(data)
+
+
+# -------------------------
+# Allocation Run History
+# -------------------------
+def allocation_runs(request):
+    """Past allocation runs, newest first, with a form to compare two."""
+    if not _is_admin(request.user):
+        return redirect('admin_login')
+
+    runs = AllocationRun.objects.select_related('cohort').prefetch_related(
+        Prefetch('phases', queryset=AllocationRunPhase.objects.defer('outcomes').order_by('pk'))
+    )
+    page_obj = Paginator(runs, 25).get_page(request.GET.get('page'))
+    return render(request, 'allocation_runs.html', {'page_obj': page_obj})
+
+
+@instrument_view
+def allocation_run_detail(request, pk):
+    """
+    Per-student outcomes of one phase of a run, explained from the stored
+    arrays. `phase` picks the phase, `q` filters by roll number.
+    """
+    if not _is_admin(request.user):
+        return redirect('admin_login')
+
+    run = get_object_or_404(AllocationRun, pk=pk)
+    phases = list(run.phases.defer('outcomes').order_by('pk'))
+    if not phases:
+        raise Http404("This run has no phases.")
+    names = [p.phase for p in phases]
+    name = request.GET.get('phase') if request.GET.get('phase') in names else names[0]
+    outcomes = history.PhaseOutcomes(run.phases.get(phase=name).outcomes)
+
+    search = request.GET.get('q', '').strip()
+    if search:
+        ids = Student.objects.filter(roll_no__icontains=search).values_list('id', flat=True)
+        indexes = sorted(i for i in map(outcomes.index, ids) if i is not None)
+    else:
+        indexes = range(len(outcomes))
+    page_obj = Paginator(indexes, 50).get_page(request.GET.get('page'))
+
+    rows = [outcomes.outcome(i) for i in page_obj]
+    students = Student.objects.in_bulk([o.student_id for o in rows])
+    page_rows = [
+        {
+            'student': students.get(o.student_id),
+            'course': history.course_name(run, name, o.course_id),
+            'rank': o.rank,
+            'explanation': history.render_outcome(run, name, o),
+        }
+        for o in rows
+    ]
+
+    params = request.GET.copy()
+    params.pop('page', None)
+    return render(request, 'allocation_run_detail.html', {
+        'run': run,
+        'phases': [(p, history.PHASE_LABELS[p.phase]) for p in phases],
+        'phase': name,
+        'page_obj': page_obj,
+        'rows': page_rows,
+        'search': search,
+        'query_string': params.urlencode(),
+    })
+
+
+def allocation_run_compare(request):
+    """Who moved between runs `a` and `b`, per phase both of them ran."""
+    if not _is_admin(request.user):
+        return redirect('admin_login')
+
+    try:
+        run_a = AllocationRun.objects.get(pk=int(request.GET['a']))
+        run_b = AllocationRun.objects.get(pk=int(request.GET['b']))
+    except (KeyError, ValueError, AllocationRun.DoesNotExist):
+        messages.error(request, "Pick two existing runs to compare.")
+        return redirect('allocation_runs')
+
+    phases = history.compare_runs(run_a, run_b)
+    students = Student.objects.in_bulk({c.student_id for phase in phases for c in phase['changes']})
+    for phase in phases:
+        phase['changes'] = [
+            {
+                'student': students.get(c.student_id),
+                'old_course': history.course_name(run_a, phase['phase'], c.course_a),
+                'new_course': history.course_name(run_b, phase['phase'], c.course_b),
+                'old_rank': c.rank_a,
+                'new_rank': c.rank_b,
+            }
+            for c in phase['changes']
+        ]
+    return render(request, 'allocation_run_compare.html', {
+        'run_a': run_a, 'run_b': run_b, 'phases': phases,
+    })
+
+
+# -------------------------
+# Student Dashboard
+# -------------------------
+# POST field of the dashboard form -> preference category
+PREFERENCE_FIELDS = {
+    'minor1_order': 'minor1',
+    'minor2_order': 'minor2',
+    'oe_order': 'oe',
+}
+
+
+@instrument_view
+def student_dashboard(request):
+    """
+    Student view: allocations, preference window status and the three
+    drag-and-drop preference lists.
+
+    Everything comes from dashboard_cache (student snapshot, course catalog,
+    window), so a warm load doesn't touch the database.
+    """
+    if not request.user.is_authenticated:
+        return redirect('student_login')
+    if _is_admin(request.user):
+        return redirect('admin_dashboard')
+
+    snapshot = dashboard_cache.student_snapshot(request.user.id)
+    if snapshot is None:
+        logout(request)
+        messages.error(request, "No student profile is linked to this account.")
+        return redirect('student_login')
+
+    if request.method == 'POST':
+        rankings = {
+            category: [v for v in request.POST.get(field, '').split(',') if v]
+            for field, category in PREFERENCE_FIELDS.items()
+        }
+        try:
+            version = int(request.POST.get('version', ''))
+        except ValueError:
+            # A form without its version can't be checked for staleness
+            version = None
+        try:
+            submit_preferences(snapshot['student'], rankings, version)
+        except PreferenceError as e:
+            messages.error(request, str(e))
+        else:
+            messages.success(request, "Your preferences have been saved.")
+        return redirect('student_dashboard')
+
+    window = dashboard_cache.current_window()
+    status = window_status(window)
+    catalog = dashboard_cache.course_catalog(snapshot['cohort_id'])
+
+    def available(catalog_key, prefs, course_field):
+        selected = {getattr(pref, f'{course_field}_id') for pref in prefs}
+        return [course for course in catalog[catalog_key] if course['id'] not in selected]
+
+    context = {
+        **snapshot,
+        'window': window,
+        'window_status': status,
+        'window_is_open': status == 'open',
+        'available_m1': available('minor', snapshot['selected_m1_prefs'], 'minor_branch'),
+        'available_m2': available('minor', snapshot['selected_m2_prefs'], 'minor_branch'),
+        'available_oe': available('oe', snapshot['selected_oe_prefs'], 'oe_subject'),
+    }
+    return render(request, 'student_dashboard.html', context)
+
+
+@instrument_view
+def preference_api(request):
+    """
+    JSON preference submission.
+
+    GET returns the student's lists and their version. POST takes
+    {"version": n, "minor1": [ids], "minor2": [ids], "oe": [ids]}
+    (lists left out are kept) and answers 200 with the new version,
+    400 for an invalid ranking, 403 when the window is closed,
+    409 with the current version when it is stale or 503 when the
+    database was too busy to save it.
+    """
+    if not request.user.is_authenticated or _is_admin(request.user):
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    snapshot = dashboard_cache.student_snapshot(request.user.id)
+    if snapshot is None:
+        return JsonResponse({'error': 'No student profile is linked to this account.'}, status=403)
+
+    if request.method == 'GET':
+        return JsonResponse({
+            'version': snapshot['preference_version'],
+            'window_status': window_status(dashboard_cache.current_window()),
+            'minor1': [p.minor_branch_id for p in snapshot['selected_m1_prefs']],
+            'minor2': [p.minor_branch_id for p in snapshot['selected_m2_prefs']],
+            'oe': [p.oe_subject_id for p in snapshot['selected_oe_prefs']],
+        })
+    if request.method != 'POST':
+        return JsonResponse({'error': 'method not allowed'}, status=405)
+
+    try:
+        payload = json.loads(request.body)
+        version = int(payload['version'])
+        rankings = {c: payload[c] for c in CATEGORIES if c in payload}
+        if not all(isinstance(ids, list) for ids in rankings.values()):
+            raise ValueError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected {"version": n, "minor1": [...], ...}.'}, status=400)
+
+    try:
+        new_version = submit_preferences(snapshot['student'], rankings, version)
+    except VersionConflict as e:
+        return JsonResponse({'error': str(e), 'version': e.current_version}, status=409)
+    except Busy as e:
+        response = JsonResponse({'error': str(e)}, status=503)
+        response['Retry-After'] = '1'
+        return response
+    except PreferenceError as e:
+        status = 400 if isinstance(e, InvalidRanking) else 403
+        return JsonResponse({'error': str(e)}, status=status)
+    return JsonResponse({'version': new_version})
+
+
+# -------------------------
+# Admin Dashboard
+# -------------------------
+def _first_submission(model):
+    return Subquery(
+        model.objects.filter(student=OuterRef('pk'))
+        .order_by('submitted_at').values('submitted_at')[:1]
+    )
+
+
+def dashboard_students(search='', submission='all'):
+    """
+    Students for the admin dashboard table, with everything the template
+    needs in a fixed number of queries: first submission times and the
+    has_any flag are annotated, preference lists are prefetched in
+    priority order with their course.
+    """
+    has_any = (
+        Exists(MinorPreference.objects.filter(student=OuterRef('pk')))
+        | Exists(DoubleMinorPreference.objects.filter(student=OuterRef('pk')))
+        | Exists(OEPreference.objects.filter(student=OuterRef('pk')))
+    )
+    students = Student.objects.annotate(
+        minor_time=_first_submission(MinorPreference),
+        double_minor_time=_first_submission(DoubleMinorPreference),
+        oe_time=_first_submission(OEPreference),
+        has_any=ExpressionWrapper(has_any, output_field=BooleanField()),
+    ).prefetch_related(
+        Prefetch('minor_preferences',
+                 queryset=MinorPreference.objects.select_related('minor_branch').order_by('priority')),
+        Prefetch('double_minor_preferences',
+                 queryset=DoubleMinorPreference.objects.select_related('minor_branch').order_by('priority')),
+        Prefetch('oe_preferences',
+                 queryset=OEPreference.objects.select_related('oe_subject').order_by('priority')),
+    )
+
+    # Prefix match so the case-insensitive name / roll_no indexes are used
+    if search:
+        students = students.filter(Q(name__istartswith=search) | Q(roll_no__istartswith=search))
+    if submission == 'submitted':
+        students = students.filter(has_any=True)
+    elif submission == 'missing':
+        students = students.filter(has_any=False)
+
+    return students.order_by('-percentage', 'roll_no')
+
+
+def _save_window(request, window):
+    start_at = parse_datetime(request.POST.get('start_at') or '')
+    end_at = parse_datetime(request.POST.get('end_at') or '')
+    if not start_at or not end_at:
+        messages.error(request, "Please provide both start and end times.")
+        return
+    if timezone.is_naive(start_at):
+        start_at = timezone.make_aware(start_at)
+    if timezone.is_naive(end_at):
+        end_at = timezone.make_aware(end_at)
+    if end_at <= start_at:
+        messages.error(request, "End time must be after start time.")
+        return
+
+    window = window or PreferenceWindow(name='Preference Window')
+    window.start_at = start_at
+    window.end_at = end_at
+    window.is_active = 'is_active' in request.POST
+    window.save()
+    messages.success(request, "Preference window saved.")
+
+
+@instrument_view
+def admin_dashboard(request):
+    """
+    Admin overview: summary counts, preference window settings and a
+    paginated, server-side searchable table of student preferences. The
+    counts come from the cached cohort analytics; the charts fetch the
+    rest from admin_analytics after the page has loaded.
+    """
+    if not _is_admin(request.user):
+        return redirect('admin_login')
+
+    window = PreferenceWindow.objects.order_by('-id').first()
+
+    if request.method == 'POST' and 'save_window' in request.POST:
+        _save_window(request, window)
+        return redirect('admin_dashboard')
+
+    search = request.GET.get('q', '').strip()
+    submission = request.GET.get('filter', 'all')
+    paginator = Paginator(
+        dashboard_students(search, submission), getattr(settings, 'PAGE_SIZE', 10)
+    )
+    page_obj = paginator.get_page(request.GET.get('page'))
+
+    # Query string without the page number, for the pagination links
+    params = request.GET.copy()
+    params.pop('page', None)
+
+    cohort = analytics.cohort_analytics()
+    context = {
+        'page_obj': page_obj,
+        'search': search,
+        'submission': submission,
+        'query_string': params.urlencode(),
+        'student_count': cohort['students'],
+        'minor_allocation_count': cohort['phases']['minor1']['allocated'],
+        'double_minor_allocation_count': cohort['phases']['minor2']['allocated'],
+        'oe_allocation_count': cohort['phases']['oe']['allocated'],
+        'window': window,
+        'window_start_value': timezone.localtime(window.start_at).strftime('%Y-%m-%dT%H:%M') if window else None,
+        'window_end_value': timezone.localtime(window.end_at).strftime('%Y-%m-%dT%H:%M') if window else None,
+        'window_is_active': window.is_active if window else False,
+        'departments': Student.DEPARTMENTS,
+        'has_cohorts': cohorts.has_cohorts(),
+        'cohorts': Cohort.objects.all(),
+        'dashboard_cache_stats': dashboard_cache.stats(),
+        'report_columns': [
+            (key, label, key in reports.DEFAULT_COLUMNS)
+            for key, label in reports.REPORT_COLUMNS.items()
+        ],
+    }
+    return render(request, 'admin_dashboard.html', context)
+
+
+@instrument_view
+def admin_analytics(request):
+    """
+    Cohort analytics for the dashboard charts, as JSON (see analytics.py):
+    of the cohort given as ?cohort=<id>, or of everyone.
+    """
+    if not _is_admin(request.user):
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    cohort = request.GET.get('cohort')
+    if cohort is not None:
+        if not cohort.isdigit() or not Cohort.objects.filter(pk=cohort).exists():
+            raise Http404("No such cohort.")
+        cohort = int(cohort)
+    response = JsonResponse(analytics.cohort_analytics(cohort))
+    response['Cache-Control'] = 'private, max-age=60'
+    return response
+
+
+# -------------------------
+# Reports
+# -------------------------
+def download_csv_report(request):
+    """
+    Allocation report, streamed row by row.
+    ?columns=roll_no,name,... picks columns, ?department=CSE (repeatable)
+    filters by department and ?format=xlsx returns an Excel workbook.
+    """
+    if not _is_admin(request.user):
+        return redirect('admin_login')
+
+    requested = [c for value in request.GET.getlist('columns') for c in value.split(',')]
+    columns = reports.select_columns(requested)
+    departments = [d for d in request.GET.getlist('department') if d]
+
+    if request.GET.get('format') == 'xlsx':
+        return FileResponse(
+            reports.write_xlsx(columns, departments),
+            as_attachment=True,
+            filename='allocation_report.xlsx',
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+
+    response = StreamingHttpResponse(reports.stream_csv(columns, departments), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="allocation_report.csv"'
+    return response
+
+
+# -------------------------
+# Student Import
+# -------------------------
+@require_POST
+def student_import(request):
+    """
+    Import the registrar's roll list (CSV upload) and show per-row errors.
+    Existing students are updated in place, matched on roll_no.
+    """
+    if not _is_admin(request.user):
+        return redirect('admin_login')
+
+    upload = request.FILES.get('roll_list')
+    if upload is None:
+        messages.error(request, "Please choose a CSV file to import.")
+        return redirect('admin_dashboard')
+
+    lines = io.TextIOWrapper(upload.file, encoding='utf-8-sig', errors='replace', newline='')
+    result = import_students(lines)
+    return render(request, 'import_result.html', {'result': result, 'filename': upload.name})
+
+
+# -------------------------
+# Metrics
+# -------------------------
+def metrics_view(request):
+    """
+    Allocation and view counters in the Prometheus text format (see
+    metrics.py). Open to admins, or to a scraper sending
+    "Authorization: Bearer <settings.METRICS_TOKEN>".
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    sent = request.headers.get('Authorization', '')
+    if not _is_admin(request.user) and not (token and hmac.compare_digest(sent, f'Bearer {token}')):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
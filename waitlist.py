@@ -0,0 +1,346 @@
+"""
+Waitlists and seat backfill.
+
+Every allocation run leaves a waitlist per course: the students who
+ranked the course above the seat they got (or who got nothing), were
+eligible for it and not excluded from it, i.e. who missed it because it
+was full. A waitlist is a min-heap of (merit position, student id,
+preference number), the merit position being the student's place in the
+run's preference order, so its top is the student the greedy would have
+seated next.
+
+Releasing a seat (release()) deletes the allocation row at once and
+queues a backfill batch (tasks.backfill_seats); releases made within
+BACKFILL_DELAY seconds of each other share one batch. The batch fills
+the seats its releases freed from the top of that course's heap, one
+O(log n) pop per seat. Seats free for another reason (a capacity
+increase, seats the run left empty) are left to the next run. A student who moves frees their old seat, which
+is filled the same way in turn. Entries of students who already hold a
+seat they prefer at least as much, or who released theirs, are dropped
+as they surface. Minor 1 and Minor 2 share branches, so nobody is moved
+into the branch they hold in the other phase. Seats no waitlisted student
+wants go to students without a seat, as a run's auto-allocation pass
+would: in merit order, each to the first course they are eligible for.
+
+Waitlists reflect the rules and preferences of the run they came from. A
+full re-run starts over from preferences and rebuilds them. A student
+who withdrew stays out of the phase in every later run (see engine.py)
+and is never seated by a backfill; a seat removed by an admin is only
+given back by the next run. A run of one cohort keeps its own waitlists,
+and a seat released by one of its students is backfilled within that
+cohort.
+"""
+import heapq
+import io
+import logging
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import dashboard_cache, engine
+from .eligibility import StudentColumns, compiled_rules
+from .history import pack
+from .models import CohortStudent, Student, SeatRelease, Waitlist
+
+
+logger = logging.getLogger(__name__)
+
+PHASES = {spec.name: spec for spec in (engine.MINOR1, engine.MINOR2, engine.OE)}
+SIBLING = {'minor1': engine.MINOR2, 'minor2': engine.MINOR1}
+
+# Current rank of a student without a preferred seat (auto-allocated or
+# none), and of one who released their seat and must not get another
+UNRANKED = int(np.iinfo(np.int32).max)
+RELEASED = 0
+
+# Seconds a backfill waits, so releases made together share one batch
+BACKFILL_DELAY = 5
+PENDING_KEY = 'allotment:backfill-pending:{phase}:{cohort}'
+
+
+# -------------------------
+# Building
+# -------------------------
+def _arrays(index, phase):
+    """Waitlist arrays of one history.PhaseRun, sorted by (course, position)."""
+    data, eligible = phase.data, phase.eligible
+    excluded = phase.excluded or {}
+    allocated = {alloc.student.id: alloc for alloc in phase.allocations}
+
+    course, position, student, priority = [], [], [], []
+    ranked, rank = [], []
+    for merit, student_id in enumerate(data.preference_order):
+        alloc = allocated.get(student_id)
+        current = UNRANKED if alloc is None or alloc.priority is None else alloc.priority
+        ranked.append(student_id)
+        rank.append(current)
+        for course_id, number in data.preferences.get(student_id, ()):
+            if number >= current:
+                break
+            course_obj = data.courses_by_id.get(course_id)
+            if (course_obj is None or not course_obj.capacity or course_id == excluded.get(student_id)
+                    or not eligible[course_id][index[student_id]]):
+                continue
+            course.append(course_id)
+            position.append(merit)
+            student.append(student_id)
+            priority.append(number)
+
+    order = np.lexsort((position, course))
+    ranked_order = np.argsort(ranked)
+    return {
+        'course': np.array(course, dtype=np.int64)[order],
+        'position': np.array(position, dtype=np.int32)[order],
+        'student': np.array(student, dtype=np.int64)[order],
+        'priority': np.array(priority, dtype=np.int32)[order],
+        'ranked_student': np.array(ranked, dtype=np.int64)[ranked_order],
+        'rank': np.array(rank, dtype=np.int32)[ranked_order],
+    }
+
+
+def _cohort_id(cohort):
+    return getattr(cohort, 'pk', cohort)
+
+
+def rebuild(students, phases, run=None):
+    """
+    Replace the waitlists of `phases` (history.PhaseRun tuples, all of one
+    cohort, or of everyone) after a run.
+    """
+    index = {s.id: i for i, s in enumerate(students)}
+    now = timezone.now()
+    with transaction.atomic():
+        for phase in phases:
+            cohort_id = _cohort_id(phase.data.cohort)
+            Waitlist.objects.update_or_create(phase=phase.spec.name, cohort_id=cohort_id, defaults={
+                'entries': pack(_arrays(index, phase)), 'run': run, 'built_at': now,
+            })
+            # The run itself has settled every release made before it
+            engine.in_cohort(SeatRelease.objects.all(), cohort_id, 'student__').filter(
+                phase=phase.spec.name, processed_at__isnull=True
+            ).update(processed_at=now)
+
+
+class _Heaps:
+    """Unpacked waitlist of one phase: a heap per course and each student's current rank."""
+
+    def __init__(self, blob):
+        with np.load(io.BytesIO(bytes(blob))) as arrays:
+            a = {name: arrays[name] for name in arrays.files}
+        # Entries are stored sorted, and a sorted list is already a heap
+        self.heaps = defaultdict(list)
+        for course_id, entry in zip(
+            a['course'].tolist(), zip(a['position'].tolist(), a['student'].tolist(), a['priority'].tolist())
+        ):
+            self.heaps[course_id].append(entry)
+        self.rank = dict(zip(a['ranked_student'].tolist(), a['rank'].tolist()))
+
+    def pop(self, course_id, blocked):
+        """
+        (student id, preference number) of the first waitlisted student
+        who still prefers `course_id` to their seat, or None. Students
+        holding the course in the sibling phase (`blocked`) are kept for
+        later.
+        """
+        heap = self.heaps.get(course_id)
+        skipped, found = [], None
+        while heap:
+            entry = heapq.heappop(heap)
+            _, student_id, priority = entry
+            if priority >= self.rank.get(student_id, UNRANKED):
+                continue
+            if blocked.get(student_id) == course_id:
+                skipped.append(entry)
+                continue
+            found = student_id, priority
+            break
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+        return found
+
+    def pack(self):
+        entries = sorted(
+            (course_id, *entry) for course_id, heap in self.heaps.items() for entry in heap
+        )
+        course, position, student, priority = list(zip(*entries)) or [()] * 4
+        ranked, rank = list(zip(*sorted(self.rank.items()))) or [()] * 2
+        return pack({
+            'course': np.array(course, dtype=np.int64),
+            'position': np.array(position, dtype=np.int32),
+            'student': np.array(student, dtype=np.int64),
+            'priority': np.array(priority, dtype=np.int32),
+            'ranked_student': np.array(ranked, dtype=np.int64),
+            'rank': np.array(rank, dtype=np.int32),
+        })
+
+
+# -------------------------
+# Releasing and backfilling
+# -------------------------
+def release(phase_name, student, reason, released_by=None):
+    """
+    Take away `student`'s seat in `phase_name` (SeatRelease.REASON_*) and
+    queue a backfill. Returns False when they had no seat.
+    """
+    spec = PHASES[phase_name]
+    with transaction.atomic():
+        allocation = spec.allocation_model.objects.select_for_update().filter(student=student).first()
+        if allocation is None:
+            return False
+        SeatRelease.objects.create(
+            phase=phase_name, student=student, reason=reason, released_by=released_by,
+            course_id=getattr(allocation, f'{spec.course_field}_id'),
+        )
+        allocation.delete()
+        cohort_id = CohortStudent.objects.filter(student=student).values_list('cohort_id', flat=True).first()
+        transaction.on_commit(lambda: dashboard_cache.invalidate_student(student.user_id))
+        transaction.on_commit(lambda: schedule_backfill(phase_name, cohort_id))
+    return True
+
+
+def schedule_backfill(phase_name, cohort_id=None):
+    """Queue a backfill batch for the phase (of the cohort), unless one is already waiting."""
+    from .tasks import backfill_seats
+
+    if cache.add(PENDING_KEY.format(phase=phase_name, cohort=cohort_id), True, timeout=BACKFILL_DELAY * 12):
+        backfill_seats.apply_async((phase_name, cohort_id), countdown=BACKFILL_DELAY)
+
+
+def _write(spec, moves, courses):
+    """Replace the allocation rows of every student in `moves`."""
+    final = {student_id: (course_id, priority) for student_id, _, course_id, priority in moves}
+    students = Student.objects.in_bulk(final)
+    model = spec.allocation_model
+
+    objects = []
+    for student_id, (course_id, priority) in final.items():
+        fields = {'student_id': student_id, f'{spec.course_field}_id': course_id}
+        if spec is engine.MINOR1 and priority is None:
+            fields['explanation'] = (
+                f"Auto-allocated Minor '{courses[course_id][0]}' after a seat was released, "
+                f"which no waitlisted student wanted. "
+                f"Student percentage: {students[student_id].percentage}."
+            )
+        elif spec is engine.MINOR1:
+            fields['explanation'] = (
+                f"Allocated Minor '{courses[course_id][0]}' from the waitlist using preference "
+                f"#{priority} after a seat was released. "
+                f"Student percentage: {students[student_id].percentage}."
+            )
+        objects.append(model(**fields))
+
+    model.objects.filter(student_id__in=final).delete()
+    model.objects.bulk_create(objects, batch_size=engine.BULK_BATCH_SIZE)
+    user_ids = [student.user_id for student in students.values()]
+    transaction.on_commit(lambda: [dashboard_cache.invalidate_student(u) for u in user_ids])
+
+
+def _auto_seats(spec, seats, current, heaps, blocked, courses, cohort_id):
+    """
+    Hand `seats` (course ids, one per free seat) to students without a seat
+    in the phase, like the auto pass of allocate_greedy: in merit order,
+    each to the first course with a free seat they are eligible for.
+    Withdrawn students and those who released their seat are skipped.
+    Returns the moves, with no old course and no preference number.
+    """
+    withdrawn = set(engine.in_cohort(SeatRelease.objects.all(), cohort_id, 'student__').filter(
+        phase=spec.name, reason=SeatRelease.REASON_WITHDRAWN,
+    ).values_list('student_id', flat=True))
+    candidates = [
+        s for s in engine.load_students(cohort_id)
+        if s.id not in current and s.id not in withdrawn and heaps.rank.get(s.id) != RELEASED
+    ]
+    if not candidates:
+        return []
+
+    free = Counter(seats)
+    order = [cid for cid in courses if free[cid]]
+    predicates = compiled_rules(spec.rule_model, spec.rule_course_field, order)
+    columns = StudentColumns(candidates)
+    eligible = {cid: predicates[cid].mask(columns).tolist() for cid in order}
+
+    moves, left = [], len(seats)
+    for i, student in enumerate(candidates):
+        if not left:
+            break
+        for course_id in order:
+            if free[course_id] and course_id != blocked.get(student.id) and eligible[course_id][i]:
+                free[course_id] -= 1
+                left -= 1
+                current[student.id] = course_id
+                moves.append((student.id, None, course_id, None))
+                break
+    return moves
+
+
+def backfill(phase_name, cohort_id=None):
+    """
+    Settle the pending releases of `phase_name` (of the cohort) and fill
+    the seats they freed from the waitlists, then by auto-allocation. Returns
+    [(student id, old course id or None, new course id, preference number
+    or None)] in the order the moves were made.
+    """
+    spec = PHASES[phase_name]
+
+    def scoped(model, path='student__'):
+        return engine.in_cohort(model.objects.all(), cohort_id, path)
+
+    with transaction.atomic():
+        waitlist = Waitlist.objects.select_for_update().filter(phase=phase_name, cohort_id=cohort_id).first()
+        pending = scoped(SeatRelease).filter(phase=phase_name, processed_at__isnull=True)
+        released = list(pending.values_list('pk', 'student_id', 'course_id'))
+        if waitlist is None:
+            pending.update(processed_at=timezone.now())
+            return []
+
+        heaps = _Heaps(waitlist.entries)
+        for _, student_id, _ in released:
+            heaps.rank[student_id] = RELEASED
+
+        course_field = f'{spec.course_field}_id'
+        current = dict(scoped(spec.allocation_model).values_list('student_id', course_field))
+        blocked = {}
+        if phase_name in SIBLING:
+            sibling = SIBLING[phase_name]
+            blocked = dict(scoped(sibling.allocation_model).values_list('student_id', f'{sibling.course_field}_id'))
+        courses = {cid: (name, capacity) for cid, name, capacity in
+                   scoped(spec.course_model, '').values_list('id', 'name', 'capacity')}
+
+        # The seats these releases freed that are still free (a course may
+        # have lost capacity since), not every unfilled seat of the phase
+        taken = Counter(current.values())
+        freed = Counter(course_id for _, _, course_id in released if course_id in courses)
+        free = [
+            cid for cid, count in sorted(freed.items())
+            for _ in range(min(count, courses[cid][1] - taken[cid]))
+        ]
+        moves, unwanted = [], []
+        while free:
+            course_id = free.pop()
+            found = heaps.pop(course_id, blocked)
+            if found is None:
+                unwanted.append(course_id)
+                continue
+            student_id, priority = found
+            old = current.get(student_id)
+            current[student_id] = course_id
+            heaps.rank[student_id] = priority
+            moves.append((student_id, old, course_id, priority))
+            if old is not None:
+                # Their old seat is free now
+                free.append(old)
+        if unwanted:
+            moves += _auto_seats(spec, unwanted, current, heaps, blocked, courses, cohort_id)
+
+        if moves:
+            _write(spec, moves, courses)
+        waitlist.entries = heaps.pack()
+        waitlist.save(update_fields=['entries', 'updated_at'])
+        SeatRelease.objects.filter(pk__in=[pk for pk, _, _ in released]).update(processed_at=timezone.now())
+
+    logger.info("Backfilled %s (cohort %s): %d release(s), %d move(s)",
+                phase_name, cohort_id, len(released), len(moves))
+    return moves
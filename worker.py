@@ -0,0 +1,82 @@
+"""
+Celery entry point for allocation and batch workers.
+
+    celery -A allotment.worker worker --concurrency 4
+
+The project's Celery app starts a worker the way it starts the web
+stack: full settings, and system checks run by Celery's Django fixup,
+whose URL check imports the URLconf and with it every view, the REST API
+and Django REST framework. A worker uses none of them. This app starts
+Django with allotment.worker_settings and skips the checks, so a worker
+loads Django, the models, the allocation engine and the tasks and little
+else.
+
+All of that is imported here, in the parent, before the prefork pool
+forks, so the children share one copy of it instead of each importing
+their own. Garbage collection is off while it loads, so no holes are
+freed between the objects the children will share, and then everything
+loaded is frozen (gc.freeze()): a collection in a child skips those
+objects instead of writing to them and copying their pages.
+
+Tasks are the same shared tasks (allotment.tasks) and the broker the same
+CELERY_* settings, so the web app queues them as before; start the
+workers from here instead of from the project. Commands that run
+allocations can use the same settings:
+
+    python manage.py run_cohorts --settings allotment.worker_settings
+
+benchmark_startup compares start-up time and per-worker memory with the
+project's app.
+"""
+import gc
+import os
+from importlib import import_module
+
+gc.disable()
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'allotment.worker_settings')
+os.environ.setdefault('CELERY_SKIP_CHECKS', '1')
+
+import django  # noqa: E402
+from celery import Celery  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.utils.module_loading import import_string  # noqa: E402
+
+
+# Everything a task needs; the models come with django.setup()
+PRELOAD = (
+    'allotment.engine',
+    'allotment.strategies',
+    'allotment.history',
+    'allotment.waitlist',
+    'allotment.utils',
+    'allotment.cohorts',
+    'allotment.outbox',
+    'allotment.tasks',
+)
+
+# Imported inside the strategy (see strategies.py); preloaded when it is
+# the default, since every run then needs them
+STRATEGY_PRELOAD = {
+    'optimal': ('scipy.optimize', 'scipy.sparse'),
+}
+
+
+def preload():
+    """Import what the children share, then freeze it."""
+    from . import strategies
+
+    for name in PRELOAD + STRATEGY_PRELOAD.get(strategies.strategy_name(), ()):
+        import_module(name)
+    import_string(settings.EMAIL_BACKEND)
+
+    gc.freeze()
+    gc.enable()
+
+
+django.setup()
+
+app = Celery('smartallot')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+
+preload()
@@ -0,0 +1,25 @@
+"""
+Settings for Celery workers and batch commands (see worker.py).
+
+The project settings without what only serves HTTP requests: the
+messages, static files and REST framework apps and the middleware. The
+admin stays installed as SimpleAdminConfig, which skips admin
+autodiscovery but keeps the LogEntry model, so deleting a user here
+still deletes their admin log entries.
+"""
+from smartallot.settings import *  # noqa: F401,F403
+
+
+WEB_ONLY_APPS = (
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'rest_framework',
+)
+
+INSTALLED_APPS = [
+    'django.contrib.admin.apps.SimpleAdminConfig' if app == 'django.contrib.admin' else app
+    for app in INSTALLED_APPS  # noqa: F405
+    if app not in WEB_ONLY_APPS
+]
+
+MIDDLEWARE = []